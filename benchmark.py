@@ -0,0 +1,71 @@
+import argparse
+import os
+import time
+
+import pytesseract
+
+from src.benchmark.memory_profiler import MemoryProfiler
+from src.benchmark.receipt_benchmark import ReceiptBenchmark
+from src.props.application_properties_builder import ApplicationPropertiesBuilder
+from src.props.application_properties_service import ApplicationPropertiesService
+from src.receipt_processors.receipt_service import ReceiptService
+from src.storage.stage_cache import StageCache
+from src.tracer import Tracer, JsonlTraceSink, ChromeTraceSink
+
+if os.name == 'nt':
+    pytesseract.pytesseract.tesseract_cmd = 'C:\\Program Files\\Tesseract-OCR\\tesseract.exe'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks receipt mining over the stored receipt images.')
+    parser.add_argument('--limit', type=int, default=None, help='number of receipts to process')
+    parser.add_argument('--single-pass', action='store_true', help='use single-pass full receipt OCR mode')
+    parser.add_argument('--numeric-second-pass', action='store_true',
+                        help='read numeric columns again with digit whitelist (single-pass mode)')
+    parser.add_argument('--receipts-dir', default=os.path.join('logs', 'receipts'))
+    parser.add_argument('--output-dir', default=os.path.join('logs', 'benchmarks'))
+    parser.add_argument('--trace-jsonl', default=None, help='file to write the spans and events as JSON lines')
+    parser.add_argument('--chrome-trace', default=None, help='file to write the spans in Chrome trace format')
+    parser.add_argument('--pixel-budget', action='store_true',
+                        help='send crops trimmed, rescaled to the target text height and binarized to OCR')
+    parser.add_argument('--memory', action='store_true', help='record tracemalloc allocations per stage and peak/RSS per receipt')
+    parser.add_argument('--memory-snapshots', action='store_true', help='also record top allocation sites of each stage (slow)')
+    parser.add_argument('--stage-cache', default=None,
+                        help='stage cache file (split geometry, OCR results are memoized, e.g. to compare properties)')
+    args = parser.parse_args()
+
+    application_properties = ApplicationPropertiesBuilder.prepare_application_properties_v_core_1_logic_0_depend_1(is_debug_on=False)
+    application_properties.pixel_budget_properties.is_pixel_budget_on = args.pixel_budget
+    ApplicationPropertiesService.load_properties(application_properties)
+    ocr_mode = ReceiptService.OCR_MODE_SINGLE_PASS if args.single_pass else ReceiptService.OCR_MODE_CROP_PER_FIELD
+    stage_cache = StageCache(args.stage_cache) if args.stage_cache is not None else None
+    receipt_service = ReceiptService(ocr_mode=ocr_mode, is_numeric_second_pass_on=args.numeric_second_pass,
+                                     stage_cache=stage_cache)
+
+    if args.trace_jsonl is not None:
+        Tracer.add_sink(JsonlTraceSink(args.trace_jsonl))
+    if args.chrome_trace is not None:
+        Tracer.add_sink(ChromeTraceSink(args.chrome_trace))
+    memory_profiler = None
+    if args.memory or args.memory_snapshots:
+        memory_profiler = MemoryProfiler(is_snapshot_per_stage_on=args.memory_snapshots).start()
+
+    corpus = ReceiptBenchmark.load_corpus(args.receipts_dir, limit=args.limit)
+    benchmark = ReceiptBenchmark()
+    start_time = time.perf_counter()
+    records = benchmark.run(receipt_service, corpus)
+    wall_time = time.perf_counter() - start_time
+    Tracer.close_sinks()
+
+    summary = ReceiptBenchmark.summarize(records, wall_time)
+    ReceiptBenchmark.print_summary(summary)
+    results_file = ReceiptBenchmark.export_results(records, summary, receipt_service, args.output_dir,
+                                                  trace_totals=benchmark.run_aggregator.to_dict(),
+                                                  memory=memory_profiler.to_dict() if memory_profiler else None)
+    print(f'Results: {results_file}')
+    if stage_cache is not None:
+        print(f'Stage cache: {stage_cache.get_stats()}')
+
+
+if __name__ == '__main__':
+    main()
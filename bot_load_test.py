@@ -0,0 +1,78 @@
+import argparse
+import os
+import tempfile
+
+import pytesseract
+
+from src.benchmark.ekassa_stub_server import EkassaStubServer
+from src.benchmark.receipt_benchmark import ReceiptBenchmark
+from src.receipt_processors.receipt_util import ReceiptUtil
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Sends synthetic Telegram updates with QR code photos of the stored receipts to the bot handlers '
+                    '(fake bot, local E-kassa stub) by concurrent simulated users and reports latency, '
+                    'event loop blocking and throughput.')
+    parser.add_argument('--concurrency', default='1,2,4', help='simulated users, or a comma separated list of levels')
+    parser.add_argument('--messages', type=int, default=None, help='messages per level (default: 5 per user)')
+    parser.add_argument('--think-time', type=float, default=0.0, help='seconds a user waits before the next photo')
+    parser.add_argument('--download-latency', type=float, default=0.1, help='seconds of the Telegram photo download')
+    parser.add_argument('--limit', type=int, default=None, help='number of fiscal codes sent in turn')
+    parser.add_argument('--warm-cache', action='store_true',
+                        help='use the receipt cache of the bot (RECEIPT_CACHE_PATH) and keep it between levels')
+    parser.add_argument('--receipts-dir', default=os.path.join('logs', 'receipts'))
+    parser.add_argument('--output-dir', default=os.path.join('logs', 'bot_load'))
+    parser.add_argument('--ekassa-url', default=None, help='base URL of a running E-kassa stub (see ekassa_stub.py)')
+    parser.add_argument('--stub-latency', type=float, default=0.2, help='seconds added to each stub request')
+    parser.add_argument('--stub-latency-jitter', type=float, default=0.1)
+    parser.add_argument('--stub-error-rate', type=float, default=0.0, help='share of stub requests failing with 500')
+    args = parser.parse_args()
+
+    if not args.warm_cache:
+        os.environ['RECEIPT_CACHE_PATH'] = os.path.join(tempfile.mkdtemp(), 'receipts.sqlite3')
+    # The bot module creates its receipt cache and metrics on import
+    import check_yighan_bot
+    from src.benchmark.bot_load_harness import BotLoadHarness
+    if os.name != 'nt' and not os.getenv('DYNO'):
+        pytesseract.pytesseract.tesseract_cmd = 'tesseract'
+
+    stub_server = None
+    if args.ekassa_url is None:
+        stub_server = EkassaStubServer(args.receipts_dir, latency=args.stub_latency, latency_jitter=args.stub_latency_jitter,
+                                       error_rate=args.stub_error_rate, seed=0)
+        ReceiptUtil.EKASSA_BASE_URL = stub_server.start()
+    else:
+        ReceiptUtil.EKASSA_BASE_URL = args.ekassa_url.rstrip('/')
+    print(f'E-kassa: {ReceiptUtil.EKASSA_BASE_URL}')
+
+    fiscal_codes = [fiscal_code for fiscal_code, _ in ReceiptBenchmark.load_corpus(args.receipts_dir, limit=args.limit)]
+    summaries = []
+    try:
+        for concurrency in [int(level) for level in args.concurrency.split(',')]:
+            if not args.warm_cache:
+                check_yighan_bot.receipt_cache.invalidate()
+            harness = BotLoadHarness(check_yighan_bot.prepare_application,
+                                     photos_folder=os.path.join(args.output_dir, 'photos'), concurrency=concurrency,
+                                     think_time=args.think_time, download_latency=args.download_latency,
+                                     errors_counter=check_yighan_bot.errors_counter)
+            report = harness.run(fiscal_codes, args.messages if args.messages is not None else 5 * concurrency)
+            print(f'<< {concurrency} users >>')
+            BotLoadHarness.print_report(report)
+            results_file = harness.export_results(report, args.output_dir, {'ekassa_base_url': ReceiptUtil.EKASSA_BASE_URL,
+                                                                             'is_cache_warm': args.warm_cache})
+            print(f'Results: {results_file}')
+            summaries.append((concurrency, report))
+    finally:
+        if stub_server is not None:
+            stub_server.stop()
+
+    print(f'{"users":>5} {"messages/s":>11} {"p50":>8} {"p95":>8} {"blocked":>8}')
+    for concurrency, report in summaries:
+        latency = report['latency'] or {'p50': 0.0, 'p95': 0.0}
+        print(f'{concurrency:>5} {report["throughput"]:>11.2f} {latency["p50"]:>7.2f}s {latency["p95"]:>7.2f}s '
+              f'{report["event_loop"]["blocked_share"]:>8.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
+import asyncio
+import time
 import traceback
 
 from dotenv import load_dotenv
@@ -10,6 +12,13 @@ import io
 from src.props.application_properties_builder import ApplicationPropertiesBuilder
 from src.props.application_properties_service import ApplicationPropertiesService
 from src.receipt_processors.receipt_service import ReceiptService
+from src.receipt_processors.receipt_util import ReceiptUtil
+from src.ekassa_rate_limiter import EkassaRateLimiter
+from src.in_flight_registry import InFlightRegistry
+from src.metrics import MetricsRegistry, MetricsTraceSink
+from src.mining_scheduler import MiningScheduler
+from src.storage.receipt_cache import ReceiptCache
+from src.tracer import Tracer
 import pytesseract
 
 # pytesseract.pytesseract.tesseract_cmd = 'C:\\Program Files\\Tesseract-OCR\\tesseract.exe'
@@ -20,8 +29,64 @@ else:
     # Local environment
     pytesseract.pytesseract.tesseract_cmd = 'C:\\Program Files\\Tesseract-OCR\\tesseract.exe'
 
+# Loaded once: the properties and the logger are shared by the mining threads
+# (the receipt being mined is kept per thread by ApplicationPropertiesService)
+ApplicationPropertiesService.load_properties(
+    ApplicationPropertiesBuilder.prepare_application_properties_v_core_1_logic_0_depend_1(is_debug_on=True))
+receipt_cache = ReceiptCache(os.getenv('RECEIPT_CACHE_PATH', os.path.join('logs', 'cache', 'receipts.sqlite3')))
+
+# Metrics exposed in Prometheus text format on http://{METRICS_HOST}:{METRICS_PORT}/metrics
+metrics_registry = MetricsRegistry()
+requests_counter = metrics_registry.counter('bot_requests_total', 'Updates handled by the bot', ['handler'])
+errors_counter = metrics_registry.counter('bot_errors_total', 'Errors by stage and exception class', ['stage', 'error'])
+qr_decode_histogram = metrics_registry.histogram('bot_qr_decode_duration_seconds', 'QR code decoding time')
+mining_histogram = metrics_registry.histogram('bot_mining_duration_seconds', 'Receipt mining latency (E-kassa fetch and mining queue wait included)')
+in_flight_gauge = metrics_registry.gauge('bot_in_flight_jobs', 'Receipts being mined or waiting for a mining worker')
+queue_depth_gauge = metrics_registry.gauge('bot_update_queue_depth', 'Updates waiting in the bot update queue')
+keyword_cache_counter = metrics_registry.function_counter('keyword_cache_lookups_total', 'Lookups of the OCR keyword set cache',
+                                                         ['result'])
+keyword_cache_counter.set_function(lambda: ReceiptUtil._prepare_keyword_set.cache_info().hits, result='hit')
+keyword_cache_counter.set_function(lambda: ReceiptUtil._prepare_keyword_set.cache_info().misses, result='miss')
+receipt_cache_counter = metrics_registry.function_counter('receipt_cache_lookups_total', 'Lookups of the mined receipt cache',
+                                                         ['result'])
+receipt_cache_counter.set_function(lambda: receipt_cache.hits, result='hit')
+receipt_cache_counter.set_function(lambda: receipt_cache.misses, result='miss')
+ekassa_requests_counter = metrics_registry.function_counter('ekassa_rate_limiter_requests_total',
+                                                           'E-kassa requests sent and queued by the rate limiter',
+                                                           ['priority', 'state'])
+for priority_name in EkassaRateLimiter.PRIORITY_NAMES.values():
+    for state in ['sent', 'queued']:
+        ekassa_requests_counter.set_function(lambda priority_name=priority_name, state=state:
+                                             ReceiptUtil.ekassa_rate_limiter.get_stats()[priority_name][state],
+                                             priority=priority_name, state=state)
+ekassa_rate_gauge = metrics_registry.gauge('ekassa_rate_limiter_rate', 'Current E-kassa request rate limit (after slowdowns)')
+ekassa_rate_gauge.set_function(lambda: ReceiptUtil.ekassa_rate_limiter.get_stats()['rate'] or 0)
+Tracer.add_sink(MetricsTraceSink(metrics_registry))
+
+# Mining runs on the scheduler threads, so the event loop keeps serving other users meanwhile
+mining_queue_wait_histogram = metrics_registry.histogram('bot_mining_queue_wait_seconds', 'Wait of the mining jobs for a worker',
+                                                         ['priority'])
+mining_scheduler = MiningScheduler(workers=int(os.getenv('MINING_WORKERS', '2')),
+                                   max_batch_in_flight=int(os.getenv('MINING_MAX_BATCH_IN_FLIGHT', '1')),
+                                   wait_histogram=mining_queue_wait_histogram)
+mining_jobs_gauge = metrics_registry.gauge('bot_mining_jobs', 'Mining jobs queued and in flight on the scheduler', ['priority', 'state'])
+for priority_name in MiningScheduler.PRIORITY_NAMES.values():
+    for state in ['queued', 'in_flight']:
+        mining_jobs_gauge.set_function(lambda priority_name=priority_name, state=state:
+                                       mining_scheduler.get_stats()[priority_name][state],
+                                       priority=priority_name, state=state)
+
+# Concurrent requests for the same fiscal code share one mining job
+mining_in_flight_registry = InFlightRegistry()
+mining_requests_counter = metrics_registry.function_counter('bot_mining_requests_total',
+                                                           'Mining requests starting a job or joining the job in progress',
+                                                           ['result'])
+for result in ['started', 'joined']:
+    mining_requests_counter.set_function(lambda result=result: mining_in_flight_registry.get_stats()[result], result=result)
+
 # Function to start the bot
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    requests_counter.inc(handler='start')
     await update.message.reply_text("<b>ÇekYığan işləyir!</b>", parse_mode="HTML")
     await update.message.reply_text("<i>Qəbzdəki QR kod hissəsinin şəklini göndərin.</i>", parse_mode="HTML")
 
@@ -29,6 +94,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # Function to handle incoming QR code images
 async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    requests_counter.inc(handler='image')
     if not update.message.photo:
         await update.message.reply_text("Şəkil yüklənilmədi. Təkrar sınayın, zəhmət olmasa.")
         return
@@ -51,33 +117,56 @@ async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
         image = enhanced_image
 
         # Decode the QR code
-        decoded_objects = decode(image)
+        with qr_decode_histogram.time():
+            decoded_objects = decode(image)
 
         if decoded_objects:
             for obj in decoded_objects:
                 decoded_text = obj.data.decode('utf-8')
                 await update.message.reply_text(f"QR kodun məzmunu: {decoded_text}")
-                application_properties = ApplicationPropertiesBuilder.prepare_application_properties_v_core_1_logic_0_depend_1(is_debug_on=True)
-                ApplicationPropertiesService.load_properties(application_properties)
-                receipt_service = ReceiptService()
+                receipt_service = ReceiptService(receipt_cache=receipt_cache, ekassa_priority=EkassaRateLimiter.PRIORITY_INTERACTIVE)
+                in_flight_gauge.inc()
+                start_time = time.perf_counter()
                 try:
                     fiscal_code = decoded_text.split('=')[-1]
-                    receipt = receipt_service.mine_receipt(fiscal_code=fiscal_code)
+                    mining_future, _ = mining_in_flight_registry.get_or_start(fiscal_code, lambda: mining_scheduler.submit(
+                        receipt_service, MiningScheduler.PRIORITY_INTERACTIVE, user_id=update.effective_user.id,
+                        fiscal_code=fiscal_code))
+                    # Shielded: a cancelled handler must not cancel the job shared with other requests
+                    receipt = await asyncio.shield(asyncio.wrap_future(mining_future))
                     receipt._fiscal_code = fiscal_code
                 except Exception as e:
+                    errors_counter.inc(stage='mining', error=type(e).__name__)
                     print(f"Error occured: {e}")
                     await update.message.reply_text(f"Qəbzin oxunması baş vermədi: {e}.")
                     traceback.print_exc()
                 else:
                     print(receipt.__str__())
-                await update.message.reply_text(receipt.__str__())
+                    await update.message.reply_text(receipt.__str__())
+                finally:
+                    mining_histogram.observe(time.perf_counter() - start_time)
+                    in_flight_gauge.dec()
 
         else:
+            errors_counter.inc(stage='qr_decode', error='QRCodeNotFound')
             await update.message.reply_text("QR kod oxunmur!")
     except Exception as e:
+        errors_counter.inc(stage='handler', error=type(e).__name__)
         await update.message.reply_text(f"Qeyri-müəyyən səbəbdən proqram işləmir.: {str(e)}")
     await start(update, context)
 
+# Builds the application with the handlers (also used by the load-test harness with a fake bot)
+def prepare_application(application_builder):
+    # Updates are handled concurrently, the mining scheduler limits the mining work
+    application = application_builder.concurrent_updates(True).build()
+
+    # Command handlers
+    application.add_handler(CommandHandler("start", start))
+
+    # Message handler for images
+    application.add_handler(MessageHandler(filters.PHOTO, handle_image))
+    return application
+
 # Main function to set up the bot
 def main():
     # Replace 'YOUR_TOKEN_HERE' with your Telegram bot token
@@ -88,13 +177,12 @@ def main():
         print("Error: API_KEY environment variable is not set.")
         return
 
-    application = Application.builder().token(bot_token).build()
-
-    # Command handlers
-    application.add_handler(CommandHandler("start", start))
+    application = prepare_application(Application.builder().token(bot_token))
 
-    # Message handler for images
-    application.add_handler(MessageHandler(filters.PHOTO, handle_image))
+    queue_depth_gauge.set_function(application.update_queue.qsize)
+    metrics_port = int(os.getenv('METRICS_PORT', '9108'))
+    metrics_registry.start_http_server(metrics_port, host=os.getenv('METRICS_HOST', '127.0.0.1'))
+    print(f"Metrics: http://{os.getenv('METRICS_HOST', '127.0.0.1')}:{metrics_port}/metrics")
 
     # Start the bot
     application.run_polling()
@@ -0,0 +1,38 @@
+import argparse
+import os
+
+from src.benchmark.ekassa_stub_server import EkassaStubServer
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serves the stored receipt images as a local stand-in of the E-kassa monitoring service '
+                    '(run main.py or the bot with EKASSA_BASE_URL=http://HOST:PORT).')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--receipts-dir', default=os.path.join('logs', 'receipts'))
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each request')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='maximum random seconds added to the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failing with 500')
+    parser.add_argument('--max-rps', type=float, default=None, help='requests per second above which 429 is returned')
+    parser.add_argument('--burst', type=float, default=None, help='requests allowed at once above the rate (default: max-rps)')
+    parser.add_argument('--max-concurrency', type=int, default=None, help='requests in progress above which 503 is returned')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    stub_server = EkassaStubServer(args.receipts_dir, host=args.host, port=args.port, latency=args.latency,
+                                   latency_jitter=args.latency_jitter, error_rate=args.error_rate,
+                                   max_requests_per_second=args.max_rps, burst=args.burst,
+                                   max_concurrency=args.max_concurrency, seed=args.seed)
+    print(f'E-kassa stub: {stub_server.base_url}')
+    try:
+        stub_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub_server.stop()
+        print(f'Requests: {stub_server.get_stats()}')
+
+
+if __name__ == '__main__':
+    main()
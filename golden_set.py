@@ -0,0 +1,59 @@
+import argparse
+import os
+import sys
+
+import pytesseract
+
+from src.benchmark.golden_set_harness import GoldenSetHarness
+from src.benchmark.receipt_accuracy import ReceiptAccuracy
+from src.receipt_processors.receipt_service import ReceiptService
+
+if os.name == 'nt':
+    pytesseract.pytesseract.tesseract_cmd = 'C:\\Program Files\\Tesseract-OCR\\tesseract.exe'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Runs the pipeline over the golden set (receipt images with reference .log files) in parallel '
+                    'and compares accuracy, latency and OCR calls with the baseline run.')
+    parser.add_argument('--limit', type=int, default=None, help='number of receipts to process')
+    parser.add_argument('--single-pass', action='store_true', help='use single-pass full receipt OCR mode')
+    parser.add_argument('--numeric-second-pass', action='store_true',
+                        help='read numeric columns again with digit whitelist (single-pass mode)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: CPU count - 1)')
+    parser.add_argument('--receipts-dir', default=os.path.join('logs', 'receipts'))
+    parser.add_argument('--references-dir', default=ReceiptAccuracy.REFERENCES_FOLDER,
+                        help='hand-checked receipt_*.log references (never written by the pipeline)')
+    parser.add_argument('--copy-references', action='store_true',
+                        help='copy the receipt logs of --receipts-dir having no reference yet into --references-dir and exit')
+    parser.add_argument('--output-dir', default=os.path.join('logs', 'golden'))
+    parser.add_argument('--baseline', default=os.path.join('logs', 'golden', 'baseline.json'))
+    parser.add_argument('--update-baseline', action='store_true', help='save this run as the baseline if it is not rejected')
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.0, help='allowed drop of the mean field accuracy')
+    parser.add_argument('--max-regressed-receipts', type=int, default=None,
+                        help='allowed number of receipts getting a field wrong (not checked by default)')
+    args = parser.parse_args()
+
+    if args.copy_references:
+        copied_fiscal_codes = ReceiptAccuracy.copy_references(args.receipts_dir, args.references_dir)
+        print(f'Copied {len(copied_fiscal_codes)} references to {args.references_dir} (check and correct them by hand)')
+        return
+
+    corpus = ReceiptAccuracy.load_corpus(args.receipts_dir, args.references_dir, limit=args.limit)
+    ocr_mode = ReceiptService.OCR_MODE_SINGLE_PASS if args.single_pass else ReceiptService.OCR_MODE_CROP_PER_FIELD
+    harness = GoldenSetHarness(ocr_mode=ocr_mode, is_numeric_second_pass_on=args.numeric_second_pass, workers=args.workers,
+                               max_accuracy_drop=args.max_accuracy_drop, max_regressed_receipts=args.max_regressed_receipts)
+    result = harness.run(corpus)
+    comparison = harness.compare(result, GoldenSetHarness.load_baseline(args.baseline))
+    GoldenSetHarness.print_report(result, comparison)
+    print(f'Results: {GoldenSetHarness.export_results(result, comparison, args.output_dir)}')
+
+    if comparison['verdict'] == GoldenSetHarness.VERDICT_REJECTED:
+        sys.exit(1)
+    if args.update_baseline:
+        GoldenSetHarness.save_baseline(result, args.baseline)
+        print(f'Baseline: {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
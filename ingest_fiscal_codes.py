@@ -0,0 +1,30 @@
+import argparse
+import os
+import sys
+
+from src.storage.fiscal_code_index import FiscalCodeIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Streams fiscal codes or E-kassa links (files or stdin) into the fiscal code index, '
+                    'dropping duplicates, truncated codes and the codes ingested before.')
+    parser.add_argument('paths', nargs='*', default=['-'], help="code or link files ('-' is stdin, the default)")
+    parser.add_argument('--index', default=os.path.join('logs', 'fiscal_codes', 'index.sqlite3'))
+    parser.add_argument('--batch-size', type=int, default=10000, help='lines per transaction')
+    parser.add_argument('--print-pending', action='store_true', help='print the codes not processed yet to stdout')
+    args = parser.parse_args()
+
+    fiscal_code_index = FiscalCodeIndex(args.index, batch_size=args.batch_size)
+    for path in args.paths:
+        counts = fiscal_code_index.ingest(FiscalCodeIndex.read_lines([path]), source='stdin' if path == '-' else path)
+        print(f'{path}: {counts}', file=sys.stderr)
+    print(f'Index: {fiscal_code_index.get_stats()}', file=sys.stderr)
+    if args.print_pending:
+        for fiscal_code in fiscal_code_index.iterate(FiscalCodeIndex.STATUS_PENDING):
+            print(fiscal_code)
+    fiscal_code_index.close()
+
+
+if __name__ == '__main__':
+    main()
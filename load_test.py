@@ -0,0 +1,76 @@
+import argparse
+import os
+
+import pytesseract
+
+from src.benchmark.ekassa_stub_server import EkassaStubServer
+from src.benchmark.load_generator import LoadGenerator
+from src.benchmark.receipt_benchmark import ReceiptBenchmark
+from src.ekassa_rate_limiter import EkassaRateLimiter
+from src.props.application_properties_builder import ApplicationPropertiesBuilder
+from src.props.application_properties_service import ApplicationPropertiesService
+from src.receipt_processors.receipt_service import ReceiptService
+from src.receipt_processors.receipt_util import ReceiptUtil
+
+if os.name == 'nt':
+    pytesseract.pytesseract.tesseract_cmd = 'C:\\Program Files\\Tesseract-OCR\\tesseract.exe'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Drives the E-kassa fetch or the whole pipeline at a target rate against a local E-kassa stub '
+                    '(started here unless --ekassa-url is given) and reports throughput and latency.')
+    parser.add_argument('--mode', choices=[LoadGenerator.MODE_FETCH, LoadGenerator.MODE_PIPELINE], default=LoadGenerator.MODE_FETCH)
+    parser.add_argument('--rate', type=float, default=5.0, help='target requests per second')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of load')
+    parser.add_argument('--requests', type=int, default=None, help='number of requests (instead of duration)')
+    parser.add_argument('--concurrency', type=int, default=4, help='requests in progress at most')
+    parser.add_argument('--limit', type=int, default=None, help='number of fiscal codes requested in turn')
+    parser.add_argument('--single-pass', action='store_true', help='use single-pass full receipt OCR mode (pipeline mode)')
+    parser.add_argument('--receipts-dir', default=os.path.join('logs', 'receipts'))
+    parser.add_argument('--output-dir', default=os.path.join('logs', 'load'))
+    parser.add_argument('--client-max-rps', type=float, default=None,
+                        help='E-kassa rate limiter of the client (default: no limit, so the offered rate reaches the stub)')
+    parser.add_argument('--ekassa-url', default=None, help='base URL of a running E-kassa stub (see ekassa_stub.py)')
+    parser.add_argument('--stub-latency', type=float, default=0.2, help='seconds added to each stub request')
+    parser.add_argument('--stub-latency-jitter', type=float, default=0.1)
+    parser.add_argument('--stub-error-rate', type=float, default=0.0, help='share of stub requests failing with 500')
+    parser.add_argument('--stub-max-rps', type=float, default=None, help='stub requests per second above which 429 is returned')
+    parser.add_argument('--stub-max-concurrency', type=int, default=None, help='stub requests in progress above which 503 is returned')
+    args = parser.parse_args()
+
+    stub_server = None
+    if args.ekassa_url is None:
+        stub_server = EkassaStubServer(args.receipts_dir, latency=args.stub_latency, latency_jitter=args.stub_latency_jitter,
+                                       error_rate=args.stub_error_rate, max_requests_per_second=args.stub_max_rps,
+                                       max_concurrency=args.stub_max_concurrency, seed=0)
+        ReceiptUtil.EKASSA_BASE_URL = stub_server.start()
+    else:
+        ReceiptUtil.EKASSA_BASE_URL = args.ekassa_url.rstrip('/')
+    print(f'E-kassa: {ReceiptUtil.EKASSA_BASE_URL}')
+    ReceiptUtil.ekassa_rate_limiter = EkassaRateLimiter(max_rate=args.client_max_rps)
+
+    receipt_service = None
+    if args.mode == LoadGenerator.MODE_PIPELINE:
+        application_properties = ApplicationPropertiesBuilder.prepare_application_properties_v_core_1_logic_0_depend_1(is_debug_on=False)
+        ApplicationPropertiesService.load_properties(application_properties)
+        ocr_mode = ReceiptService.OCR_MODE_SINGLE_PASS if args.single_pass else ReceiptService.OCR_MODE_CROP_PER_FIELD
+        receipt_service = ReceiptService(ocr_mode=ocr_mode)
+
+    fiscal_codes = [fiscal_code for fiscal_code, _ in ReceiptBenchmark.load_corpus(args.receipts_dir, limit=args.limit)]
+    load_generator = LoadGenerator(receipt_service, mode=args.mode, concurrency=args.concurrency)
+    try:
+        report = load_generator.run(fiscal_codes, args.rate, duration=args.duration, request_count=args.requests)
+    finally:
+        if stub_server is not None:
+            stub_server.stop()
+    stub_stats = stub_server.get_stats() if stub_server is not None else None
+    LoadGenerator.print_report(report)
+    if stub_stats is not None:
+        print(f'Stub: {stub_stats}')
+    print(f'Client rate limiter: {ReceiptUtil.ekassa_rate_limiter.get_stats()}')
+    print(f'Results: {load_generator.export_results(report, args.output_dir, stub_stats)}')
+
+
+if __name__ == '__main__':
+    main()
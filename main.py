@@ -9,6 +9,12 @@ from src.props.application_properties_service import ApplicationPropertiesServic
 from src.receipt_processors.receipt_service import ReceiptService
 from src.receipt_processors.receipt_util import ReceiptUtil
 from src.props.application_properties_builder import ApplicationPropertiesBuilder
+from src.storage.batch_journal import BatchJournal
+from src.storage.fiscal_code_index import FiscalCodeIndex
+from src.storage.receipt_analytics import ReceiptAnalytics
+from src.storage.receipt_cache import ReceiptCache
+from src.storage.receipt_warehouse import ReceiptWarehouse
+from src.storage.stage_cache import StageCache
 
 pytesseract.pytesseract.tesseract_cmd = 'C:\\Program Files\\Tesseract-OCR\\tesseract.exe'
 
@@ -16,10 +22,16 @@ pytesseract.pytesseract.tesseract_cmd = 'C:\\Program Files\\Tesseract-OCR\\tesse
 def main():
     application_properties = ApplicationPropertiesBuilder.prepare_application_properties_v_core_1_logic_0_depend_1(is_debug_on = True)
     ApplicationPropertiesService.load_properties(application_properties)
-    receipt_service = ReceiptService()
+    # Receipts already mined with the same properties and pipeline source are taken from the cache;
+    # after a change of properties, only the split/OCR results depending on the changed ones are recomputed
+    receipt_service = ReceiptService(receipt_cache=ReceiptCache(), stage_cache=StageCache())
 
-    with open(os.path.join('src','fiscal_codes_for_testing', 'ekassa_fiscal_codes.txt'), mode = 'r') as file:
-        fiscal_codes = file.readlines()
+    # Codes (or E-kassa links) are streamed into the index, which drops duplicates and truncated codes
+    fiscal_code_index = FiscalCodeIndex()
+    fiscal_codes_file = os.path.join('src','fiscal_codes_for_testing', 'ekassa_fiscal_codes.txt')
+    print(f'Fiscal codes: {fiscal_code_index.ingest(FiscalCodeIndex.read_lines([fiscal_codes_file]), source = fiscal_codes_file)}')
+    # Iterated lazily (a page of codes at a time), so the codes are never held in memory
+    fiscal_codes = fiscal_code_index.iterate()
 
     # fiscal_codes = fiscal_codes[4:7]
     fiscal_codes_with_watermark = [
@@ -35,39 +47,52 @@ def main():
     ]
 
     # fiscal_codes = fiscal_codes_with_error
-    fiscal_codes = [fiscal_code.strip() for fiscal_code in fiscal_codes]
-    fiscal_codes = list(set(fiscal_codes))
-    fiscal_codes.sort()
 
-    fiscal_codes_with_error, errors, error_tracebacks = [], [], []
+    # Finished fiscal codes are journaled, so a restarted run continues where it stopped
+    # and retries the failed ones (at most max_attempts times); remove the journal to start over
+    batch_journal = BatchJournal(os.path.join('logs', 'batches', 'main_batch.jsonl'), max_attempts = 3)
+    print(f'{batch_journal.get_stats()["completed"]} of {fiscal_code_index.get_stats()["codes"]} fiscal codes are already processed')
     receipt_images_folder = os.path.join('logs', 'receipts')
     downloaded_receipt_images = os.listdir(receipt_images_folder)
-    receipts_dict = {}
-    for i in range(len(fiscal_codes)):
-        fiscal_code = fiscal_codes[i]
+    for i, fiscal_code in enumerate(batch_journal.get_pending(fiscal_codes)):
         print(f'{i+1}. {fiscal_code}')
-        image_name = LowLevelReceiptMinerLogger.sanitize_string(f"receipt_{fiscal_code}.jpg")
-        if image_name not in downloaded_receipt_images:
-            image_ekassa_gray = ReceiptUtil.read_image_from_ekassa(fiscal_code)
-            image_file = os.path.join(receipt_images_folder, image_name)
-            cv2.imwrite(image_file, image_ekassa_gray)
-        image_ekassa_gray = cv2.imread(os.path.join(receipt_images_folder, image_name), cv2.IMREAD_GRAYSCALE)
-
+        batch_journal.mark_started(fiscal_code)
         try:
+            image_name = LowLevelReceiptMinerLogger.sanitize_string(f"receipt_{fiscal_code}.jpg")
+            if image_name not in downloaded_receipt_images:
+                image_ekassa_gray = ReceiptUtil.read_image_from_ekassa(fiscal_code)
+                image_file = os.path.join(receipt_images_folder, image_name)
+                cv2.imwrite(image_file, image_ekassa_gray)
+            image_ekassa_gray = cv2.imread(os.path.join(receipt_images_folder, image_name), cv2.IMREAD_GRAYSCALE)
+
             receipt = receipt_service.mine_receipt(image_ekassa_gray=image_ekassa_gray,
                                                    fiscal_code=fiscal_code)
             receipt._fiscal_code = fiscal_code
         except Exception as e:
             print(f"! An error occurred (on {fiscal_code}): {e}")
             # traceback.print_exc()
-            errors.append(e)
-            error_tracebacks.append(traceback.format_exc())
-            fiscal_codes_with_error.append(fiscal_code)
+            batch_journal.mark_failed(fiscal_code, e, traceback.format_exc())
         else:
-            receipts_dict[fiscal_code] = receipt
+            batch_journal.mark_completed(fiscal_code, receipt)
+            fiscal_code_index.mark_processed([fiscal_code])
+
+    # All the codes of the journal (the iteration of the codes is consumed)
+    receipts_dict = batch_journal.get_completed_receipts()
+    failures = batch_journal.get_failures()
+    batch_journal.close()
+    fiscal_code_index.close()
+    fiscal_codes_with_error = list(failures.keys())
+    errors = [f'{failure["error"]} (attempts: {failure["attempts"]})' for failure in failures.values()]
+    error_tracebacks = [failure['traceback'] for failure in failures.values()]
 
     receipts = list(receipts_dict.values())
     ReceiptUtil.export_receipts(receipts)
+    # Mined receipts are also kept in the warehouse for the spending/price queries
+    receipt_warehouse = ReceiptWarehouse()
+    receipt_warehouse.ingest(receipts)
+    receipt_warehouse.close()
+    # ... and in the Parquet datasets for the reporting scans
+    ReceiptAnalytics().write(receipts)
 
     print()
     print('<< Receipts >>')
@@ -0,0 +1,42 @@
+import argparse
+import os
+
+import pytesseract
+
+from src.benchmark.receipt_benchmark import ReceiptBenchmark
+from src.benchmark.soak_test_runner import SoakTestRunner
+from src.props.application_properties_builder import ApplicationPropertiesBuilder
+from src.props.application_properties_service import ApplicationPropertiesService
+from src.receipt_processors.receipt_service import ReceiptService
+
+if os.name == 'nt':
+    pytesseract.pytesseract.tesseract_cmd = 'C:\\Program Files\\Tesseract-OCR\\tesseract.exe'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Loops the stored receipt images and reports memory growth.')
+    parser.add_argument('--hours', type=float, default=1.0, help='soak test duration')
+    parser.add_argument('--max-receipts', type=int, default=None, help='stop earlier after this number of receipts')
+    parser.add_argument('--limit', type=int, default=None, help='number of receipts in the corpus')
+    parser.add_argument('--single-pass', action='store_true', help='use single-pass full receipt OCR mode')
+    parser.add_argument('--sample-every', type=int, default=10, help='receipts between memory samples')
+    parser.add_argument('--top', type=int, default=20, help='number of reported allocation sites')
+    parser.add_argument('--receipts-dir', default=os.path.join('logs', 'receipts'))
+    parser.add_argument('--output-dir', default=os.path.join('logs', 'soak'))
+    args = parser.parse_args()
+
+    application_properties = ApplicationPropertiesBuilder.prepare_application_properties_v_core_1_logic_0_depend_1(is_debug_on=False)
+    ApplicationPropertiesService.load_properties(application_properties)
+    ocr_mode = ReceiptService.OCR_MODE_SINGLE_PASS if args.single_pass else ReceiptService.OCR_MODE_CROP_PER_FIELD
+    receipt_service = ReceiptService(ocr_mode=ocr_mode)
+
+    corpus = ReceiptBenchmark.load_corpus(args.receipts_dir, limit=args.limit)
+    soak_test_runner = SoakTestRunner(receipt_service, corpus, sample_every=args.sample_every, top_n=args.top)
+    report = soak_test_runner.run(args.hours, max_receipts=args.max_receipts)
+    SoakTestRunner.print_report(report)
+    results_file = soak_test_runner.export_results(report, args.output_dir)
+    print(f'Results: {results_file}')
+
+
+if __name__ == '__main__':
+    main()
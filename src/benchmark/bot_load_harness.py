@@ -0,0 +1,261 @@
+import asyncio
+import datetime
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+from telegram import Bot, Chat, File, Message, PhotoSize, Update, User
+from telegram.ext import Application, TypeHandler
+
+from src.benchmark.receipt_benchmark import ReceiptBenchmark
+from src.receipt_processors.util import Util
+
+
+class FakeTelegramBot(Bot):
+    """
+    Class for a Telegram bot which never calls the Bot API: photos are read
+    from local files (registered by file id, after {download_latency}
+    seconds) and sent messages are collected in the reply sink with their
+    send time, by chat.
+
+    Methods:
+        add_photo(file_id, path)
+        get_replies(chat_id) -> list of (send time, text)
+    """
+
+    def __init__(self, download_latency = 0.0):
+        super().__init__(token='0:fake')
+        self._download_latency = download_latency
+        self._photo_paths = {}
+        self._replies = {}
+
+    def add_photo(self, file_id, path):
+        self._photo_paths[file_id] = path
+
+    def get_replies(self, chat_id):
+        return self._replies.get(chat_id, [])
+
+    async def get_me(self, *args, **kwargs):
+        self._bot_user = User(1, 'CheckYighan', True, username='fake_check_yighan_bot')
+        return self._bot_user
+
+    async def get_file(self, file_id, *args, **kwargs):
+        if self._download_latency > 0:
+            await asyncio.sleep(self._download_latency)
+        file = File(file_id, file_id, file_path=self._photo_paths[file_id])
+        file.set_bot(self)
+        return file
+
+    async def send_message(self, chat_id, text, *args, **kwargs):
+        self._replies.setdefault(chat_id, []).append((time.perf_counter(), text))
+        return None
+
+
+class BotLoadHarness:
+    """
+    Class for the end-to-end load test of the bot: {concurrency} simulated
+    users each send QR code photos of the corpus fiscal codes (synthetic
+    Updates) one after the other (waiting for the previous one to be handled,
+    plus {think_time}) to the bot application built with a FakeTelegramBot,
+    so the real handlers (and the concurrency settings of the application)
+    are exercised without Telegram.
+
+    Latency of a message is measured from putting its Update into the update
+    queue to the end of its handling (and to the first reply); the event loop
+    is sampled every {lag_interval} seconds, the delays of the samples beyond
+    the interval are the time the loop was blocked (e.g. by synchronous
+    mining), when no other user could be answered.
+
+    Methods:
+        prepare_photos(fiscal_codes, photos_folder) -> dict of fiscal code: QR photo path
+        prepare_application_builder(bot) -> application builder of the fake bot
+        prepare_update(update_id, chat_id, file_id, bot) -> Update with a photo message
+        run(fiscal_codes, message_count) -> report dict
+        export_results(report, output_dir) -> path of the JSON results file
+    """
+    EKASSA_LINK_PREFIX = 'https://monitoring.e-kassa.gov.az/#/index?doc='
+    PERCENTILES = [50, 90, 95, 99]
+
+    def __init__(self, prepare_application, photos_folder = os.path.join('logs', 'bot_load', 'photos'), concurrency = 4,
+                 think_time = 0.0, download_latency = 0.0, lag_interval = 0.01, errors_counter = None):
+        self.prepare_application = prepare_application
+        self.photos_folder = photos_folder
+        self.concurrency = concurrency
+        self.think_time = think_time
+        self.download_latency = download_latency
+        self.lag_interval = lag_interval
+        self.errors_counter = errors_counter
+
+    @staticmethod
+    def prepare_photos(fiscal_codes, photos_folder, module_size = 8):
+        """
+        QR codes of the E-kassa links (as printed on receipts), saved as JPEG photos.
+        """
+        os.makedirs(photos_folder, exist_ok=True)
+        qr_code_encoder = cv2.QRCodeEncoder.create()
+        photo_paths = {}
+        for fiscal_code in fiscal_codes:
+            photo_path = os.path.join(photos_folder, f'qr_{fiscal_code}.jpg')
+            if not os.path.exists(photo_path):
+                qr_code = qr_code_encoder.encode(BotLoadHarness.EKASSA_LINK_PREFIX + fiscal_code)
+                qr_code = cv2.resize(qr_code, None, fx=module_size, fy=module_size, interpolation=cv2.INTER_NEAREST)
+                qr_code = cv2.copyMakeBorder(qr_code, 4 * module_size, 4 * module_size, 4 * module_size, 4 * module_size,
+                                             cv2.BORDER_CONSTANT, value=255)
+                cv2.imwrite(photo_path, qr_code)
+            photo_paths[fiscal_code] = photo_path
+        return photo_paths
+
+    @staticmethod
+    def prepare_application_builder(bot):
+        # No updater: the Updates are put into the update queue directly
+        return Application.builder().bot(bot).updater(None)
+
+    @staticmethod
+    def prepare_update(update_id, chat_id, file_id, bot):
+        user = User(chat_id, f'User {chat_id}', False)
+        photo_size = PhotoSize(file_id, file_id, 1024, 1024)
+        message = Message(update_id, datetime.datetime.now(datetime.timezone.utc), Chat(chat_id, Chat.PRIVATE),
+                          from_user=user, photo=(photo_size,))
+        update = Update(update_id, message=message)
+        for telegram_object in (update, message, photo_size):
+            telegram_object.set_bot(bot)
+        return update
+
+    def run(self, fiscal_codes, message_count):
+        """
+        Args:
+            fiscal_codes: fiscal codes sent in turn
+            message_count: total number of messages (shared by the users)
+
+        Returns:
+            return: report dict (throughput, latency percentiles, event loop blocking, errors, per message records)
+        """
+        errors_before = self.errors_counter.get_samples() if self.errors_counter is not None else {}
+        report = asyncio.run(self._run(fiscal_codes, message_count))
+        if self.errors_counter is not None:
+            errors_after = self.errors_counter.get_samples()
+            report['errors'] = {'/'.join(key): value - errors_before.get(key, 0) for key, value in errors_after.items()
+                                if value != errors_before.get(key, 0)}
+        return report
+
+    async def _run(self, fiscal_codes, message_count):
+        bot = FakeTelegramBot(download_latency=self.download_latency)
+        for fiscal_code, photo_path in BotLoadHarness.prepare_photos(fiscal_codes, self.photos_folder).items():
+            bot.add_photo(fiscal_code, photo_path)
+        application = self.prepare_application(BotLoadHarness.prepare_application_builder(bot))
+        handled_events = {}
+
+        async def on_handled(update, context):
+            handled_events[update.update_id].set()
+
+        # The last group runs after the handlers of the update are done
+        application.add_handler(TypeHandler(Update, on_handled), group=max(application.handlers) + 1)
+
+        records = []
+        next_message_num = iter(range(message_count))
+
+        async def simulate_user(chat_id):
+            for message_num in next_message_num:
+                fiscal_code = fiscal_codes[message_num % len(fiscal_codes)]
+                update_id = message_num + 1
+                handled_events[update_id] = asyncio.Event()
+                sent_time = time.perf_counter()
+                await application.update_queue.put(BotLoadHarness.prepare_update(update_id, chat_id, fiscal_code, bot))
+                await handled_events[update_id].wait()
+                handled_time = time.perf_counter()
+                reply_times = [reply_time for reply_time, _ in bot.get_replies(chat_id) if reply_time >= sent_time]
+                records.append({
+                    'update_id': update_id,
+                    'chat_id': chat_id,
+                    'fiscal_code': fiscal_code,
+                    'sent_at': sent_time - start_time,
+                    'latency': handled_time - sent_time,
+                    'first_reply_latency': reply_times[0] - sent_time if reply_times else None,
+                    'reply_count': len(reply_times),
+                })
+                if self.think_time > 0:
+                    await asyncio.sleep(self.think_time)
+
+        lags = []
+        is_running = True
+
+        async def monitor_event_loop():
+            while is_running:
+                sleep_start_time = time.perf_counter()
+                await asyncio.sleep(self.lag_interval)
+                lags.append(max(time.perf_counter() - sleep_start_time - self.lag_interval, 0.0))
+
+        async with application:
+            await application.start()
+            monitor_task = asyncio.create_task(monitor_event_loop())
+            start_time = time.perf_counter()
+            await asyncio.gather(*[simulate_user(chat_id) for chat_id in range(1, self.concurrency + 1)])
+            duration = time.perf_counter() - start_time
+            is_running = False
+            await monitor_task
+            await application.stop()
+        return BotLoadHarness.summarize(sorted(records, key=lambda record: record['update_id']), duration, lags,
+                                        self.lag_interval)
+
+    @staticmethod
+    def summarize(records, duration, lags, lag_interval):
+        # Delays shorter than a few milliseconds are scheduling noise, not blocking
+        blocking_lags = [lag for lag in lags if lag > max(lag_interval, 0.005)]
+        first_reply_latencies = [record['first_reply_latency'] for record in records if record['first_reply_latency'] is not None]
+        return {
+            'message_count': len(records),
+            'duration': duration,
+            'throughput': len(records) / duration if duration > 0 else 0.0,
+            'latency': BotLoadHarness._calculate_percentiles([record['latency'] for record in records]),
+            'first_reply_latency': BotLoadHarness._calculate_percentiles(first_reply_latencies),
+            'event_loop': {
+                'blocked_time': float(sum(blocking_lags)),
+                'blocked_share': float(sum(blocking_lags)) / duration if duration > 0 else 0.0,
+                'blocking_count': len(blocking_lags),
+                'max_lag': float(max(lags)) if lags else 0.0,
+                'lag_p99': float(np.percentile(lags, 99)) if lags else 0.0,
+            },
+            'records': records,
+        }
+
+    @staticmethod
+    def _calculate_percentiles(values):
+        if not values:
+            return None
+        percentiles = {f'p{percentile}': float(np.percentile(values, percentile)) for percentile in BotLoadHarness.PERCENTILES}
+        return {'mean': float(np.mean(values)), **percentiles, 'max': float(np.max(values))}
+
+    def export_results(self, report, output_dir = os.path.join('logs', 'bot_load'), config = None):
+        os.makedirs(output_dir, exist_ok=True)
+        results = {
+            'commit': ReceiptBenchmark._get_commit(),
+            'date_time': Util.prepare_current_datetime(),
+            'config': {
+                'concurrency': self.concurrency,
+                'think_time': self.think_time,
+                'download_latency': self.download_latency,
+                **(config or {}),
+            },
+            'report': report,
+        }
+        results_file = os.path.join(output_dir, f'{results["date_time"]}_bot_load.json')
+        with open(results_file, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2, ensure_ascii=False)
+        return results_file
+
+    @staticmethod
+    def print_report(report):
+        print('<< Bot load test >>')
+        print(f'{"message_count":<20}: {report["message_count"]} in {report["duration"]:.1f} s')
+        print(f'{"throughput":<20}: {report["throughput"]:.2f} messages/s')
+        for key in ['latency', 'first_reply_latency']:
+            if report[key] is not None:
+                print(f'{key:<20}: ' + ', '.join(f'{name} {value * 1000:.0f} ms' for name, value in report[key].items()))
+        event_loop = report['event_loop']
+        print(f'{"event_loop_blocked":<20}: {event_loop["blocked_time"]:.2f} s ({event_loop["blocked_share"]:.1%} of the run, '
+              f'{event_loop["blocking_count"]} times), max lag {event_loop["max_lag"] * 1000:.0f} ms')
+        if 'errors' in report:
+            print(f'{"errors":<20}: {report["errors"]}')
+
@@ -0,0 +1,145 @@
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.logger import LowLevelReceiptMinerLogger
+
+
+class EkassaStubServer:
+    """
+    Class for a local stand-in of the E-kassa monitoring service: serves
+    GET /pks-monitoring/2.0.0/documents/{fiscal_code} from the stored receipt
+    images (receipt_{fiscal_code}.jpg of {receipts_folder}), so the fetch and
+    the pipeline can be load tested without the government service
+    (point ReceiptUtil.EKASSA_BASE_URL or EKASSA_BASE_URL to it).
+
+    A request waits {latency} seconds (plus a uniform jitter up to
+    {latency_jitter}) and fails with 500 at {error_rate}; it is rejected with
+    429 above {max_requests_per_second} (token bucket of {burst} requests) and
+    with 503 while {max_concurrency} requests are in progress.
+    Unknown fiscal codes get 404.
+
+    Methods:
+        start() -> base URL (served by a background thread)
+        serve_forever()
+        stop()
+        get_stats() -> request counts by status, bytes sent
+    """
+    DOCUMENTS_PATH = '/pks-monitoring/2.0.0/documents/'
+
+    def __init__(self, receipts_folder = os.path.join('logs', 'receipts'), host = '127.0.0.1', port = 0,
+                 latency = 0.0, latency_jitter = 0.0, error_rate = 0.0, max_requests_per_second = None,
+                 burst = None, max_concurrency = None, seed = None):
+        self.receipts_folder = receipts_folder
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.max_requests_per_second = max_requests_per_second
+        self.burst = burst if burst is not None else max(max_requests_per_second or 1, 1)
+        self.max_concurrency = max_concurrency
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._tokens_updated_at = time.monotonic()
+        self._in_progress = 0
+        self._status_counts = {}
+        self._bytes_sent = 0
+        self._server = ThreadingHTTPServer((host, port), self._prepare_handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _prepare_handler_class(self):
+        stub_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = stub_server._handle(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'image/jpeg' if status == 200 else 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _handle(self, path):
+        if not path.startswith(EkassaStubServer.DOCUMENTS_PATH):
+            return self._count(404, b'Not found')
+        if not self._take_token():
+            return self._count(429, b'Too many requests')
+        with self._lock:
+            if self.max_concurrency is not None and self._in_progress >= self.max_concurrency:
+                is_busy = True
+            else:
+                is_busy = False
+                self._in_progress += 1
+                delay = self.latency + self._random.uniform(0, self.latency_jitter)
+                is_failed = self._random.random() < self.error_rate
+        if is_busy:
+            return self._count(503, b'Service unavailable')
+        try:
+            time.sleep(delay)
+            if is_failed:
+                return self._count(500, b'Internal server error')
+            fiscal_code = path[len(EkassaStubServer.DOCUMENTS_PATH):].split('?')[0]
+            image_name = LowLevelReceiptMinerLogger.sanitize_string(f'receipt_{fiscal_code}.jpg')
+            image_path = os.path.join(self.receipts_folder, image_name)
+            if fiscal_code == '' or not os.path.isfile(image_path):
+                return self._count(404, b'Not found')
+            with open(image_path, 'rb') as file:
+                return self._count(200, file.read())
+        finally:
+            with self._lock:
+                self._in_progress -= 1
+
+    def _take_token(self):
+        if self.max_requests_per_second is None:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._tokens_updated_at) * self.max_requests_per_second)
+            self._tokens_updated_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def _count(self, status, body):
+        with self._lock:
+            self._status_counts[status] = self._status_counts.get(status, 0) + 1
+            self._bytes_sent += len(body)
+        return status, body
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        # shutdown() waits for the serving loop, so it is called only for the background thread
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'requests': sum(self._status_counts.values()),
+                'status_counts': dict(sorted(self._status_counts.items())),
+                'bytes_sent': self._bytes_sent,
+            }
@@ -0,0 +1,181 @@
+import json
+import os
+import re
+
+import numpy as np
+
+from src.benchmark.parameter_sweep import ParameterSweep
+from src.benchmark.receipt_benchmark import ReceiptBenchmark
+from src.receipt_processors.receipt_service import ReceiptService
+from src.receipt_processors.util import Util
+
+
+class GoldenSetHarness:
+    """
+    Class for the accuracy-vs-speed regression check: the pipeline is run
+    in parallel over the golden set (stored receipt images having a
+    reference receipt_*.log), each field is compared with the reference and
+    the run is compared with a baseline run (accuracy, latency, OCR calls,
+    per field mismatch counts, receipts whose fields got wrong or fixed).
+
+    A run is rejected if its field accuracy on the receipts of both runs is
+    lower than the baseline one by more than {max_accuracy_drop} (or more
+    than {max_regressed_receipts} receipts got a field wrong, if given),
+    whatever it gains in speed.
+    No stage cache is used, so latencies are real.
+
+    Methods:
+        run(corpus) -> result dict (summary and per receipt records)
+        compare(result, baseline) -> comparison dict (deltas, regressions, verdict)
+        export_results(result, comparison, output_dir) -> path of the JSON results file
+        save_baseline(result, path), load_baseline(path)
+    """
+    VERDICT_ACCEPTED = 'ACCEPTED'
+    VERDICT_REJECTED = 'REJECTED'
+    VERDICT_NO_BASELINE = 'NO BASELINE'
+
+    def __init__(self, ocr_mode = ReceiptService.OCR_MODE_CROP_PER_FIELD, is_numeric_second_pass_on = False,
+                 workers = None, chunk_size = 5, max_accuracy_drop = 0.0, max_regressed_receipts = None):
+        self.parameter_sweep = ParameterSweep(ocr_mode=ocr_mode, is_numeric_second_pass_on=is_numeric_second_pass_on,
+                                              stage_cache_path=None, workers=workers, chunk_size=chunk_size)
+        self.max_accuracy_drop = max_accuracy_drop
+        self.max_regressed_receipts = max_regressed_receipts
+
+    def run(self, corpus):
+        # The golden set run is a sweep of the baseline candidate only
+        result = self.parameter_sweep.run([{}], corpus)[0]
+        records = result['records']
+        result = {key: value for key, value in result.items()
+                  if key not in ('candidate', 'overrides', 'is_pareto_optimal', 'records')}
+        result.update({
+            'commit': ReceiptBenchmark._get_commit(),
+            'date_time': Util.prepare_current_datetime(),
+            'config': {
+                'ocr_mode': self.parameter_sweep.ocr_mode,
+                'is_numeric_second_pass_on': self.parameter_sweep.is_numeric_second_pass_on,
+            },
+            'latency_p95': float(np.percentile([record['latency'] for record in records], 95)) if records else 0.0,
+            'field_mismatches': GoldenSetHarness.count_field_mismatches(records),
+            'records': records,
+        })
+        return result
+
+    @staticmethod
+    def count_field_mismatches(records):
+        # Product lines are counted together: products[3].price -> products.price
+        counts = {}
+        for record in records:
+            for field in GoldenSetHarness._get_mismatches(record):
+                field = re.sub(r'\[\d+\]', '', field)
+                counts[field] = counts.get(field, 0) + 1
+        return dict(sorted(counts.items(), key=lambda item: -item[1]))
+
+    @staticmethod
+    def _get_mismatches(record):
+        # Mismatches are None if the receipt could not be mined
+        return record['mismatches'] if record['mismatches'] is not None else ['error']
+
+    def compare(self, result, baseline):
+        """
+        Args:
+            result: result dict of the run
+            baseline: result dict of the baseline run (or None)
+            ...
+
+        Returns:
+            return: comparison dict (metrics of both runs on the common receipts and deltas,
+                    field mismatch count deltas, regressed/fixed receipts, verdict, reasons)
+        """
+        if baseline is None:
+            return {'verdict': GoldenSetHarness.VERDICT_NO_BASELINE, 'reasons': []}
+        baseline_records = {record['fiscal_code']: record for record in baseline['records']}
+        records = [record for record in result['records'] if record['fiscal_code'] in baseline_records]
+        common_baseline_records = [baseline_records[record['fiscal_code']] for record in records]
+
+        metrics = {}
+        for key in ['field_accuracy', 'is_exact', 'latency', 'ocr_calls', 'ocr_time']:
+            value = float(np.mean([record[key] for record in records])) if records else 0.0
+            baseline_value = float(np.mean([record[key] for record in common_baseline_records])) if records else 0.0
+            metrics[key] = {
+                'value': value,
+                'baseline': baseline_value,
+                'delta': value - baseline_value,
+                'relative_delta': (value - baseline_value) / baseline_value if baseline_value else None,
+            }
+
+        regressed, fixed = {}, {}
+        for record, baseline_record in zip(records, common_baseline_records):
+            mismatches = set(GoldenSetHarness._get_mismatches(record))
+            baseline_mismatches = set(GoldenSetHarness._get_mismatches(baseline_record))
+            if mismatches - baseline_mismatches:
+                regressed[record['fiscal_code']] = sorted(mismatches - baseline_mismatches)
+            if baseline_mismatches - mismatches:
+                fixed[record['fiscal_code']] = sorted(baseline_mismatches - mismatches)
+
+        field_mismatches = GoldenSetHarness.count_field_mismatches(records)
+        baseline_field_mismatches = GoldenSetHarness.count_field_mismatches(common_baseline_records)
+        field_mismatch_deltas = {field: field_mismatches.get(field, 0) - baseline_field_mismatches.get(field, 0)
+                                 for field in set(field_mismatches) | set(baseline_field_mismatches)}
+
+        reasons = []
+        accuracy_drop = -metrics['field_accuracy']['delta']
+        if accuracy_drop > self.max_accuracy_drop + 1e-12:
+            reasons.append(f'field accuracy dropped by {accuracy_drop:.4f} (allowed {self.max_accuracy_drop:.4f})')
+        if self.max_regressed_receipts is not None and len(regressed) > self.max_regressed_receipts:
+            reasons.append(f'{len(regressed)} receipts got fields wrong (allowed {self.max_regressed_receipts})')
+        return {
+            'baseline_commit': baseline.get('commit'),
+            'baseline_date_time': baseline.get('date_time'),
+            'common_receipt_count': len(records),
+            'metrics': metrics,
+            'field_mismatch_deltas': {field: delta for field, delta in
+                                      sorted(field_mismatch_deltas.items(), key=lambda item: -abs(item[1])) if delta != 0},
+            'regressed_receipts': regressed,
+            'fixed_receipts': fixed,
+            'verdict': GoldenSetHarness.VERDICT_REJECTED if reasons else GoldenSetHarness.VERDICT_ACCEPTED,
+            'reasons': reasons,
+        }
+
+    @staticmethod
+    def load_baseline(path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    @staticmethod
+    def save_baseline(result, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(result, file, indent=2, ensure_ascii=False)
+
+    @staticmethod
+    def export_results(result, comparison, output_dir = os.path.join('logs', 'golden')):
+        os.makedirs(output_dir, exist_ok=True)
+        results_file = os.path.join(output_dir, f'{result["date_time"]}_golden.json')
+        with open(results_file, 'w', encoding='utf-8') as file:
+            json.dump({'result': result, 'comparison': comparison}, file, indent=2, ensure_ascii=False)
+        return results_file
+
+    @staticmethod
+    def print_report(result, comparison, max_receipts = 10):
+        print('<< Golden set >>')
+        print(f'{"receipt_count":<25}: {result["receipt_count"]} (errors: {result["error_count"]})')
+        print(f'{"field_accuracy_mean":<25}: {result["field_accuracy_mean"]:.4f}')
+        print(f'{"exact_rate":<25}: {result["exact_rate"]:.3f}')
+        print(f'{"latency_mean":<25}: {result["latency_mean"]:.2f} s (p95 {result["latency_p95"]:.2f} s)')
+        print(f'{"ocr_calls_mean":<25}: {result["ocr_calls_mean"]:.1f}')
+        print(f'Field mismatches: {result["field_mismatches"]}')
+        if comparison['verdict'] != GoldenSetHarness.VERDICT_NO_BASELINE:
+            print(f'<< Against baseline ({comparison["baseline_commit"]}, {comparison["baseline_date_time"]}; '
+                  f'{comparison["common_receipt_count"]} common receipts) >>')
+            for key, metric in comparison['metrics'].items():
+                relative_delta = f' ({metric["relative_delta"]:+.1%})' if metric['relative_delta'] is not None else ''
+                print(f'{key:<25}: {metric["baseline"]:.4f} -> {metric["value"]:.4f}, '
+                      f'delta {metric["delta"]:+.4f}{relative_delta}')
+            print(f'Field mismatch deltas: {comparison["field_mismatch_deltas"]}')
+            for title, receipts in [('Regressed', comparison['regressed_receipts']), ('Fixed', comparison['fixed_receipts'])]:
+                print(f'{title} receipts: {len(receipts)}')
+                for fiscal_code, fields in list(receipts.items())[:max_receipts]:
+                    print(f'  {fiscal_code}: {", ".join(fields)}')
+        print(f'Verdict: {comparison["verdict"]}' + (f' ({"; ".join(comparison["reasons"])})' if comparison['reasons'] else ''))
@@ -0,0 +1,147 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from src.benchmark.receipt_benchmark import ReceiptBenchmark
+from src.receipt_processors.receipt_util import ReceiptUtil
+from src.receipt_processors.util import Util
+
+
+class LoadGenerator:
+    """
+    Class for driving the E-kassa fetch (ReceiptUtil.read_image_from_ekassa)
+    or the whole pipeline (ReceiptService.mine_receipt by fiscal code) at a
+    target rate, reporting throughput, latency and errors.
+
+    Requests are started on an open-loop schedule (one every 1/{rate}
+    seconds, whether or not the earlier ones finished) by {concurrency}
+    threads, and latency is measured from the scheduled start: when the
+    system cannot keep up, the queueing delay shows in the latency instead
+    of lowering the offered rate.
+
+    Methods:
+        run(fiscal_codes, rate, duration = None, request_count = None) -> report dict
+        summarize(records, rate, duration) -> report dict
+        export_results(report, output_dir) -> path of the JSON results file
+    """
+    MODE_FETCH = 'fetch'
+    MODE_PIPELINE = 'pipeline'
+    PERCENTILES = [50, 90, 95, 99]
+
+    def __init__(self, receipt_service = None, mode = MODE_FETCH, concurrency = 4):
+        if mode not in (LoadGenerator.MODE_FETCH, LoadGenerator.MODE_PIPELINE):
+            raise ValueError(f'Unknown mode: {mode}')
+        if mode == LoadGenerator.MODE_PIPELINE and receipt_service is None:
+            raise ValueError('Pipeline mode needs a receipt service')
+        self.receipt_service = receipt_service
+        self.mode = mode
+        self.concurrency = concurrency
+
+    def run(self, fiscal_codes, rate, duration = None, request_count = None):
+        """
+        Args:
+            fiscal_codes: fiscal codes requested in turn
+            rate: target requests per second
+            duration: seconds of load (if {request_count} is not given)
+            ...
+
+        Returns:
+            return: report dict (throughput, latency/service time/start delay percentiles, errors, per request records)
+        """
+        if request_count is None:
+            if duration is None:
+                raise ValueError('Either duration or request count must be given')
+            request_count = max(int(rate * duration), 1)
+        records = [None] * request_count
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for i in range(request_count):
+                scheduled_time = start_time + i / rate
+                delay = scheduled_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self._send, records, i, fiscal_codes[i % len(fiscal_codes)], scheduled_time, start_time)
+        return LoadGenerator.summarize(records, rate, time.perf_counter() - start_time)
+
+    def _send(self, records, i, fiscal_code, scheduled_time, run_start_time):
+        start_time = time.perf_counter()
+        error = None
+        try:
+            if self.mode == LoadGenerator.MODE_FETCH:
+                ReceiptUtil.read_image_from_ekassa(fiscal_code)
+            else:
+                self.receipt_service.mine_receipt(fiscal_code=fiscal_code)
+        except requests.HTTPError as e:
+            error = f'HTTP {e.response.status_code}'
+        except Exception as e:
+            error = type(e).__name__
+        end_time = time.perf_counter()
+        records[i] = {
+            'fiscal_code': fiscal_code,
+            'scheduled_at': scheduled_time - run_start_time,
+            'start_delay': start_time - scheduled_time,
+            'service_time': end_time - start_time,
+            'latency': end_time - scheduled_time,
+            'error': error,
+        }
+
+    @staticmethod
+    def summarize(records, rate, duration):
+        successful_records = [record for record in records if record['error'] is None]
+        errors = {}
+        for record in records:
+            if record['error'] is not None:
+                errors[record['error']] = errors.get(record['error'], 0) + 1
+        return {
+            'request_count': len(records),
+            'duration': duration,
+            'offered_rate': rate,
+            'throughput': len(successful_records) / duration if duration > 0 else 0.0,
+            'error_rate': (len(records) - len(successful_records)) / len(records) if records else 0.0,
+            'errors': dict(sorted(errors.items(), key=lambda item: -item[1])),
+            'latency': LoadGenerator._calculate_percentiles([record['latency'] for record in successful_records]),
+            'service_time': LoadGenerator._calculate_percentiles([record['service_time'] for record in successful_records]),
+            'start_delay': LoadGenerator._calculate_percentiles([record['start_delay'] for record in records]),
+            'records': records,
+        }
+
+    @staticmethod
+    def _calculate_percentiles(values):
+        if not values:
+            return None
+        percentiles = {f'p{percentile}': float(np.percentile(values, percentile)) for percentile in LoadGenerator.PERCENTILES}
+        return {'mean': float(np.mean(values)), **percentiles, 'max': float(np.max(values))}
+
+    def export_results(self, report, output_dir = os.path.join('logs', 'load'), stub_stats = None):
+        os.makedirs(output_dir, exist_ok=True)
+        results = {
+            'commit': ReceiptBenchmark._get_commit(),
+            'date_time': Util.prepare_current_datetime(),
+            'config': {
+                'mode': self.mode,
+                'concurrency': self.concurrency,
+                'ekassa_base_url': ReceiptUtil.EKASSA_BASE_URL,
+                'ocr_mode': self.receipt_service.ocr_mode if self.receipt_service is not None else None,
+            },
+            'stub_stats': stub_stats,
+            'report': report,
+        }
+        results_file = os.path.join(output_dir, f'{results["date_time"]}_load.json')
+        with open(results_file, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        return results_file
+
+    @staticmethod
+    def print_report(report):
+        print('<< Load test >>')
+        print(f'{"request_count":<15}: {report["request_count"]} in {report["duration"]:.1f} s')
+        print(f'{"offered_rate":<15}: {report["offered_rate"]:.2f} req/s')
+        print(f'{"throughput":<15}: {report["throughput"]:.2f} req/s (successful)')
+        print(f'{"error_rate":<15}: {report["error_rate"]:.3f} {report["errors"]}')
+        for key in ['latency', 'service_time', 'start_delay']:
+            if report[key] is not None:
+                print(f'{key:<15}: ' + ', '.join(f'{name} {value * 1000:.0f} ms' for name, value in report[key].items()))
@@ -0,0 +1,155 @@
+import os
+import threading
+import tracemalloc
+
+import psutil
+
+from src.tracer import Tracer
+
+
+class MemoryProfiler:
+    """
+    Tracer sink for the opt-in memory instrumentation of ReceiptService.
+    Python allocations of each stage (tracemalloc) and the peak/RSS of each
+    receipt (psutil) are recorded on the 'mine_receipt' and stage spans.
+
+    Stage record:
+        allocated: traced memory left allocated after the stage (bytes)
+        peak: peak traced memory above the memory at the stage start (bytes)
+        top_allocations: largest allocation sites of the stage (only if is_snapshot_per_stage_on)
+
+    Methods:
+        start(), stop()
+        take_snapshot() -> tracemalloc snapshot
+        compare_snapshots(old_snapshot, new_snapshot, top_n) -> top allocation sites by size difference
+        get_rss() -> resident set size of the process (bytes)
+        summarize() -> summary dict, to_dict() -> summary and per receipt records
+    """
+    STAGES = ['split', 'general', 'products', 'payment']
+
+    def __init__(self, traceback_frames = 1, is_snapshot_per_stage_on = False, top_n = 10):
+        self.traceback_frames = traceback_frames
+        self.is_snapshot_per_stage_on = is_snapshot_per_stage_on
+        self.top_n = top_n
+        self.records = []
+        self._process = psutil.Process(os.getpid())
+        self._thread_id = None
+        self._is_tracemalloc_started_here = False
+        self._receipt_record = None
+        self._stage_starts = {}
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.traceback_frames)
+            self._is_tracemalloc_started_here = True
+        self._thread_id = threading.get_ident()
+        Tracer.add_sink(self)
+        return self
+
+    def stop(self):
+        Tracer.remove_sink(self)
+        if self._is_tracemalloc_started_here:
+            tracemalloc.stop()
+            self._is_tracemalloc_started_here = False
+
+    def on_span_start(self, span):
+        # tracemalloc peak is process-wide, only the profiled thread is followed
+        if span.thread_id != self._thread_id:
+            return
+        if span.name == 'mine_receipt':
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            self._receipt_record = {'traced_start': current, 'peak': 0, 'rss_start': self.get_rss(), 'stages': {}}
+        elif span.name in MemoryProfiler.STAGES and self._receipt_record is not None:
+            self._update_receipt_peak()
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            snapshot = self.take_snapshot() if self.is_snapshot_per_stage_on else None
+            self._stage_starts[span.name] = (current, snapshot)
+
+    def on_span(self, span):
+        if span.thread_id != self._thread_id or self._receipt_record is None:
+            return
+        if span.name in MemoryProfiler.STAGES and span.name in self._stage_starts:
+            start_current, start_snapshot = self._stage_starts.pop(span.name)
+            current, peak = tracemalloc.get_traced_memory()
+            stage_record = {'allocated': current - start_current, 'peak': peak - start_current}
+            if start_snapshot is not None:
+                stage_record['top_allocations'] = self.compare_snapshots(start_snapshot, self.take_snapshot(), self.top_n)
+            self._receipt_record['stages'][span.name] = stage_record
+            self._update_receipt_peak()
+        elif span.name == 'mine_receipt':
+            self._update_receipt_peak()
+            record = self._receipt_record
+            current, _ = tracemalloc.get_traced_memory()
+            self.records.append({
+                'fiscal_code': span.fiscal_code,
+                'traced_allocated': current - record['traced_start'],
+                'traced_peak': record['peak'] - record['traced_start'],
+                'rss': self.get_rss(),
+                'rss_growth': self.get_rss() - record['rss_start'],
+                'stages': record['stages'],
+                'error': span.attributes.get('error'),
+            })
+            self._receipt_record = None
+            self._stage_starts = {}
+
+    def on_event(self, name, attributes, span):
+        pass
+
+    def close(self):
+        self.stop()
+
+    def _update_receipt_peak(self):
+        _, peak = tracemalloc.get_traced_memory()
+        self._receipt_record['peak'] = max(self._receipt_record['peak'], peak)
+
+    def get_rss(self):
+        return self._process.memory_info().rss
+
+    def take_snapshot(self):
+        snapshot = tracemalloc.take_snapshot()
+        return snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ])
+
+    @staticmethod
+    def compare_snapshots(old_snapshot, new_snapshot, top_n = 10):
+        stats = new_snapshot.compare_to(old_snapshot, 'lineno')
+        return [{
+            'location': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+            'size_diff': stat.size_diff,
+            'size': stat.size,
+            'count_diff': stat.count_diff,
+        } for stat in stats[:top_n]]
+
+    def to_dict(self):
+        return {'summary': self.summarize(), 'records': self.records}
+
+    def summarize(self):
+        """
+        Returns:
+            summary dict (mean/max peak per receipt, mean allocations per stage, last RSS)
+        """
+        if len(self.records) == 0:
+            return {'receipt_count': 0}
+        peaks = [record['traced_peak'] for record in self.records]
+        summary = {
+            'receipt_count': len(self.records),
+            'traced_peak_mean': sum(peaks) / len(peaks),
+            'traced_peak_max': max(peaks),
+            'rss_first': self.records[0]['rss'],
+            'rss_last': self.records[-1]['rss'],
+            'stages': {},
+        }
+        for stage in MemoryProfiler.STAGES:
+            stage_records = [record['stages'][stage] for record in self.records if stage in record['stages']]
+            if stage_records:
+                summary['stages'][stage] = {
+                    'allocated_mean': sum(item['allocated'] for item in stage_records) / len(stage_records),
+                    'peak_mean': sum(item['peak'] for item in stage_records) / len(stage_records),
+                    'peak_max': max(item['peak'] for item in stage_records),
+                }
+        return summary
@@ -0,0 +1,285 @@
+import itertools
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from src.benchmark.receipt_accuracy import ReceiptAccuracy
+from src.benchmark.receipt_benchmark import ReceiptBenchmark
+from src.props.application_properties_builder import ApplicationPropertiesBuilder
+from src.props.application_properties_service import ApplicationPropertiesService
+from src.receipt_processors.receipt_service import ReceiptService
+from src.receipt_processors.util import Util
+from src.shared_image_store import SharedImageStore
+from src.storage.stage_cache import StageCache
+from src.tracer import Tracer, InMemoryTraceAggregator
+
+
+class ParameterSweep:
+    """
+    Class for tuning ApplicationProperties: candidate property sets (overrides
+    of the properties of ApplicationPropertiesBuilder given by dotted paths,
+    e.g. margin_properties.product_line_margin) are evaluated over the stored
+    receipts in worker processes and ranked by field accuracy against the
+    reference receipts (see ReceiptAccuracy), then by OCR time.
+
+    The workers share a StageCache file, so the split/OCR results which do
+    not depend on the swept properties are computed once for all candidates.
+    OCR time is estimated as if nothing was cached (OCR spans + compute time
+    of the cached OCR results), so the candidates are compared fairly.
+    The first candidate is always the baseline (no overrides).
+    The receipt images are decoded once and passed to the workers in shared
+    memory (see SharedImageStore), each block is freed after its last task.
+
+    Methods:
+        parse_parameter(text) -> (path, values) from 'path=v1,v2,...' or 'path=start:stop[:step]'
+        prepare_candidates(parameters, strategy, samples, seed) -> list of overrides dicts
+        apply_overrides(application_properties, overrides)
+        run(candidates, corpus) -> ranked candidate results
+        export_results(results, output_dir) -> path of the JSON results file
+    """
+    STRATEGY_GRID = 'grid'
+    STRATEGY_RANDOM = 'random'
+
+    def __init__(self, ocr_mode = ReceiptService.OCR_MODE_CROP_PER_FIELD, is_numeric_second_pass_on = False,
+                 stage_cache_path = os.path.join('logs', 'cache', 'stages.sqlite3'), workers = None, chunk_size = 5):
+        self.ocr_mode = ocr_mode
+        self.is_numeric_second_pass_on = is_numeric_second_pass_on
+        self.stage_cache_path = stage_cache_path
+        self.workers = workers if workers is not None else max((os.cpu_count() or 2) - 1, 1)
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def parse_parameter(text):
+        path, separator, values_text = text.partition('=')
+        if separator == '' or values_text == '':
+            raise ValueError(f"Parameter must be given as 'path=v1,v2,...' or 'path=start:stop[:step]': {text}")
+        range_parts = values_text.split(':')
+        numbers = [ParameterSweep._parse_value(part) for part in range_parts]
+        if len(range_parts) in (2, 3) and all(isinstance(number, (int, float)) for number in numbers):
+            start, stop = numbers[0], numbers[1]
+            step = numbers[2] if len(numbers) == 3 else 1
+            count = int(math.floor((stop - start) / step + 1e-9)) + 1
+            values = [start + i * step for i in range(count)]
+            if any(isinstance(number, float) for number in numbers):
+                values = [round(value, 10) for value in values]
+            return path.strip(), values
+        return path.strip(), [ParameterSweep._parse_value(value) for value in values_text.split(',')]
+
+    @staticmethod
+    def _parse_value(text):
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text
+
+    @staticmethod
+    def prepare_candidates(parameters, strategy = STRATEGY_GRID, samples = None, seed = 0):
+        """
+        Args:
+            parameters: list of (path, values)
+            strategy: grid (all combinations) or random ({samples} distinct combinations)
+            ...
+
+        Returns:
+            return: list of overrides dicts (path: value), the baseline ({}) first
+        """
+        paths = [path for path, _ in parameters]
+        value_lists = [values for _, values in parameters]
+        if strategy == ParameterSweep.STRATEGY_RANDOM and samples is not None:
+            total = math.prod(len(values) for values in value_lists)
+            # Combinations are decoded from sampled indexes, the grid itself is not built
+            indexes = random.Random(seed).sample(range(total), min(samples, total))
+            combinations = []
+            for index in indexes:
+                combination = []
+                for values in reversed(value_lists):
+                    index, value_index = divmod(index, len(values))
+                    combination.append(values[value_index])
+                combinations.append(list(reversed(combination)))
+        elif strategy in (ParameterSweep.STRATEGY_GRID, ParameterSweep.STRATEGY_RANDOM):
+            combinations = itertools.product(*value_lists)
+        else:
+            raise ValueError(f'Unknown strategy: {strategy}')
+        return [{}] + [dict(zip(paths, combination)) for combination in combinations]
+
+    @staticmethod
+    def apply_overrides(application_properties, overrides):
+        for path, value in overrides.items():
+            names = path.split('.')
+            target = application_properties
+            for name in names[:-1]:
+                target = getattr(target, name, None)
+            if target is None or not hasattr(target, names[-1]):
+                raise ValueError(f'Unknown property: {path}')
+            setattr(target, names[-1], value)
+
+    def run(self, candidates, corpus):
+        """
+        Args:
+            candidates: list of overrides dicts
+            corpus: list of (fiscal_code, image_path, reference_path)
+
+        Returns:
+            list of candidate results ranked from the best
+        """
+        records = [[] for _ in candidates]
+        arguments = (self.ocr_mode, self.is_numeric_second_pass_on, self.stage_cache_path)
+        start_time = time.perf_counter()
+        with SharedImageStore() as image_store:
+            # Images are decoded once and shared with the workers: a task carries only their handles
+            handles = {}
+            for fiscal_code, image_path, _ in corpus:
+                image_ekassa_gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+                if image_ekassa_gray is None:
+                    raise ValueError(f'Image could not be read: {image_path}')
+                handles[fiscal_code] = image_store.put(fiscal_code, image_ekassa_gray)
+            # Tasks of a candidate are queued together, so that the next candidates find its results in the stage cache
+            tasks = [(candidate_index, [(fiscal_code, image_store.acquire(fiscal_code), reference_path)
+                                        for fiscal_code, _, reference_path in corpus[i:i + self.chunk_size]])
+                     for candidate_index in range(len(candidates)) for i in range(0, len(corpus), self.chunk_size)]
+            for fiscal_code in handles:
+                image_store.release(fiscal_code)
+
+            if self.workers == 1:
+                for task_num, (candidate_index, chunk) in enumerate(tasks):
+                    records[candidate_index] += _evaluate_chunk(candidates[candidate_index], chunk, *arguments)
+                    ParameterSweep._release_chunk(image_store, chunk)
+                    ParameterSweep._print_progress(task_num + 1, len(tasks), start_time)
+            else:
+                with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                    futures = {executor.submit(_evaluate_chunk, candidates[candidate_index], chunk, *arguments):
+                               (candidate_index, chunk) for candidate_index, chunk in tasks}
+                    for task_num, future in enumerate(as_completed(futures)):
+                        candidate_index, chunk = futures[future]
+                        records[candidate_index] += future.result()
+                        ParameterSweep._release_chunk(image_store, chunk)
+                        ParameterSweep._print_progress(task_num + 1, len(tasks), start_time)
+        results = [ParameterSweep.summarize_candidate(candidate_index, candidates[candidate_index], records[candidate_index])
+                   for candidate_index in range(len(candidates))]
+        return ParameterSweep.rank(results)
+
+    @staticmethod
+    def _release_chunk(image_store, chunk):
+        for fiscal_code, _, _ in chunk:
+            image_store.release(fiscal_code)
+
+    @staticmethod
+    def _print_progress(done, total, start_time):
+        print(f'{done}/{total} tasks, {time.perf_counter() - start_time:.0f} s')
+
+    @staticmethod
+    def summarize_candidate(candidate_index, overrides, records):
+        return {
+            'candidate': candidate_index,
+            'overrides': overrides,
+            'receipt_count': len(records),
+            'error_count': sum(record['error'] is not None for record in records),
+            'field_accuracy_mean': float(np.mean([record['field_accuracy'] for record in records])) if records else 0.0,
+            'exact_rate': float(np.mean([record['is_exact'] for record in records])) if records else 0.0,
+            'ocr_time_mean': float(np.mean([record['ocr_time'] for record in records])) if records else 0.0,
+            'ocr_calls_mean': float(np.mean([record['ocr_calls'] for record in records])) if records else 0.0,
+            'latency_mean': float(np.mean([record['latency'] for record in records])) if records else 0.0,
+            'records': sorted(records, key=lambda record: record['fiscal_code']),
+        }
+
+    @staticmethod
+    def rank(results):
+        results = sorted(results, key=lambda result: (-result['field_accuracy_mean'], result['ocr_time_mean']))
+        # Pareto front: no other candidate is both at least as accurate and faster
+        for result in results:
+            result['is_pareto_optimal'] = not any(
+                other['field_accuracy_mean'] >= result['field_accuracy_mean'] and
+                other['ocr_time_mean'] < result['ocr_time_mean'] for other in results)
+        return results
+
+    def export_results(self, results, output_dir = os.path.join('logs', 'sweeps')):
+        os.makedirs(output_dir, exist_ok=True)
+        output = {
+            'commit': ReceiptBenchmark._get_commit(),
+            'date_time': Util.prepare_current_datetime(),
+            'config': {
+                'ocr_mode': self.ocr_mode,
+                'is_numeric_second_pass_on': self.is_numeric_second_pass_on,
+                'workers': self.workers,
+            },
+            'results': results,
+        }
+        results_file = os.path.join(output_dir, f'{output["date_time"]}_sweep.json')
+        with open(results_file, 'w', encoding='utf-8') as file:
+            json.dump(output, file, indent=2, ensure_ascii=False)
+        return results_file
+
+    @staticmethod
+    def print_ranking(results, top_n = 10):
+        baseline = next(result for result in results if result['candidate'] == 0)
+        print('<< Parameter sweep >>')
+        print(f'{"rank":<5} {"accuracy":>9} {"exact":>7} {"OCR time":>9} {"OCR calls":>10} {"errors":>7}  overrides')
+        for rank, result in enumerate(results[:top_n]):
+            print(f'{rank + 1:<5} {result["field_accuracy_mean"]:>9.4f} {result["exact_rate"]:>7.3f} '
+                  f'{result["ocr_time_mean"]:>8.2f}s {result["ocr_calls_mean"]:>10.1f} {result["error_count"]:>7}  '
+                  f'{result["overrides"] or "baseline"}{" *" if result["is_pareto_optimal"] else ""}')
+        print(f'Baseline: accuracy {baseline["field_accuracy_mean"]:.4f}, OCR time {baseline["ocr_time_mean"]:.2f} s '
+              f'(rank {results.index(baseline) + 1}); * Pareto optimal')
+
+
+_worker_stage_caches = {}
+
+
+def _evaluate_chunk(overrides, chunk, ocr_mode, is_numeric_second_pass_on, stage_cache_path):
+    """
+    Mines the receipts of the chunk with the candidate properties in the worker process
+    and compares them with the references.
+    """
+    application_properties = ApplicationPropertiesBuilder.prepare_application_properties_v_core_1_logic_0_depend_1(is_debug_on=False)
+    ParameterSweep.apply_overrides(application_properties, overrides)
+    ApplicationPropertiesService.load_properties(application_properties)
+    stage_cache = None
+    if stage_cache_path is not None:
+        if stage_cache_path not in _worker_stage_caches:
+            _worker_stage_caches[stage_cache_path] = StageCache(stage_cache_path)
+        stage_cache = _worker_stage_caches[stage_cache_path]
+    receipt_service = ReceiptService(ocr_mode=ocr_mode, is_numeric_second_pass_on=is_numeric_second_pass_on,
+                                     stage_cache=stage_cache)
+    receipt_accuracy = ReceiptAccuracy()
+    aggregator = InMemoryTraceAggregator()
+    records = []
+    Tracer.add_sink(aggregator)
+    try:
+        for fiscal_code, image_handle, reference_path in chunk:
+            aggregator.reset()
+            image_ekassa_gray = SharedImageStore.attach(image_handle)
+            receipt, error = None, None
+            start_time = time.perf_counter()
+            try:
+                receipt = receipt_service.mine_receipt(image_ekassa_gray=image_ekassa_gray, fiscal_code=fiscal_code)
+            except Exception as e:
+                error = type(e).__name__
+            latency = time.perf_counter() - start_time
+            del image_ekassa_gray
+            SharedImageStore.detach()
+            comparison = None
+            if receipt is not None:
+                comparison = receipt_accuracy.compare(receipt, ReceiptAccuracy.parse_receipt_log(reference_path))
+            ocr_totals = aggregator.get_span_totals('ocr')
+            cached_ocr_calls = aggregator.events.get(('stage_cache', 'ocr_hit'), 0)
+            records.append({
+                'fiscal_code': fiscal_code,
+                'latency': latency,
+                'error': error,
+                'field_accuracy': comparison['field_accuracy'] if comparison else 0.0,
+                'is_exact': comparison['is_exact'] if comparison else False,
+                'mismatches': comparison['mismatches'] if comparison else None,
+                'diffs': comparison['diffs'] if comparison else None,
+                'ocr_calls': ocr_totals['count'] + cached_ocr_calls,
+                'cached_ocr_calls': cached_ocr_calls,
+                'ocr_time': ocr_totals['wall_time'] + aggregator.get_event_cost('stage_cache', 'ocr_hit'),
+            })
+    finally:
+        Tracer.remove_sink(aggregator)
+    return records
@@ -0,0 +1,177 @@
+import os
+import re
+import shutil
+
+from rapidfuzz import fuzz
+
+from src.models.product import Product
+from src.models.receipt import Receipt
+from src.models.receipt_general_info import ReceiptGeneralInfo
+from src.models.receipt_payment_info import ReceiptPaymentInfo
+from src.models.receipt_product_list import ReceiptProductList
+
+
+class ReceiptAccuracy:
+    """
+    Class for scoring mined receipts against the reference receipts
+    (golden/references/receipt_[fiscal code].log, in the format of
+    Receipt.__str__). The references are copied from the receipt logs of
+    earlier runs (logs/receipts, rewritten by every debug run) and wrong
+    values in them are corrected by hand, so they are the ground truth;
+    copying never overwrites an existing reference.
+
+    Fields compared: general info fields (text, exact after whitespace
+    normalization), payment fields and product quantities, prices, amounts
+    (within {amount_tolerance}), product names (exact, the mean similarity
+    is reported too). Product lines are compared by position; missing and
+    extra lines count as mismatched fields.
+
+    Methods:
+        parse_receipt_log(path) -> Receipt instance
+        load_references(references_folder) -> dict of fiscal code: log path
+        load_corpus(receipts_folder, references_folder, limit) -> list of (fiscal_code, image_path, reference_path)
+        copy_references(receipt_logs_folder, references_folder) -> fiscal codes of the copied (new) references
+        compare(receipt, reference) -> dict of matched/total fields, field accuracy, mismatched fields and values
+    """
+    GENERAL_LABELS = {
+        'Object Name': 'name', 'Address': 'address', 'Code': 'code', 'Tax Payer': 'tax_payer_name', 'TIN': 'TIN',
+        'Receipt #': 'sale_receipt_num', 'Cashier': 'cashier_name', 'Date': 'date', 'Time': 'time',
+    }
+    PAYMENT_LABELS = {
+        'Total Amount': 'total_amount', 'Tax Amount': 'tax_amount', 'Non-Tax Amount': 'non_tax_amount',
+        'Cashless Payment': 'cashless_payment_amount', 'Cash Payment': 'cash_payment_amount',
+        'Paid Cash': 'paid_cash_amount', 'Change': 'change_cash_amount', 'Bonus': 'bonus',
+        'Prepayment': 'prepayment', 'Credit': 'credit',
+    }
+    PRODUCT_VALUE_FIELDS = ['quantity', 'price', 'amount']
+    REFERENCES_FOLDER = os.path.join('golden', 'references')
+
+    def __init__(self, amount_tolerance = 0.005):
+        self.amount_tolerance = amount_tolerance
+
+    @staticmethod
+    def parse_receipt_log(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            lines = file.read().splitlines()
+        general_values, payment_values, products = {}, {}, []
+        is_products_part = False
+        for line in lines:
+            if line.startswith('_' * 10):
+                is_products_part = not is_products_part
+                continue
+            if is_products_part:
+                match = re.fullmatch(r'(.*?)\s+(\S+)\s+(\S+)\s+(\S+)\s*', line)
+                if match is not None:
+                    name, quantity, price, amount = match.groups()
+                    products.append(Product(name.strip(), float(quantity), float(price), float(amount)))
+                continue
+            label, separator, value = line.partition(':')
+            if separator == '':
+                continue
+            label, value = label.strip(), value.strip()
+            if label in ReceiptAccuracy.GENERAL_LABELS:
+                general_values[ReceiptAccuracy.GENERAL_LABELS[label]] = value
+            elif label in ReceiptAccuracy.PAYMENT_LABELS:
+                try:
+                    payment_values[ReceiptAccuracy.PAYMENT_LABELS[label]] = float(value)
+                except ValueError:
+                    payment_values[ReceiptAccuracy.PAYMENT_LABELS[label]] = value
+        general_info = ReceiptGeneralInfo(*[general_values.get(field, '-') for field in ReceiptGeneralInfo.FIELDS])
+        payment_info = ReceiptPaymentInfo(*[payment_values.get(field, 0.0) for field in ReceiptPaymentInfo.FIELDS])
+        return Receipt(general_info, ReceiptProductList(products), payment_info)
+
+    @staticmethod
+    def load_references(references_folder = REFERENCES_FOLDER):
+        references = {}
+        for file_name in sorted(os.listdir(references_folder)):
+            if file_name.startswith('receipt_') and file_name.endswith('.log'):
+                references[file_name[len('receipt_'):-len('.log')]] = os.path.join(references_folder, file_name)
+        return references
+
+    @staticmethod
+    def load_corpus(receipts_folder = os.path.join('logs', 'receipts'), references_folder = REFERENCES_FOLDER, limit = None):
+        # Only the stored images having a reference
+        references = ReceiptAccuracy.load_references(references_folder)
+        corpus = []
+        for file_name in sorted(os.listdir(receipts_folder)):
+            fiscal_code = file_name[len('receipt_'):-len('.jpg')]
+            if file_name.startswith('receipt_') and file_name.endswith('.jpg') and fiscal_code in references:
+                corpus.append((fiscal_code, os.path.join(receipts_folder, file_name), references[fiscal_code]))
+        return corpus[:limit] if limit is not None else corpus
+
+    @staticmethod
+    def copy_references(receipt_logs_folder = os.path.join('logs', 'receipts'), references_folder = REFERENCES_FOLDER):
+        os.makedirs(references_folder, exist_ok=True)
+        existing_references = ReceiptAccuracy.load_references(references_folder)
+        copied_fiscal_codes = []
+        for fiscal_code, log_path in ReceiptAccuracy.load_references(receipt_logs_folder).items():
+            if fiscal_code not in existing_references:
+                shutil.copyfile(log_path, os.path.join(references_folder, os.path.basename(log_path)))
+                copied_fiscal_codes.append(fiscal_code)
+        return copied_fiscal_codes
+
+    def compare(self, receipt, reference):
+        """
+        Args:
+            receipt: mined Receipt instance
+            reference: reference Receipt instance
+            ...
+
+        Returns:
+            return: dict (matched, total, field_accuracy, is_exact, name_similarity,
+                    mismatches (field names), diffs (field, value, reference))
+        """
+        diffs = []
+        for field in ReceiptGeneralInfo.FIELDS:
+            value = ReceiptAccuracy._normalize_text(getattr(receipt.general_info, field))
+            reference_value = ReceiptAccuracy._normalize_text(getattr(reference.general_info, field))
+            if value != reference_value:
+                diffs.append({'field': f'general.{field}', 'value': value, 'reference': reference_value})
+        for field in ReceiptPaymentInfo.FIELDS:
+            value, reference_value = getattr(receipt.payment_info, field), getattr(reference.payment_info, field)
+            if not self._are_amounts_equal(value, reference_value):
+                diffs.append({'field': f'payment.{field}', 'value': value, 'reference': reference_value})
+
+        products, reference_products = receipt.product_list.products, reference.product_list.products
+        name_similarities = []
+        for i in range(max(len(products), len(reference_products))):
+            if i >= len(products) or i >= len(reference_products):
+                product, reference_product = products[i] if i < len(products) else None, \
+                    reference_products[i] if i < len(reference_products) else None
+                diffs += [{'field': f'products[{i}].{field}',
+                           'value': getattr(product, field) if product is not None else None,
+                           'reference': getattr(reference_product, field) if reference_product is not None else None}
+                          for field in ['name'] + ReceiptAccuracy.PRODUCT_VALUE_FIELDS]
+                name_similarities.append(0)
+                continue
+            name = ReceiptAccuracy._normalize_text(products[i].name)
+            reference_name = ReceiptAccuracy._normalize_text(reference_products[i].name)
+            name_similarities.append(fuzz.ratio(name, reference_name) / 100)
+            if name != reference_name:
+                diffs.append({'field': f'products[{i}].name', 'value': name, 'reference': reference_name})
+            for field in ReceiptAccuracy.PRODUCT_VALUE_FIELDS:
+                value, reference_value = getattr(products[i], field), getattr(reference_products[i], field)
+                if not self._are_amounts_equal(value, reference_value):
+                    diffs.append({'field': f'products[{i}].{field}', 'value': value, 'reference': reference_value})
+
+        total = (len(ReceiptGeneralInfo.FIELDS) + len(ReceiptPaymentInfo.FIELDS) +
+                 (1 + len(ReceiptAccuracy.PRODUCT_VALUE_FIELDS)) * max(len(products), len(reference_products)))
+        return {
+            'matched': total - len(diffs),
+            'total': total,
+            'field_accuracy': (total - len(diffs)) / total,
+            'is_exact': len(diffs) == 0,
+            'name_similarity': sum(name_similarities) / len(name_similarities) if name_similarities else 1.0,
+            'mismatches': [diff['field'] for diff in diffs],
+            'diffs': diffs,
+        }
+
+    @staticmethod
+    def _normalize_text(value):
+        return ' '.join(str(value).split())
+
+    def _are_amounts_equal(self, value, reference_value):
+        try:
+            return abs(float(value) - float(reference_value)) <= self.amount_tolerance
+        except (TypeError, ValueError):
+            return False
@@ -0,0 +1,178 @@
+import json
+import os
+import subprocess
+import time
+
+import cv2
+import numpy as np
+
+from src.props.application_properties_service import ApplicationPropertiesService
+from src.receipt_processors.util import Util
+from src.tracer import Tracer, InMemoryTraceAggregator
+
+
+class ReceiptBenchmark:
+    """
+    Class for running ReceiptService.mine_receipt over the stored receipt images
+    (offline, without E-kassa access) and reporting latency, throughput,
+    OCR call counts and per stage timings.
+    Stage timings are taken from the Tracer spans of the pipeline.
+
+    Stages:
+        split: splitting the receipt into general, products, payments parts
+        general, products, payment: NER on the corresponding parts
+                                    (payment includes the consistency checks)
+
+    Methods:
+        load_corpus(receipt_images_folder, limit = None) -> list of (fiscal_code, image_path)
+        run(receipt_service, corpus) -> list of per receipt records
+        summarize(records, wall_time) -> summary dict
+        export_results(records, summary, receipt_service, output_dir) -> path of the JSON results file
+    """
+    STAGES = ['split', 'general', 'products', 'payment']
+
+    def __init__(self):
+        self._receipt_aggregator = InMemoryTraceAggregator()
+        self.run_aggregator = InMemoryTraceAggregator()
+
+    @staticmethod
+    def load_corpus(receipt_images_folder=os.path.join('logs', 'receipts'), limit=None):
+        image_names = sorted(name for name in os.listdir(receipt_images_folder) if name.endswith('.jpg'))
+        if limit is not None:
+            image_names = image_names[:limit]
+        corpus = []
+        for image_name in image_names:
+            fiscal_code = image_name[len('receipt_'):-len('.jpg')]
+            corpus.append((fiscal_code, os.path.join(receipt_images_folder, image_name)))
+        return corpus
+
+    def run(self, receipt_service, corpus):
+        """
+        Mines each receipt of the corpus, timing the stages.
+
+        Args:
+            receipt_service: ReceiptService instance
+            corpus: list of (fiscal_code, image_path)
+
+        Returns:
+            list of per receipt records
+        """
+        records = []
+        Tracer.add_sink(self._receipt_aggregator)
+        Tracer.add_sink(self.run_aggregator)
+        try:
+            for i in range(len(corpus)):
+                fiscal_code, image_path = corpus[i]
+                image_ekassa_gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+                self._receipt_aggregator.reset()
+                error = None
+                start_time = time.perf_counter()
+                try:
+                    receipt_service.mine_receipt(image_ekassa_gray=image_ekassa_gray, fiscal_code=fiscal_code)
+                except Exception as e:
+                    error = type(e).__name__
+                latency = time.perf_counter() - start_time
+                record = self._prepare_record(fiscal_code, latency, error)
+                records.append(record)
+                print(f'{i + 1}. {fiscal_code}: {latency:.2f} s, {record["ocr_calls"]} OCR calls' +
+                      (f' ({error})' if error else ''))
+        finally:
+            Tracer.remove_sink(self._receipt_aggregator)
+            Tracer.remove_sink(self.run_aggregator)
+        return records
+
+    def _prepare_record(self, fiscal_code, latency, error):
+        aggregator = self._receipt_aggregator
+        ocr_totals = aggregator.get_span_totals('ocr')
+        return {
+            'fiscal_code': fiscal_code,
+            'latency': latency,
+            'ocr_calls': ocr_totals['count'],
+            'ocr_pixels': ocr_totals['ocr_pixels'],
+            'stage_times': {stage: aggregator.get_span_totals(stage)['wall_time'] for stage in ReceiptBenchmark.STAGES},
+            'stage_ocr_calls': {stage: aggregator.get_span_totals(stage)['ocr_calls'] for stage in ReceiptBenchmark.STAGES},
+            'events': {f'{name}:{kind}': count for (name, kind), count in aggregator.events.items()},
+            'error': error,
+        }
+
+    @staticmethod
+    def summarize(records, wall_time):
+        """
+        Args:
+            records: list of per receipt records
+            wall_time: total time of the run in seconds
+
+        Returns:
+            summary dict (latency percentiles, receipts/sec, OCR calls, mean stage times)
+        """
+        latencies = np.array([record['latency'] for record in records])
+        ocr_calls = np.array([record['ocr_calls'] for record in records])
+        errors = {}
+        for record in records:
+            if record['error'] is not None:
+                errors[record['error']] = errors.get(record['error'], 0) + 1
+
+        summary = {
+            'receipt_count': len(records),
+            'error_count': sum(errors.values()),
+            'errors': errors,
+            'wall_time': wall_time,
+            'receipts_per_second': len(records) / wall_time if wall_time > 0 else None,
+        }
+        if len(records) == 0:
+            return summary
+        summary.update({
+            'latency_p50': float(np.percentile(latencies, 50)),
+            'latency_p95': float(np.percentile(latencies, 95)),
+            'latency_p99': float(np.percentile(latencies, 99)),
+            'latency_mean': float(latencies.mean()),
+            'ocr_calls_total': int(ocr_calls.sum()),
+            'ocr_calls_mean': float(ocr_calls.mean()),
+            'ocr_pixels_mean': float(np.mean([record['ocr_pixels'] for record in records])),
+            'stage_times_mean': {stage: float(np.mean([record['stage_times'][stage] for record in records]))
+                                 for stage in ReceiptBenchmark.STAGES},
+            'stage_ocr_calls_mean': {stage: float(np.mean([record['stage_ocr_calls'][stage] for record in records]))
+                                     for stage in ReceiptBenchmark.STAGES},
+        })
+        return summary
+
+    @staticmethod
+    def export_results(records, summary, receipt_service, output_dir=os.path.join('logs', 'benchmarks'), trace_totals=None,
+                       memory=None):
+        os.makedirs(output_dir, exist_ok=True)
+        results = {
+            'commit': ReceiptBenchmark._get_commit(),
+            'date_time': Util.prepare_current_datetime(),
+            'config': {
+                'ocr_mode': receipt_service.ocr_mode,
+                'is_numeric_second_pass_on': receipt_service.is_numeric_second_pass_on,
+                'is_pixel_budget_on': ApplicationPropertiesService.pixel_budget_properties.is_pixel_budget_on,
+                'properties_version': ApplicationPropertiesService.version,
+            },
+            'summary': summary,
+            'trace_totals': trace_totals,
+            'memory': memory,
+            'records': records,
+        }
+        results_file = os.path.join(output_dir, f'{results["date_time"]}_benchmark.json')
+        with open(results_file, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        return results_file
+
+    @staticmethod
+    def print_summary(summary):
+        print('<< Benchmark >>')
+        for key in ['receipt_count', 'error_count', 'wall_time', 'receipts_per_second',
+                    'latency_p50', 'latency_p95', 'latency_p99', 'ocr_calls_mean', 'ocr_pixels_mean']:
+            if key in summary:
+                print(f'{key:<20}: {summary[key]}')
+        for stage, stage_time in summary.get('stage_times_mean', {}).items():
+            print(f'{stage:<20}: {stage_time:.3f} s, {summary["stage_ocr_calls_mean"][stage]:.1f} OCR calls')
+
+    @staticmethod
+    def _get_commit():
+        try:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
@@ -0,0 +1,183 @@
+import gc
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from src.benchmark.memory_profiler import MemoryProfiler
+from src.benchmark.receipt_benchmark import ReceiptBenchmark
+from src.receipt_processors.util import Util
+
+
+class SoakTestRunner:
+    """
+    Class for the long-run soak test of ReceiptService: loops the receipt
+    corpus for the given duration and reports memory growth (RSS, traced
+    Python memory) and the allocation sites which grew the most since warmup.
+    RSS is also sampled every {rss_interval} seconds by a background thread,
+    so the peak during a receipt (OCR) is reported next to the value taken
+    after it.
+
+    Methods:
+        run(duration_hours, max_receipts = None) -> report dict
+        export_results(report, output_dir) -> path of the JSON results file
+    """
+
+    def __init__(self, receipt_service, corpus, sample_every = 10, warmup_receipts = None,
+                 traceback_frames = 5, top_n = 20, rss_interval = 0.05):
+        self.receipt_service = receipt_service
+        self.corpus = corpus
+        self.sample_every = sample_every
+        # One pass over the corpus fills the caches before the baseline is taken
+        self.warmup_receipts = len(corpus) if warmup_receipts is None else warmup_receipts
+        self.top_n = top_n
+        self.profiler = MemoryProfiler(traceback_frames=traceback_frames, top_n=top_n)
+        self.rss_interval = rss_interval
+        self._rss_peak = 0
+        self._rss_lock = threading.Lock()
+
+    def run(self, duration_hours, max_receipts = None):
+        """
+        Args:
+            duration_hours: soak test duration
+            max_receipts: stops earlier after this number of receipts (if given)
+
+        Returns:
+            report dict (samples, growth, top allocation sites)
+        """
+        samples, errors = [], {}
+        baseline_snapshot, baseline_sample = None, None
+        receipt_count = 0
+        window_peaks = []
+        self.profiler.start()
+        self._rss_peak = 0
+        is_stopped = threading.Event()
+        rss_thread = threading.Thread(target=self._sample_rss, args=(is_stopped,), daemon=True)
+        rss_thread.start()
+        start_time = time.perf_counter()
+        end_time = start_time + duration_hours * 3600
+        try:
+            while time.perf_counter() < end_time and (max_receipts is None or receipt_count < max_receipts):
+                fiscal_code, image_path = self.corpus[receipt_count % len(self.corpus)]
+                image_ekassa_gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+                try:
+                    self.receipt_service.mine_receipt(image_ekassa_gray=image_ekassa_gray, fiscal_code=fiscal_code)
+                except Exception as e:
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                del image_ekassa_gray
+                receipt_count += 1
+
+                # Records are drained so that the profiler itself does not grow
+                window_peaks += [record['traced_peak'] for record in self.profiler.records]
+                self.profiler.records.clear()
+
+                if receipt_count == self.warmup_receipts:
+                    gc.collect()
+                    baseline_snapshot = self.profiler.take_snapshot()
+                    baseline_sample = self._take_sample(start_time, receipt_count, window_peaks)
+                    samples.append(baseline_sample)
+                    window_peaks = []
+                elif receipt_count % self.sample_every == 0:
+                    samples.append(self._take_sample(start_time, receipt_count, window_peaks))
+                    window_peaks = []
+                    print(f'{receipt_count} receipts, {samples[-1]["elapsed"] / 60:.1f} min, '
+                          f'RSS {samples[-1]["rss"] / 2 ** 20:.1f} MB (peak {samples[-1]["rss_peak"] / 2 ** 20:.1f} MB), '
+                          f'traced {samples[-1]["traced_current"] / 2 ** 20:.1f} MB')
+
+            gc.collect()
+            final_sample = self._take_sample(start_time, receipt_count, window_peaks)
+            samples.append(final_sample)
+            top_allocations = []
+            if baseline_snapshot is not None:
+                top_allocations = MemoryProfiler.compare_snapshots(baseline_snapshot, self.profiler.take_snapshot(), self.top_n)
+        finally:
+            is_stopped.set()
+            rss_thread.join()
+            self.profiler.stop()
+
+        return {
+            'receipt_count': receipt_count,
+            'duration': time.perf_counter() - start_time,
+            'errors': errors,
+            'growth': SoakTestRunner.calculate_growth(samples, baseline_sample),
+            'rss_peak_max': max(sample['rss_peak'] for sample in samples),
+            'top_allocations': top_allocations,
+            'samples': samples,
+        }
+
+    def _sample_rss(self, is_stopped):
+        while not is_stopped.wait(self.rss_interval):
+            rss = self.profiler.get_rss()
+            with self._rss_lock:
+                self._rss_peak = max(self._rss_peak, rss)
+
+    def _take_sample(self, start_time, receipt_count, window_peaks):
+        traced_current, _ = tracemalloc.get_traced_memory()
+        rss = self.profiler.get_rss()
+        # Peak of the background samples since the previous sample
+        with self._rss_lock:
+            rss_peak, self._rss_peak = max(self._rss_peak, rss), 0
+        return {
+            'elapsed': time.perf_counter() - start_time,
+            'receipt_count': receipt_count,
+            'rss': rss,
+            'rss_peak': rss_peak,
+            'traced_current': traced_current,
+            'traced_peak_max': max(window_peaks) if window_peaks else None,
+        }
+
+    @staticmethod
+    def calculate_growth(samples, baseline_sample):
+        """
+        Memory growth after the warmup: total and per hour / per 1000 receipts
+        (slope of a linear fit over the samples).
+        """
+        if baseline_sample is None:
+            return None
+        samples = [sample for sample in samples if sample['receipt_count'] >= baseline_sample['receipt_count']]
+        growth = {
+            'rss_growth': samples[-1]['rss'] - baseline_sample['rss'],
+            'traced_growth': samples[-1]['traced_current'] - baseline_sample['traced_current'],
+        }
+        if len(samples) >= 2 and samples[-1]['elapsed'] > samples[0]['elapsed']:
+            elapsed_hours = np.array([sample['elapsed'] for sample in samples]) / 3600
+            receipt_counts = np.array([sample['receipt_count'] for sample in samples])
+            for key in ['rss', 'traced_current']:
+                values = np.array([sample[key] for sample in samples], dtype=np.float64)
+                growth[f'{key}_growth_per_hour'] = float(np.polyfit(elapsed_hours, values, 1)[0])
+                growth[f'{key}_growth_per_1000_receipts'] = float(np.polyfit(receipt_counts, values, 1)[0] * 1000)
+        return growth
+
+    def export_results(self, report, output_dir = os.path.join('logs', 'soak')):
+        os.makedirs(output_dir, exist_ok=True)
+        results = {
+            'commit': ReceiptBenchmark._get_commit(),
+            'date_time': Util.prepare_current_datetime(),
+            'config': {
+                'ocr_mode': self.receipt_service.ocr_mode,
+                'is_numeric_second_pass_on': self.receipt_service.is_numeric_second_pass_on,
+                'corpus_size': len(self.corpus),
+            },
+            'report': report,
+        }
+        results_file = os.path.join(output_dir, f'{results["date_time"]}_soak.json')
+        with open(results_file, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        return results_file
+
+    @staticmethod
+    def print_report(report):
+        print('<< Soak test >>')
+        print(f'{"receipt_count":<40}: {report["receipt_count"]}')
+        print(f'{"duration":<40}: {report["duration"]:.1f} s')
+        print(f'{"errors":<40}: {report["errors"]}')
+        print(f'{"rss_peak_max":<40}: {report["rss_peak_max"] / 2 ** 20:.2f} MB')
+        for key, value in (report['growth'] or {}).items():
+            print(f'{key:<40}: {value / 2 ** 20:.2f} MB')
+        print('Top allocation sites since warmup:')
+        for allocation in report['top_allocations']:
+            print(f'  {allocation["size_diff"] / 2 ** 10:>10.1f} KB  {allocation["location"]}')
@@ -0,0 +1,157 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from src.tracer import Tracer
+
+
+class EkassaRateLimiter:
+    """
+    Class for the client-side rate limiter of the E-kassa requests: a token
+    bucket of {max_rate} requests per second ({burst} at once) shared by the
+    threads of the process, where waiting requests get the tokens by
+    priority class (interactive bot requests before batch ones), then in
+    arrival order.
+
+    Adaptive slowdown: a 429/5xx response halves the current rate (by
+    {decrease_factor}, down to {min_rate}) at most once per 1 / rate
+    seconds, so a burst of concurrent failures counts as one, and a
+    Retry-After header holds all requests for that long; each successful
+    response raises the rate by {increase_step} again, up to {max_rate}.
+    Failed connections (no response) are counted but do not slow down,
+    as they are not throttling by the server.
+    {max_rate} None means no limit (responses are still counted).
+
+    Bot and batch processes have their own limiters, so a batch process
+    sharing the E-kassa quota with the bot is given a lower EKASSA_MAX_RPS.
+
+    Methods:
+        from_env() -> limiter configured by EKASSA_MAX_RPS, EKASSA_BURST ('0' or '' is no limit)
+        acquire(priority) -> seconds waited for the token
+        on_response(status_code, retry_after = None)
+        get_stats() -> current rate, queued/sent counts and wait time by priority, throttled responses, failed requests
+    """
+    PRIORITY_INTERACTIVE = 0
+    PRIORITY_BATCH = 1
+    PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BATCH: 'batch'}
+
+    def __init__(self, max_rate = 5.0, burst = None, min_rate = 0.2, decrease_factor = 0.5, increase_step = None,
+                 max_retry_after = 60.0):
+        self.max_rate = max_rate
+        self.burst = burst if burst is not None else max(max_rate or 1.0, 1.0)
+        self.min_rate = min(min_rate, max_rate) if max_rate is not None else min_rate
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step if increase_step is not None else (max_rate or 0.0) / 20
+        self.max_retry_after = max_retry_after
+        self.rate = max_rate
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._decreased_at = None
+        self._condition = threading.Condition()
+        self._waiters = []
+        self._arrival_nums = itertools.count()
+        self._stats = {priority: {'queued': 0, 'sent': 0, 'wait_time': 0.0} for priority in EkassaRateLimiter.PRIORITY_NAMES}
+        self._throttled_responses = 0
+        self._failed_requests = 0
+
+    @staticmethod
+    def from_env():
+        max_rate = float(os.getenv('EKASSA_MAX_RPS', '5') or 0)
+        burst = os.getenv('EKASSA_BURST')
+        return EkassaRateLimiter(max_rate=max_rate if max_rate > 0 else None, burst=float(burst) if burst else None)
+
+    def acquire(self, priority = PRIORITY_BATCH):
+        start_time = time.monotonic()
+        with self._condition:
+            if self.max_rate is None:
+                self._stats[priority]['sent'] += 1
+                return 0.0
+            ticket = (priority, next(self._arrival_nums))
+            heapq.heappush(self._waiters, ticket)
+            is_queued = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._waiters[0] == ticket and now >= self._blocked_until and self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+                    is_queued = True
+                    if self._waiters[0] != ticket:
+                        # Woken up when a request ahead got its token
+                        timeout = None
+                    elif now < self._blocked_until:
+                        timeout = self._blocked_until - now
+                    else:
+                        timeout = (1 - self._tokens) / self.rate
+                    self._condition.wait(timeout)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+            wait_time = time.monotonic() - start_time
+            self._stats[priority]['sent'] += 1
+            self._stats[priority]['wait_time'] += wait_time
+            if is_queued:
+                self._stats[priority]['queued'] += 1
+        if is_queued:
+            Tracer.event('ekassa_rate_limiter', kind=f'{EkassaRateLimiter.PRIORITY_NAMES[priority]}_queued', cost=wait_time)
+        return wait_time
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def on_response(self, status_code, retry_after = None):
+        """
+        Args:
+            status_code: HTTP status of the response (None if the request failed without a response)
+            retry_after: Retry-After header of the response (seconds)
+        """
+        if status_code is None:
+            with self._condition:
+                self._failed_requests += 1
+            return
+        is_throttled = status_code == 429 or status_code >= 500
+        with self._condition:
+            if is_throttled:
+                self._throttled_responses += 1
+            if self.max_rate is None:
+                return
+            now = time.monotonic()
+            self._refill(now)
+            if is_throttled:
+                # The failures of the requests sent at the old rate are answered within about one interval
+                if self._decreased_at is None or now - self._decreased_at >= 1 / self.rate:
+                    self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+                    self._decreased_at = now
+                retry_after = EkassaRateLimiter._parse_retry_after(retry_after)
+                if retry_after is not None:
+                    self._blocked_until = max(self._blocked_until, now + min(retry_after, self.max_retry_after))
+            elif status_code < 400:
+                self.rate = min(self.max_rate, self.rate + self.increase_step)
+            self._condition.notify_all()
+        if is_throttled:
+            Tracer.event('ekassa_rate_limiter', kind='throttled')
+
+    @staticmethod
+    def _parse_retry_after(retry_after):
+        # Only the delay in seconds is supported (not the HTTP date form)
+        try:
+            return max(float(retry_after), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                'rate': self.rate,
+                'max_rate': self.max_rate,
+                'waiting': len(self._waiters),
+                'throttled_responses': self._throttled_responses,
+                'failed_requests': self._failed_requests,
+                **{EkassaRateLimiter.PRIORITY_NAMES[priority]: dict(stats) for priority, stats in self._stats.items()},
+            }
@@ -0,0 +1,59 @@
+import threading
+
+
+class InFlightRegistry:
+    """
+    Class for the registry of the jobs in progress by key (fiscal code), so
+    that concurrent requests for the same key share a single job (single
+    flight): the first request starts it, the ones arriving before it is done
+    get the same Future, and the key is released when the job is done.
+
+    Unlike a persistent cache (ReceiptCache), nothing is kept after the job:
+    a request arriving later starts a new job (which may then hit the cache).
+    The result object is shared by the requesters, so it is not to be modified
+    per request.
+
+    Methods:
+        get_or_start(key, start_job) -> (Future of the job, whether the request joined a job in progress)
+        get_stats() -> jobs in flight, started and joined request counts
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._started_count = 0
+        self._joined_count = 0
+
+    def get_or_start(self, key, start_job):
+        """
+        Args:
+            key: key of the job (e.g. fiscal code)
+            start_job: function starting the job, returning its concurrent.futures.Future
+
+        Returns:
+            return: (Future of the job, True if the request joined a job in progress)
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                self._joined_count += 1
+                return future, True
+            # Started under the lock, so a concurrent request for the key cannot start a second job
+            future = start_job()
+            self._futures[key] = future
+            self._started_count += 1
+        future.add_done_callback(lambda done_future: self._release(key, done_future))
+        return future, False
+
+    def _release(self, key, future):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._futures),
+                'started': self._started_count,
+                'joined': self._joined_count,
+            }
@@ -30,8 +30,8 @@ class LowLevelReceiptMinerLogger:
         - tag (str): keyword as recognition phase definition.
         - text (str): Text to log.
         """
-        image_id = ApplicationPropertiesService.current_receipt_fiscal_code
-        receipt_processing_start_date_time = ApplicationPropertiesService.current_receipt_processing_start_date_time
+        image_id = ApplicationPropertiesService.get_current_receipt_fiscal_code()
+        receipt_processing_start_date_time = ApplicationPropertiesService.get_current_receipt_processing_start_date_time()
         fiscal_code_dir = os.path.join(self.output_dir, subdirectory,
                                        f'{image_id}_{receipt_processing_start_date_time}')
         os.makedirs(fiscal_code_dir, exist_ok=True)
@@ -50,8 +50,8 @@ class LowLevelReceiptMinerLogger:
         - tag (str): keyword as recognition phase definition.
         - image (numpy.ndarray): Image to save.
         """
-        image_id = ApplicationPropertiesService.current_receipt_fiscal_code
-        receipt_processing_start_date_time = ApplicationPropertiesService.current_receipt_processing_start_date_time
+        image_id = ApplicationPropertiesService.get_current_receipt_fiscal_code()
+        receipt_processing_start_date_time = ApplicationPropertiesService.get_current_receipt_processing_start_date_time()
         image_name = LowLevelReceiptMinerLogger.sanitize_string(f"{tag}.jpg")
         fiscal_code_dir = os.path.join(self.output_dir, subdirectory,
                                        f'{image_id}_{receipt_processing_start_date_time}')
@@ -70,7 +70,7 @@ class LowLevelReceiptMinerLogger:
         - tag (str): keyword as recognition phase definition.
         - text (str): Text to log.
         """
-        image_id = ApplicationPropertiesService.current_receipt_fiscal_code
+        image_id = ApplicationPropertiesService.get_current_receipt_fiscal_code()
         os.makedirs(self.output_dir, exist_ok=True)
         receipts_path = os.path.join(self.output_dir, 'receipts')
         os.makedirs(receipts_path, exist_ok=True)
@@ -81,7 +81,7 @@ class LowLevelReceiptMinerLogger:
         # logging.info(f"Logged {tag} for {image_id}")
 
     def log_receipt_image(self, tag, image):
-        image_id = ApplicationPropertiesService.current_receipt_fiscal_code
+        image_id = ApplicationPropertiesService.get_current_receipt_fiscal_code()
         receipts_path = os.path.join(self.output_dir, 'receipts')
         os.makedirs(receipts_path, exist_ok=True)
         image_file = os.path.join(receipts_path, LowLevelReceiptMinerLogger.sanitize_string(f"receipt_{image_id}.jpg"))
@@ -89,7 +89,7 @@ class LowLevelReceiptMinerLogger:
         # logging.info(f"Logged image for {image_id} during {tag}")
 
     def log_image_for_debug(self, tag, image):
-        image_id = ApplicationPropertiesService.current_receipt_fiscal_code
+        image_id = ApplicationPropertiesService.get_current_receipt_fiscal_code()
         folder_path = os.path.join(self.output_dir, 'temp')
         os.makedirs(folder_path, exist_ok=True)
         image_file = os.path.join(folder_path, LowLevelReceiptMinerLogger.sanitize_string(f"{tag}_{image_id}.jpg"))
@@ -0,0 +1,288 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(label_names, label_values, extra_labels = None):
+    labels = list(zip(label_names, label_values))
+    if extra_labels is not None:
+        labels += extra_labels
+    if not labels:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+               for name, value in labels]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class _Metric:
+    TYPE = None
+
+    def __init__(self, name, documentation, label_names = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f'{self.name} expects labels {self.label_names}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def get_samples(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.TYPE}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines += self._render_sample(label_values, value)
+        return lines
+
+    def _render_sample(self, label_values, value):
+        return [f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}']
+
+
+class Counter(_Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class _FunctionMetric(_Metric):
+    def __init__(self, name, documentation, label_names = ()):
+        super().__init__(name, documentation, label_names)
+        self._functions = {}
+
+    def set_function(self, function, **labels):
+        """
+        Value is obtained by calling {function} on each scrape (e.g. size of a queue).
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def get(self, **labels):
+        key = self._key(labels)
+        if key in self._functions:
+            return self._functions[key]()
+        return self._values.get(key, 0)
+
+    def render(self):
+        with self._lock:
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                value = function()
+            except Exception:
+                continue
+            with self._lock:
+                self._values[key] = value
+        return super().render()
+
+
+class Gauge(_FunctionMetric):
+    TYPE = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class FunctionCounter(_FunctionMetric):
+    """
+    Counter whose values are totals kept elsewhere (e.g. cache hits),
+    read by calling the set functions on each scrape.
+    """
+    TYPE = 'counter'
+
+
+class Histogram(_Metric):
+    TYPE = 'histogram'
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+    def __init__(self, name, documentation, label_names = (), buckets = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            bucket_counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i in range(len(self.buckets)):
+                if value <= self.buckets[i]:
+                    bucket_counts[i] += 1
+            self._values[key] = (bucket_counts, total + value)
+
+    def time(self, **labels):
+        return _HistogramTimer(self, labels)
+
+    def get_count(self, **labels):
+        bucket_counts, _ = self._values.get(self._key(labels), ([0] * len(self.buckets), 0.0))
+        return bucket_counts[-1]
+
+    def _render_sample(self, label_values, value):
+        bucket_counts, total = value
+        lines = []
+        for bucket, count in zip(self.buckets, bucket_counts):
+            labels = _format_labels(self.label_names, label_values, [('le', _format_value(bucket))])
+            lines.append(f'{self.name}_bucket{labels} {count}')
+        labels = _format_labels(self.label_names, label_values)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {bucket_counts[-1]}')
+        return lines
+
+
+class _HistogramTimer:
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+        self._start_time = None
+
+    def __enter__(self):
+        self._start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._histogram.observe(time.perf_counter() - self._start_time, **self._labels)
+        return False
+
+
+class MetricsRegistry:
+    """
+    Class for keeping metrics (counters, gauges, histograms) of a process
+    and exposing them in Prometheus text format on a local HTTP endpoint.
+
+    Methods:
+        counter(name, documentation, label_names) -> Counter (created once, then reused)
+        function_counter(name, documentation, label_names) -> FunctionCounter (totals read by functions on scrape)
+        gauge(name, documentation, label_names) -> Gauge (point-in-time values)
+        histogram(name, documentation, label_names, buckets) -> Histogram
+        render() -> metrics in Prometheus text format
+        start_http_server(port, host) -> serves GET /metrics in a daemon thread
+    """
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def counter(self, name, documentation, label_names = ()):
+        return self._register(Counter, name, documentation, label_names)
+
+    def function_counter(self, name, documentation, label_names = ()):
+        return self._register(FunctionCounter, name, documentation, label_names)
+
+    def gauge(self, name, documentation, label_names = ()):
+        return self._register(Gauge, name, documentation, label_names)
+
+    def histogram(self, name, documentation, label_names = (), buckets = Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, label_names, buckets = buckets)
+
+    def _register(self, metric_class, name, documentation, label_names, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, documentation, label_names, **kwargs)
+            elif type(metric) is not metric_class or metric.label_names != tuple(label_names):
+                raise ValueError(f'Metric {name} is already registered with another type or labels')
+            return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+    def start_http_server(self, port, host = '127.0.0.1'):
+        registry = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                content = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', MetricsRegistry.CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        thread = threading.Thread(target=self._server.serve_forever, name='metrics-http-server', daemon=True)
+        thread.start()
+        return self._server
+
+    def stop_http_server(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class MetricsTraceSink:
+    """
+    Tracer sink turning the spans of the receipt pipeline into duration
+    histograms, OCR calls into counters by (config, lang) and
+    fallback/retry events into counters by (name, kind).
+    """
+    STAGE_SPANS = ('mine_receipt', 'ekassa_fetch', 'split', 'general', 'products', 'payment')
+
+    def __init__(self, registry):
+        self.stage_durations = registry.histogram('receipt_stage_duration_seconds',
+                                                  'Duration of the receipt processing stages', ['stage'])
+        self.ocr_calls = registry.counter('ocr_calls_total', 'OCR calls', ['config', 'lang'])
+        self.ocr_duration = registry.counter('ocr_duration_seconds_total', 'Time spent in OCR calls', ['config', 'lang'])
+        self.ocr_pixels = registry.counter('ocr_pixels_total', 'Pixels sent to OCR', ['config', 'lang'])
+        self.events = registry.counter('receipt_events_total', 'Fallbacks and retries in the receipt processing',
+                                       ['name', 'kind'])
+
+    def on_span_start(self, span):
+        pass
+
+    def on_span(self, span):
+        if span.name == 'ocr':
+            labels = {'config': span.attributes.get('config'), 'lang': span.attributes.get('lang')}
+            self.ocr_calls.inc(**labels)
+            self.ocr_duration.inc(span.wall_time, **labels)
+            self.ocr_pixels.inc(span.ocr_pixels, **labels)
+        elif span.name in MetricsTraceSink.STAGE_SPANS:
+            self.stage_durations.observe(span.wall_time, stage=span.name)
+
+    def on_event(self, name, attributes, span):
+        self.events.inc(name=name, kind=attributes.get('kind'))
+
+    def close(self):
+        pass
@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from src.ekassa_rate_limiter import EkassaRateLimiter
+
+
+class MiningScheduler:
+    """
+    Class for a scheduler of receipt mining jobs (ReceiptService.mine_receipt
+    calls) run by {workers} threads, so the bot and background reprocessing
+    can share a process without batch receipts delaying the bot users.
+
+    Jobs are taken by priority class (interactive before batch), and within
+    a class in turn by user (round robin over the users having queued jobs,
+    so a user sending many photos does not hold back the others).
+    While interactive jobs are waiting or running, at most
+    {max_batch_in_flight} batch jobs run, so that they do not compete for
+    the CPU with the interactive ones.
+    The queue wait time of the jobs is measured by class (and observed into
+    {wait_histogram} with the priority label, if given).
+
+    Methods:
+        submit(receipt_service, priority, user_id = None, **mine_receipt_kwargs) -> Future of the Receipt instance
+        get_stats() -> queued, in flight, submitted, completed, failed, wait time (mean, p95, max) by priority
+        shutdown(wait = True)
+    """
+    PRIORITY_INTERACTIVE = EkassaRateLimiter.PRIORITY_INTERACTIVE
+    PRIORITY_BATCH = EkassaRateLimiter.PRIORITY_BATCH
+    PRIORITY_NAMES = EkassaRateLimiter.PRIORITY_NAMES
+
+    def __init__(self, workers = 2, max_batch_in_flight = 1, wait_histogram = None, recent_wait_count = 1000):
+        self.workers = workers
+        self.max_batch_in_flight = max_batch_in_flight
+        self.wait_histogram = wait_histogram
+        self._condition = threading.Condition()
+        self._is_running = True
+        # By priority: user id -> queued jobs of the user, in the order the users are served
+        self._queues = {priority: OrderedDict() for priority in MiningScheduler.PRIORITY_NAMES}
+        self._in_flight = {priority: 0 for priority in MiningScheduler.PRIORITY_NAMES}
+        self._stats = {priority: {'submitted': 0, 'completed': 0, 'failed': 0, 'wait_time': 0.0, 'max_wait_time': 0.0}
+                       for priority in MiningScheduler.PRIORITY_NAMES}
+        self._recent_wait_times = {priority: deque(maxlen=recent_wait_count) for priority in MiningScheduler.PRIORITY_NAMES}
+        self._threads = [threading.Thread(target=self._work, name=f'mining-worker-{i}', daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, receipt_service, priority = PRIORITY_BATCH, user_id = None, **mine_receipt_kwargs):
+        future = Future()
+        job = {
+            'future': future,
+            'receipt_service': receipt_service,
+            'kwargs': mine_receipt_kwargs,
+            'submitted_at': time.perf_counter(),
+        }
+        with self._condition:
+            if not self._is_running:
+                raise RuntimeError('Mining scheduler is shut down')
+            self._queues[priority].setdefault(user_id, deque()).append(job)
+            self._stats[priority]['submitted'] += 1
+            self._condition.notify()
+        return future
+
+    def _take_job(self):
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            if not queue:
+                continue
+            if priority != MiningScheduler.PRIORITY_INTERACTIVE and self._is_interactive_work_present() and \
+                    self._in_flight[priority] >= self.max_batch_in_flight:
+                return None
+            user_id, jobs = next(iter(queue.items()))
+            job = jobs.popleft()
+            # The user goes to the back of the turn
+            del queue[user_id]
+            if jobs:
+                queue[user_id] = jobs
+            return priority, job
+        return None
+
+    def _is_interactive_work_present(self):
+        return bool(self._queues[MiningScheduler.PRIORITY_INTERACTIVE]) or \
+            self._in_flight[MiningScheduler.PRIORITY_INTERACTIVE] > 0
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while True:
+                    taken = self._take_job()
+                    if taken is not None:
+                        break
+                    if not self._is_running and not any(self._queues.values()):
+                        return
+                    self._condition.wait()
+                priority, job = taken
+                self._in_flight[priority] += 1
+
+            wait_time = time.perf_counter() - job['submitted_at']
+            is_failed = False
+            try:
+                if job['future'].set_running_or_notify_cancel():
+                    if self.wait_histogram is not None:
+                        self.wait_histogram.observe(wait_time, priority=MiningScheduler.PRIORITY_NAMES[priority])
+                    try:
+                        job['future'].set_result(job['receipt_service'].mine_receipt(**job['kwargs']))
+                    except BaseException as e:
+                        is_failed = True
+                        job['future'].set_exception(e)
+            finally:
+                with self._condition:
+                    self._in_flight[priority] -= 1
+                    stats = self._stats[priority]
+                    stats['failed' if is_failed else 'completed'] += 1
+                    stats['wait_time'] += wait_time
+                    stats['max_wait_time'] = max(stats['max_wait_time'], wait_time)
+                    self._recent_wait_times[priority].append(wait_time)
+                    # A finished interactive job may let batch jobs start
+                    self._condition.notify_all()
+
+    def get_stats(self):
+        with self._condition:
+            stats = {}
+            for priority, name in MiningScheduler.PRIORITY_NAMES.items():
+                priority_stats = self._stats[priority]
+                finished_count = priority_stats['completed'] + priority_stats['failed']
+                recent_wait_times = self._recent_wait_times[priority]
+                stats[name] = {
+                    'queued': sum(len(jobs) for jobs in self._queues[priority].values()),
+                    'in_flight': self._in_flight[priority],
+                    'submitted': priority_stats['submitted'],
+                    'completed': priority_stats['completed'],
+                    'failed': priority_stats['failed'],
+                    'wait_time_mean': priority_stats['wait_time'] / finished_count if finished_count else 0.0,
+                    'wait_time_p95': float(np.percentile(recent_wait_times, 95)) if recent_wait_times else 0.0,
+                    'wait_time_max': priority_stats['max_wait_time'],
+                }
+            return stats
+
+    def shutdown(self, wait = True):
+        """
+        Stops accepting jobs; the queued ones are still run.
+        """
+        with self._condition:
+            self._is_running = False
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
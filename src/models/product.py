@@ -1,4 +1,6 @@
 class Product:
+    __slots__ = ('_name', '_quantity', '_price', '_amount')
+
     def __init__(self, name: str, quantity: float, price: float, amount: float):
         self._name = name
         self._quantity = quantity
@@ -45,11 +47,18 @@ class Product:
     def check_amount_coherence(self) -> bool:
         return self._amount == self._quantity * self._price
 
-    # Override __str__ method
-    def __str__(self):
-        return str({
+    def to_dict(self):
+        return {
             "name": self._name,
             "quantity": self._quantity,
             "price": self._price,
             "amount": self._amount
-        })
\ No newline at end of file
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return Product(data["name"], data["quantity"], data["price"], data["amount"])
+
+    # Override __str__ method
+    def __str__(self):
+        return str(self.to_dict())
\ No newline at end of file
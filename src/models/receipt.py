@@ -1,8 +1,17 @@
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 from src.models.receipt_general_info import ReceiptGeneralInfo
 from src.models.receipt_product_list import ReceiptProductList
 from src.models.receipt_payment_info import ReceiptPaymentInfo
 
 class Receipt:
+    __slots__ = ('_general_info', '_product_list', '_payment_info', '_fiscal_code')
+
     def __init__(
         self,
         general_info: 'ReceiptGeneralInfo',
@@ -48,12 +57,71 @@ class Receipt:
     def fiscal_code(self):
         return self._fiscal_code
 
-    @general_info.setter
+    @fiscal_code.setter
     def fiscal_code(self, value: 'str'):
         self._fiscal_code = value
         if self._fiscal_code is None:
             self._fiscal_code = ''
 
+    def to_dict(self):
+        return {
+            "fiscal_code": self._fiscal_code,
+            "general_info": self._general_info.to_dict(),
+            "product_list": self._product_list.to_dict(),
+            "payment_info": self._payment_info.to_dict()
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return Receipt(
+            ReceiptGeneralInfo.from_dict(data["general_info"]),
+            ReceiptProductList.from_dict(data["product_list"]),
+            ReceiptPaymentInfo.from_dict(data["payment_info"]),
+            data["fiscal_code"]
+        )
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, default=Receipt._convert_scalar)
+
+    @staticmethod
+    def from_json(text):
+        return Receipt.from_dict(json.loads(text))
+
+    def to_msgpack(self):
+        return Receipt._packb(self.to_dict())
+
+    @staticmethod
+    def from_msgpack(data):
+        return Receipt.from_dict(Receipt._unpackb(data))
+
+    # Batches are packed as a single list (IPC between workers, caching, bulk export)
+    @staticmethod
+    def receipts_to_msgpack(receipts):
+        return Receipt._packb([receipt.to_dict() for receipt in receipts])
+
+    @staticmethod
+    def receipts_from_msgpack(data):
+        return [Receipt.from_dict(item) for item in Receipt._unpackb(data)]
+
+    @staticmethod
+    def _packb(obj):
+        if msgpack is None:
+            raise ImportError("msgpack is required for msgpack serialization (pip install msgpack)")
+        return msgpack.packb(obj, use_bin_type=True, default=Receipt._convert_scalar)
+
+    @staticmethod
+    def _unpackb(data):
+        if msgpack is None:
+            raise ImportError("msgpack is required for msgpack serialization (pip install msgpack)")
+        return msgpack.unpackb(data, raw=False)
+
+    @staticmethod
+    def _convert_scalar(obj):
+        # numpy/pandas scalars (e.g. values imported from Excel)
+        if hasattr(obj, 'item'):
+            return obj.item()
+        raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
     # Override __str__ method
     def __str__(self):
         return Receipt.format_receipt_to_show(self)
@@ -1,4 +1,9 @@
 class ReceiptGeneralInfo:
+    __slots__ = ('_name', '_address', '_code', '_tax_payer_name', '_TIN',
+                 '_sale_receipt_num', '_cashier_name', '_date', '_time')
+    FIELDS = ('name', 'address', 'code', 'tax_payer_name', 'TIN',
+              'sale_receipt_num', 'cashier_name', 'date', 'time')
+
     def __init__(
         self,
         name: str,
@@ -102,16 +107,17 @@ class ReceiptGeneralInfo:
     def time(self, value: str):
         self._time = value
 
+    def to_tuple(self):
+        return (self._name, self._address, self._code, self._tax_payer_name, self._TIN,
+                self._sale_receipt_num, self._cashier_name, self._date, self._time)
+
+    def to_dict(self):
+        return dict(zip(ReceiptGeneralInfo.FIELDS, self.to_tuple()))
+
+    @staticmethod
+    def from_dict(data):
+        return ReceiptGeneralInfo(*[data[field] for field in ReceiptGeneralInfo.FIELDS])
+
     # Override __str__ method
     def __str__(self):
-        return str({
-            "name": self._name,
-            "address": self._address,
-            "code": self._code,
-            "tax_payer_name": self._tax_payer_name,
-            "TIN": self._TIN,
-            "sale_receipt_num": self._sale_receipt_num,
-            "cashier_name": self._cashier_name,
-            "date": self._date,
-            "time": self._time
-        })
\ No newline at end of file
+        return str(self.to_dict())
\ No newline at end of file
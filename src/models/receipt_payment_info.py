@@ -1,4 +1,11 @@
 class ReceiptPaymentInfo:
+    __slots__ = ('_total_amount', '_tax_amount', '_non_tax_amount', '_cashless_payment_amount',
+                 '_cash_payment_amount', '_paid_cash_amount', '_change_cash_amount',
+                 '_bonus', '_prepayment', '_credit')
+    FIELDS = ('total_amount', 'tax_amount', 'non_tax_amount', 'cashless_payment_amount',
+              'cash_payment_amount', 'paid_cash_amount', 'change_cash_amount',
+              'bonus', 'prepayment', 'credit')
+
     def __init__(
         self,
         total_amount: float,
@@ -113,17 +120,18 @@ class ReceiptPaymentInfo:
     def credit(self, value: float):
         self._credit = value
 
+    def to_tuple(self):
+        return (self._total_amount, self._tax_amount, self._non_tax_amount, self._cashless_payment_amount,
+                self._cash_payment_amount, self._paid_cash_amount, self._change_cash_amount,
+                self._bonus, self._prepayment, self._credit)
+
+    def to_dict(self):
+        return dict(zip(ReceiptPaymentInfo.FIELDS, self.to_tuple()))
+
+    @staticmethod
+    def from_dict(data):
+        return ReceiptPaymentInfo(*[data[field] for field in ReceiptPaymentInfo.FIELDS])
+
     # Override __str__ method
     def __str__(self):
-        return str({
-            "total_amount": self._total_amount,
-            "tax_amount": self._tax_amount,
-            "non_tax_amount": self._non_tax_amount,
-            "cashless_payment_amount": self._cashless_payment_amount,
-            "cash_payment_amount": self._cash_payment_amount,
-            "paid_cash_amount": self._paid_cash_amount,
-            "change_cash_amount": self._change_cash_amount,
-            "bonus": self._bonus,
-            "prepayment": self._prepayment,
-            "credit": self._credit
-        })
\ No newline at end of file
+        return str(self.to_dict())
\ No newline at end of file
@@ -1,24 +1,79 @@
+import numpy as np
+
+from src.models.product import Product
+
+
 class ReceiptProductList:
+    """
+    Columnar list of the products of a receipt: names are kept in a list,
+    quantities, prices, amounts in float64 arrays.
+    {products} builds Product instances on each access, so changes of
+    these instances are not reflected in the list (use the setter).
+    """
+    __slots__ = ('_names', '_quantities', '_prices', '_amounts')
+
     def __init__(self, products: list):
-        self._products = products
+        self.products = products
+
+    @staticmethod
+    def from_columns(names, quantities, prices, amounts):
+        product_list = ReceiptProductList([])
+        product_list._names = list(names)
+        product_list._quantities = np.asarray(quantities, dtype=np.float64)
+        product_list._prices = np.asarray(prices, dtype=np.float64)
+        product_list._amounts = np.asarray(amounts, dtype=np.float64)
+        return product_list
 
     # Getter and Setter for products
     @property
     def products(self):
-        return self._products
+        return [Product(name, quantity, price, amount) for name, quantity, price, amount in
+                zip(self._names, self._quantities.tolist(), self._prices.tolist(), self._amounts.tolist())]
 
     @products.setter
     def products(self, value: list):
-        self._products = value
+        self._names = [product.name for product in value]
+        self._quantities = np.array([product.quantity for product in value], dtype=np.float64)
+        self._prices = np.array([product.price for product in value], dtype=np.float64)
+        self._amounts = np.array([product.amount for product in value], dtype=np.float64)
+
+    # Getters for the columns
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def quantities(self):
+        return self._quantities
+
+    @property
+    def prices(self):
+        return self._prices
+
+    @property
+    def amounts(self):
+        return self._amounts
 
     # Method to get the number of products
     def get_num_products(self) -> int:
-        return len(self._products)
+        return len(self._names)
 
     # Method to get the total amount
     def get_total_amount(self) -> float:
-        return sum(product.amount for product in self._products)
+        return float(self._amounts.sum())
+
+    def to_dict(self):
+        return {
+            "names": list(self._names),
+            "quantities": self._quantities.tolist(),
+            "prices": self._prices.tolist(),
+            "amounts": self._amounts.tolist()
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return ReceiptProductList.from_columns(data["names"], data["quantities"], data["prices"], data["amounts"])
 
     # Override __str__ method
     def __str__(self):
-        return str([str(product) for product in self._products])
\ No newline at end of file
+        return str([str(product) for product in self.products])
@@ -7,12 +7,18 @@ class ApplicationProperties:
                  splitting_properties,
                  margin_properties,
                  text_similarity_threshold_properties,
+                 confidence_threshold_properties,
+                 validation_properties,
+                 pixel_budget_properties,
                  is_debug_on = False):
 
         self.ocr_properties = ocr_properties
         self.splitting_properties = splitting_properties
         self.margin_properties = margin_properties
         self.text_similarity_threshold_properties = text_similarity_threshold_properties
+        self.confidence_threshold_properties = confidence_threshold_properties
+        self.validation_properties = validation_properties
+        self.pixel_budget_properties = pixel_budget_properties
         self.is_debug_on = is_debug_on
         self.logger = LowLevelReceiptMinerLogger()
 
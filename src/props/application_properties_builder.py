@@ -1,6 +1,7 @@
 from src.props.application_properties import ApplicationProperties
 from src.props.properties import TextSimilarityThresholdProperties, MarginProperties, SplittingProperty, \
-    SplittingProperties, OCRProperty, OCRProperties
+    SplittingProperties, OCRProperty, OCRProperties, ConfidenceThresholdProperties, \
+    ValidationProperties, PixelBudgetProperties
 
 class ApplicationPropertiesBuilder:
 
@@ -11,6 +12,7 @@ class ApplicationPropertiesBuilder:
         azerbaijani_alphabet = upper_letters + lower_letters
         chartset = ' ' + '%_-№' + azerbaijani_alphabet + '.0123456789'
         general_part_config = f'--psm 6 -c tessedit_char_whitelist={chartset}'
+        full_receipt_config = f'--psm 4 -c tessedit_char_whitelist={chartset}'
 
         upper_letters = 'ABCÇDEƏFGĞHXIİJKQLMNOÖPRSŞTUÜVYZ'
         lower_letters = 'abcçdeəfgğhxıijkqlmnoöprsştuüvyz'
@@ -20,6 +22,7 @@ class ApplicationPropertiesBuilder:
 
         charset = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxvz'
         payment_type_part_names_config = f'--psm 4 -c tessedit_char_whitelist={charset}'
+        payment_details_config = f'--psm 6 -c tessedit_char_whitelist={charset}:.0123456789'
 
         ocr_properties = OCRProperties(
             general_part_ocr_property=OCRProperty(config=general_part_config, lang='eng+aze'),
@@ -32,7 +35,10 @@ class ApplicationPropertiesBuilder:
             payment_type_part_names_ocr_property=OCRProperty(config=payment_type_part_names_config, lang='eng'),
             payment_type_part_numbers_ocr_property=OCRProperty(config='--psm 6 -c tessedit_char_whitelist=.0123456789',
                                                                lang=None),
+            payment_details_ocr_property=OCRProperty(config=payment_details_config, lang='eng'),
             small_image_ocr_property=OCRProperty(config='--psm 8 -c tessedit_char_whitelist=.0123456789', lang=None),
+            full_receipt_ocr_property=OCRProperty(config=full_receipt_config, lang='eng+aze'),
+            numeric_column_ocr_property=OCRProperty(config='--psm 6 -c tessedit_char_whitelist=.0123456789', lang=None),
         )
 
         splitting_properties = SplittingProperties(
@@ -61,10 +67,43 @@ class ApplicationPropertiesBuilder:
             multi_token_text_similarity_threshold=80
         )
 
+        confidence_threshold_properties = ConfidenceThresholdProperties(
+            general_part_words_reuse_confidence_threshold=60
+        )
+
+        validation_properties = ValidationProperties(
+            amount_tolerance=0.011,
+            product_lines_retry_budget=12,
+            payment_retry_budget=2,
+            retry_scale_factor=3,
+            payment_retry_scale_factor=2,
+            retry_psms=[7, 8, 13],
+            payment_retry_psms=[4, 11]
+        )
+
+        # Crops are trimmed to content and rescaled so that text lines are {target_text_heights} pixels high
+        pixel_budget_properties = PixelBudgetProperties(
+            is_pixel_budget_on=False,
+            is_binarization_on=True,
+            trim_margin=4,
+            target_text_heights={
+                'general': 32,
+                'full_receipt': 32,
+                'product_names': 32,
+                'values': 28,
+                'payment': 28,
+            },
+            min_scale_factor=0.5,
+            max_scale_factor=2
+        )
+
         return ApplicationProperties(
             ocr_properties,
             splitting_properties,
             margin_properties,
             text_similarity_threshold_properties,
+            confidence_threshold_properties,
+            validation_properties,
+            pixel_budget_properties,
             is_debug_on
         )
\ No newline at end of file
@@ -1,3 +1,7 @@
+import hashlib
+import json
+import threading
+
 from src.receipt_processors.util import Util
 
 
@@ -6,11 +10,15 @@ class ApplicationPropertiesService:
     splitting_properties = None
     margin_properties = None
     text_similarity_threshold_properties = None
+    confidence_threshold_properties = None
+    validation_properties = None
+    pixel_budget_properties = None
     version = None
     is_debug_on = False
-    current_receipt_fiscal_code = 'Undefined'
-    current_receipt_processing_start_date_time = Util.prepare_current_datetime()
     logger = None
+    # Receipt being mined by the thread (fiscal code, processing start, StageCache instance or None), set by ReceiptService
+    _receipt_context = threading.local()
+    _start_date_time = Util.prepare_current_datetime()
 
     @staticmethod
     def load_properties(application_properties):
@@ -18,7 +26,47 @@ class ApplicationPropertiesService:
         ApplicationPropertiesService.splitting_properties = application_properties.splitting_properties
         ApplicationPropertiesService.margin_properties = application_properties.margin_properties
         ApplicationPropertiesService.text_similarity_threshold_properties = application_properties.text_similarity_threshold_properties
+        ApplicationPropertiesService.confidence_threshold_properties = application_properties.confidence_threshold_properties
+        ApplicationPropertiesService.validation_properties = application_properties.validation_properties
+        ApplicationPropertiesService.pixel_budget_properties = application_properties.pixel_budget_properties
         ApplicationPropertiesService.version = application_properties.version
         ApplicationPropertiesService.is_debug_on = application_properties.is_debug_on
         ApplicationPropertiesService.logger = application_properties.logger
 
+    @staticmethod
+    def set_current_receipt(fiscal_code, stage_cache = None):
+        context = ApplicationPropertiesService._receipt_context
+        context.fiscal_code = fiscal_code
+        context.stage_cache = stage_cache
+        context.processing_start_date_time = Util.prepare_current_datetime()
+
+    @staticmethod
+    def get_current_receipt_fiscal_code():
+        return getattr(ApplicationPropertiesService._receipt_context, 'fiscal_code', 'Undefined')
+
+    @staticmethod
+    def get_current_receipt_processing_start_date_time():
+        return getattr(ApplicationPropertiesService._receipt_context, 'processing_start_date_time',
+                       ApplicationPropertiesService._start_date_time)
+
+    @staticmethod
+    def get_stage_cache():
+        return getattr(ApplicationPropertiesService._receipt_context, 'stage_cache', None)
+
+    @staticmethod
+    def compute_properties_hash():
+        """
+        Hash of the loaded OCR/NER properties (not of the debug/logging ones),
+        so that results obtained with other properties can be told apart.
+        """
+        properties = {
+            'ocr_properties': ApplicationPropertiesService.ocr_properties,
+            'splitting_properties': ApplicationPropertiesService.splitting_properties,
+            'margin_properties': ApplicationPropertiesService.margin_properties,
+            'text_similarity_threshold_properties': ApplicationPropertiesService.text_similarity_threshold_properties,
+            'confidence_threshold_properties': ApplicationPropertiesService.confidence_threshold_properties,
+            'validation_properties': ApplicationPropertiesService.validation_properties,
+            'pixel_budget_properties': ApplicationPropertiesService.pixel_budget_properties,
+        }
+        text = json.dumps(properties, sort_keys=True, default=lambda obj: vars(obj))
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
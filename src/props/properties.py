@@ -24,7 +24,10 @@ class OCRProperties(Properties):
                  payment_amount_part_ocr_property,
                  payment_type_part_names_ocr_property,
                  payment_type_part_numbers_ocr_property,
-                 small_image_ocr_property):
+                 payment_details_ocr_property,
+                 small_image_ocr_property,
+                 full_receipt_ocr_property,
+                 numeric_column_ocr_property):
         self.general_part_ocr_property = general_part_ocr_property
         self.product_names_ocr_property = product_names_ocr_property
         self.quantities_ocr_property = quantities_ocr_property
@@ -33,7 +36,10 @@ class OCRProperties(Properties):
         self.payment_amount_part_ocr_property = payment_amount_part_ocr_property
         self.payment_type_part_names_ocr_property = payment_type_part_names_ocr_property
         self.payment_type_part_numbers_ocr_property = payment_type_part_numbers_ocr_property
+        self.payment_details_ocr_property = payment_details_ocr_property
         self.small_image_ocr_property = small_image_ocr_property
+        self.full_receipt_ocr_property = full_receipt_ocr_property
+        self.numeric_column_ocr_property = numeric_column_ocr_property
 
 class SplittingProperties(Properties):
     def __init__(self,
@@ -75,3 +81,40 @@ class TextSimilarityThresholdProperties(Properties):
         self.payment_type_checking_text_similarity_threshold = payment_type_checking_text_similarity_threshold
         self.multi_token_text_similarity_threshold = multi_token_text_similarity_threshold
         self.one_token_text_similarity_threshold = one_token_text_similarity_threshold
+
+class ConfidenceThresholdProperties(Properties):
+    def __init__(self,
+                 general_part_words_reuse_confidence_threshold):
+        self.general_part_words_reuse_confidence_threshold = general_part_words_reuse_confidence_threshold
+
+class ValidationProperties(Properties):
+    def __init__(self,
+                 amount_tolerance,
+                 product_lines_retry_budget,
+                 payment_retry_budget,
+                 retry_scale_factor,
+                 payment_retry_scale_factor,
+                 retry_psms,
+                 payment_retry_psms):
+        self.amount_tolerance = amount_tolerance
+        self.product_lines_retry_budget = product_lines_retry_budget
+        self.payment_retry_budget = payment_retry_budget
+        self.retry_scale_factor = retry_scale_factor
+        self.payment_retry_scale_factor = payment_retry_scale_factor
+        self.retry_psms = retry_psms
+        self.payment_retry_psms = payment_retry_psms
+
+class PixelBudgetProperties(Properties):
+    def __init__(self,
+                 is_pixel_budget_on,
+                 is_binarization_on,
+                 trim_margin,
+                 target_text_heights,
+                 min_scale_factor,
+                 max_scale_factor):
+        self.is_pixel_budget_on = is_pixel_budget_on
+        self.is_binarization_on = is_binarization_on
+        self.trim_margin = trim_margin
+        self.target_text_heights = target_text_heights
+        self.min_scale_factor = min_scale_factor
+        self.max_scale_factor = max_scale_factor
@@ -0,0 +1,134 @@
+import cv2
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from src.props.application_properties_service import ApplicationPropertiesService
+
+
+class OCRImagePreprocessor:
+  """
+  Class for reducing the pixels sent to OCR: an image is binarized once
+  (already binarized images are kept as they are), trimmed to its
+  content bounds and rescaled so that its text lines are as high as the
+  target of the field type, then sent as a 1-bit image.
+  Word boxes of the OCR results are mapped back to the original image.
+
+  Field types (keys of PixelBudgetProperties.target_text_heights):
+      general, full_receipt, product_names, values, payment
+
+  Methods:
+      binarize(image) -> binarized (0/255) image
+      prepare(image, field_type) -> prepared image (PIL, 1-bit), pixel count, transform (None if no content)
+      map_words_back(df, transform) -> OCR results in coordinates of the original image
+      measure_text_height(ink) -> median height of the text lines
+  """
+  OCR_RESULT_COLUMNS = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+                        'left', 'top', 'width', 'height', 'conf', 'text']
+  BORDER = 10
+
+  @staticmethod
+  def is_applied(field_type):
+    pixel_budget_properties = ApplicationPropertiesService.pixel_budget_properties
+    return (field_type is not None and pixel_budget_properties is not None and
+            pixel_budget_properties.is_pixel_budget_on)
+
+  @staticmethod
+  def binarize(image):
+    if OCRImagePreprocessor.is_binary(image):
+      return image
+    _, binary_image = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return binary_image
+
+  @staticmethod
+  def is_binary(image):
+    return image.dtype == np.uint8 and cv2.countNonZero(cv2.inRange(image, 1, 254)) == 0
+
+  @staticmethod
+  def prepare(image, field_type):
+    """
+    Args:
+        image (numpy array): grayscale image
+        field_type (str): key of the target text heights
+        ...
+
+    Returns:
+        return: prepared image (PIL image in mode '1'), number of its pixels,
+                transform (x offset, y offset, scale factor), all None if the image has no content
+    """
+    pixel_budget_properties = ApplicationPropertiesService.pixel_budget_properties
+    if image.size == 0:
+      return None, None, None
+    # Content bounds are found on the binarized image even if gray image is sent
+    binary_image = OCRImagePreprocessor.binarize(image)
+    image_temp = binary_image if pixel_budget_properties.is_binarization_on else image
+    ink = binary_image < 128
+    rows = np.flatnonzero(ink.any(axis=1))
+    if len(rows) == 0:
+      return None, None, None
+    columns = np.flatnonzero(ink.any(axis=0))
+    margin = pixel_budget_properties.trim_margin
+    y1, y2 = max(rows[0] - margin, 0), min(rows[-1] + margin + 1, image.shape[0])
+    x1, x2 = max(columns[0] - margin, 0), min(columns[-1] + margin + 1, image.shape[1])
+    image_temp = image_temp[y1:y2, x1:x2]
+    ink = ink[y1:y2, x1:x2]
+
+    text_height = OCRImagePreprocessor.measure_text_height(ink)
+    target_text_height = pixel_budget_properties.target_text_heights.get(field_type)
+    scale_factor = 1
+    if text_height > 0 and target_text_height is not None:
+      scale_factor = min(max(target_text_height / text_height, pixel_budget_properties.min_scale_factor),
+                         pixel_budget_properties.max_scale_factor)
+    if scale_factor != 1:
+      interpolation = cv2.INTER_AREA if scale_factor < 1 else cv2.INTER_LINEAR
+      new_width = max(int(round(image_temp.shape[1] * scale_factor)), 1)
+      new_height = max(int(round(image_temp.shape[0] * scale_factor)), 1)
+      image_temp = cv2.resize(image_temp, (new_width, new_height), interpolation=interpolation)
+      if pixel_budget_properties.is_binarization_on:
+        _, image_temp = cv2.threshold(image_temp, 127, 255, cv2.THRESH_BINARY)
+
+    border = OCRImagePreprocessor.BORDER
+    image_temp = cv2.copyMakeBorder(image_temp, border, border, border, border, cv2.BORDER_CONSTANT, value=255)
+    pixel_count = int(image_temp.size)
+    prepared_image = Image.fromarray(image_temp)
+    if pixel_budget_properties.is_binarization_on:
+      prepared_image = prepared_image.convert('1')
+    return prepared_image, pixel_count, (x1, y1, scale_factor)
+
+  @staticmethod
+  def measure_text_height(ink):
+    """
+    Determines the median height of the text lines
+    as runs of rows having ink.
+
+    Args:
+        ink (numpy array): boolean mask of the dark pixels
+        ...
+
+    Returns:
+        return: median text line height in pixels (0 if there is no text)
+    """
+    has_ink = np.concatenate(([False], ink.any(axis=1), [False]))
+    changes = np.flatnonzero(has_ink[1:] != has_ink[:-1])
+    heights = changes[1::2] - changes[::2]
+    # Runs thinner than 3 pixels are lines/noise, not text
+    heights = heights[heights >= 3]
+    if len(heights) == 0:
+      return 0
+    return float(np.median(heights))
+
+  @staticmethod
+  def map_words_back(df, transform):
+    x_offset, y_offset, scale_factor = transform
+    border = OCRImagePreprocessor.BORDER
+    df = df.copy()
+    for column, offset in [('left', x_offset), ('top', y_offset)]:
+      df[column] = ((df[column] - border) / scale_factor).round().astype(int).clip(lower=0) + offset
+    for column in ['width', 'height']:
+      df[column] = (df[column] / scale_factor).round().astype(int)
+    return df
+
+  @staticmethod
+  def prepare_empty_result():
+    return pd.DataFrame({column: [] for column in OCRImagePreprocessor.OCR_RESULT_COLUMNS}).astype(
+      {'left': int, 'top': int, 'width': int, 'height': int, 'text': object})
@@ -2,7 +2,9 @@ import warnings
 
 from src.props.application_properties_service import ApplicationPropertiesService
 from src.receipt_processors.receipt_util import ReceiptUtil
+from src.receipt_processors.receipt_validator import ReceiptValidator
 from src.receipt_processors.util import Util
+from src.tracer import Tracer
 
 
 class ReceiptBuilder:
@@ -12,6 +14,8 @@ class ReceiptBuilder:
 
     Methods:
         split_receipt_logical_parts(image) -> splits receipt image into general, products, payments parts.
+        segment_cashier_date_time_words(image, df_general, df, selected_df) -> splits general part OCR results
+                                                      into cashier and date/time word boxes.
         segment_products_part(image, rect_xs_list) -> splits products part of the receipt image
                                                       into names, quantities, prices, amounts parts.
         segment_payment_details_part(image_payment_details) -> splits payment details part of the receipt image
@@ -21,6 +25,16 @@ class ReceiptBuilder:
                                                             of the receipt image to obtain total payment amounts.
         extract_values_from_payment_type_part(payment_type_part) -> processes payment type part of the lower (payments and payment type details)
                                                                   of the receipt image to obtain cashless, cash, paid_cash, change, bonus, prepayment, credit values.
+        determine_receipt_logical_parts_bounds(image, df_words = None) -> bounds of general, products, payments parts and product columns.
+        determine_payment_details_bounds(image_payment_details) -> bounds of payment amount and payment type parts.
+        segment_products_words(df_products_words, rect_xs_list) -> splits products part OCR results into columns.
+        extract_product_names_from_words(product_names_words, product_lines_ys) -> product names from OCR results.
+        extract_values(value_images, ocr_property) -> prices/amounts with OCR confidences.
+        extract_values_from_words(values_words, value_lines_ys) -> prices/amounts from OCR results.
+        revise_inconsistent_product_lines(products, quantity_images, price_images, amount_images, confidences) -> reads
+                                                                  inconsistent product lines again.
+        extract_values_from_payment_details_words(image_payment_details, payment_details_words) -> payment values
+                                                                  from OCR results paired by lines (None if not all paired).
   """
 
   warnings.simplefilter("always", UserWarning)
@@ -41,6 +55,40 @@ class ReceiptBuilder:
         return: image_general, image_products, image_total
     """
 
+    general_ys, products_ys, payment_ys, product_part_rect_xs_list = ReceiptBuilder.determine_receipt_logical_parts_bounds(image)
+    image_general = image[general_ys[0]:general_ys[1], :]
+    image_products = image[products_ys[0]:products_ys[1], :]
+    image_total = image[payment_ys[0]:payment_ys[1], :]
+    return image_general, image_products, image_total, product_part_rect_xs_list
+
+  @staticmethod
+  def determine_receipt_logical_parts_bounds(image, df_words = None):
+    """
+    Determines vertical bounds of general, products, payments parts
+    and horizontal bounds of the product columns.
+    The product column names are looked up in {df_words} (OCR results
+    of the whole receipt) if given, otherwise their line is read separately.
+
+    Args:
+        image (numpy array): image of a receipt
+        df_words: data frame of OCR results of the whole receipt image
+        ...
+
+    Returns:
+        return: general_ys, products_ys, payment_ys, product_part_rect_xs_list
+    """
+    stage_cache = ApplicationPropertiesService.get_stage_cache()
+    if stage_cache is None:
+      return ReceiptBuilder._determine_receipt_logical_parts_bounds(image, df_words)
+    margin_properties = ApplicationPropertiesService.margin_properties
+    properties = [ApplicationPropertiesService.splitting_properties.receipt_logical_splitting_property,
+                  margin_properties.general_part_bottom_margin, margin_properties.payment_part_bottom_margin]
+    general_ys, products_ys, payment_ys, product_part_rect_xs_list = stage_cache.memoize(
+      'split', [image, df_words], properties, lambda: ReceiptBuilder._determine_receipt_logical_parts_bounds(image, df_words))
+    return tuple(general_ys), tuple(products_ys), tuple(payment_ys), [tuple(rect_xs) for rect_xs in product_part_rect_xs_list]
+
+  @staticmethod
+  def _determine_receipt_logical_parts_bounds(image, df_words):
     _, horizontal_hist_normalized = ReceiptUtil.calculate_histograms(image, is_cleaning_applied = False)
     splitting_property = ApplicationPropertiesService.splitting_properties.receipt_logical_splitting_property
     rect_ys_list = ReceiptUtil.determine_vertical_splitting_rectangles(image, horizontal_hist_normalized,
@@ -52,9 +100,9 @@ class ReceiptBuilder:
 
     general_part_bottom_margin = ApplicationPropertiesService.margin_properties.general_part_bottom_margin
     payment_part_bottom_margin = ApplicationPropertiesService.margin_properties.payment_part_bottom_margin
-    image_general = image[:rect_ys_prod[0] - general_part_bottom_margin, :]
-    image_products = image[rect_ys_prod[0]:rect_ys_prod[1], :]
-    image_total = image[rect_ys_total[0]:rect_ys_total[1] - payment_part_bottom_margin, :]
+    general_ys = (0, rect_ys_prod[0] - general_part_bottom_margin)
+    products_ys = (rect_ys_prod[0], rect_ys_prod[1])
+    payment_ys = (rect_ys_total[0], rect_ys_total[1] - payment_part_bottom_margin)
 
     # Print part between general info and products for debug
     index1 = rect_ys_prod[0] - general_part_bottom_margin + 25
@@ -63,9 +111,18 @@ class ReceiptBuilder:
     ApplicationPropertiesService.logger.log_image_for_debug(
       'product_column_names_part', product_column_names_part
     )
-    config = f'--psm 7'
-    values, df = ReceiptUtil.perform_ocr_obtain_values(product_column_names_part,
-                                          ocr_config = config, return_type=str, lang=None)
+
+    df = None
+    if df_words is not None:
+      df = ReceiptUtil.select_words_in_rectangle(df_words, (index1, index2))
+      if not ReceiptBuilder._are_product_column_names_found(df):
+        df = None
+    if df is None:
+      if df_words is not None:
+        Tracer.event('fallback', kind='product_column_names_ocr')
+      config = f'--psm 7'
+      values, df = ReceiptUtil.perform_ocr_obtain_values(product_column_names_part,
+                                            ocr_config = config, return_type=str, lang=None)
     PRODUCT, QUANTITY, PRICE, TOTAL = 'Product', 'Quantity', 'Price', 'Total'
 
     left_product = df[df.text == PRODUCT].iloc[0].left
@@ -83,7 +140,12 @@ class ReceiptBuilder:
       (left_price, left_total),
       (left_total, image.shape[1]),
     ]
-    return image_general, image_products, image_total, product_part_rect_xs_list
+    return general_ys, products_ys, payment_ys, product_part_rect_xs_list
+
+  @staticmethod
+  def _are_product_column_names_found(df):
+    column_names = set(df.text.to_list())
+    return all(column_name in column_names for column_name in ['Product', 'Quantity', 'Price', 'Total'])
 
   @staticmethod
   def segment_cashier_date_time_part(image, df, selected_df):
@@ -104,16 +166,46 @@ class ReceiptBuilder:
                 of the lower part of the receipt image
     """
 
-    cashier_keyword = 'Cashier:' # Used to note the splitting location of the general part
-    index, keyword, matched_string, keyword_token_count = selected_df[selected_df.Keyword == cashier_keyword].iloc[0]
-
-    cashier_date_time_top_margin = ApplicationPropertiesService.margin_properties.cashier_date_time_top_margin
-    y_start = df.iloc[index].top - cashier_date_time_top_margin
+    y_start = ReceiptBuilder._determine_cashier_date_time_top(df, selected_df)
     cashier_part_image = image[y_start:,:image.shape[1] // 2]
     date_time_part_image = image[y_start:,image.shape[1] // 2:]
 
     return cashier_part_image, date_time_part_image
 
+  @staticmethod
+  def segment_cashier_date_time_words(image, df_general, df, selected_df):
+    """
+    Same splitting as segment_cashier_date_time_part, but applied to the
+    word boxes of the general part OCR results, so that cashier and
+    date/time parts need not be read again.
+
+    Args:
+        image (numpy array): image of the general (upper) part of a receipt
+        df_general: full OCR results data frame of the general part
+        df: raw OCR results data frame of the general part (as used in keyword search)
+        selected_df: selected rows of focus in terms of searched keywords
+        ...
+
+    Returns:
+        return: cashier_part_words, date_time_part_words
+                of the lower part of the receipt image
+    """
+    y_start = ReceiptBuilder._determine_cashier_date_time_top(df, selected_df)
+    lower_part_words = df_general[df_general.top + df_general.height > y_start]
+    is_left = lower_part_words.left + lower_part_words.width / 2 < image.shape[1] // 2
+    cashier_part_words = lower_part_words[is_left].reset_index(drop=True)
+    date_time_part_words = lower_part_words[~is_left].reset_index(drop=True)
+
+    return cashier_part_words, date_time_part_words
+
+  @staticmethod
+  def _determine_cashier_date_time_top(df, selected_df):
+    cashier_keyword = 'Cashier:' # Used to note the splitting location of the general part
+    index, keyword, matched_string, keyword_token_count = selected_df[selected_df.Keyword == cashier_keyword].iloc[0]
+
+    cashier_date_time_top_margin = ApplicationPropertiesService.margin_properties.cashier_date_time_top_margin
+    return df.iloc[index].top - cashier_date_time_top_margin
+
   @staticmethod
   def segment_products_part(image, rect_xs_list):
     """
@@ -153,6 +245,25 @@ class ReceiptBuilder:
     Returns:
         return: payment_part, payment_type_part
     """
+    payment_part_ys, payment_type_part_ys = ReceiptBuilder.determine_payment_details_bounds(image_payment_details)
+    payment_part = image_payment_details[payment_part_ys[0]:payment_part_ys[1],:]
+    payment_type_part = image_payment_details[payment_type_part_ys[0]:payment_type_part_ys[1],:]
+
+    return payment_part, payment_type_part
+
+  @staticmethod
+  def determine_payment_details_bounds(image_payment_details):
+    """
+    Determines vertical bounds of payment amount and payment type parts
+    in payment details part.
+
+    Args:
+        image_payment_details (numpy array): payment details (lower) part of the receipt image
+        ...
+
+    Returns:
+        return: payment_part_ys, payment_type_part_ys
+    """
     vertical_hist_normalized, horizontal_hist_normalized = ReceiptUtil.calculate_histograms(image_payment_details)
     splitting_property = ApplicationPropertiesService.splitting_properties.payment_to_amount_type_splitting_property
     rect_ys_list = ReceiptUtil.determine_vertical_splitting_rectangles(image_payment_details, horizontal_hist_normalized,
@@ -160,12 +271,38 @@ class ReceiptBuilder:
 
     index1, index2 = rect_ys_list[0][:2]
     payment_amount_part_margin = ApplicationPropertiesService.margin_properties.payment_amount_part_margin
-    payment_part = image_payment_details[:index1 - payment_amount_part_margin,:]
-    payment_type_part = image_payment_details[index1 + payment_amount_part_margin:index2,:]
+    payment_part_ys = (0, index1 - payment_amount_part_margin)
+    payment_type_part_ys = (index1 + payment_amount_part_margin, index2)
 
-    return payment_part, payment_type_part
+    return payment_part_ys, payment_type_part_ys
+
+  @staticmethod
+  def segment_products_words(df_products_words, rect_xs_list):
+    """
+    Same splitting as segment_products_part, but applied to the
+    word boxes of the products part OCR results.
+
+    Args:
+        df_products_words: data frame of OCR results of the products part
+        rect_xs_list: list of horizontal splitting rectangles
+        ...
+
+    Returns:
+        return: product_names_words, quantities_words, prices_words, amounts_words
+    """
+    y_start, y_end = 0, float('inf')
+    horizontal_parts = []
+    for rect_xs in rect_xs_list:
+      horizontal_parts.append(ReceiptUtil.select_words_in_rectangle(df_products_words, (y_start, y_end), rect_xs))
+
+    product_names_words = horizontal_parts[0]
+    quantities_words = horizontal_parts[-3]
+    prices_words = horizontal_parts[-2]
+    amounts_words = horizontal_parts[-1]
+    return product_names_words, quantities_words, prices_words, amounts_words
 
   @staticmethod
+  @Tracer.traced('extract_product_names')
   def extract_product_names(product_images):
     """
     Performs OCR on each of the images to obtain
@@ -183,7 +320,7 @@ class ReceiptBuilder:
     for i in range(len(product_images)):
       product_image = product_images[i]
       ocr_property = ApplicationPropertiesService.ocr_properties.product_names_ocr_property
-      df_product = ReceiptUtil.perform_ocr(product_image, ocr_config = ocr_property.config, lang = ocr_property.lang)
+      df_product = ReceiptUtil.perform_ocr(product_image, ocr_config = ocr_property.config, lang = ocr_property.lang, field_type = 'product_names')
       product_name = ' '.join(df_product.iloc[:-2].text.to_list())
 
       # Remove redundant (pc) like things
@@ -205,24 +342,8 @@ class ReceiptBuilder:
         return: price_names
     """
 
-    prices = []
-    for i in range(len(price_images)):
-      price_image = price_images[i]
-      ocr_property = ApplicationPropertiesService.ocr_properties.prices_ocr_property
-      df_price = ReceiptUtil.perform_ocr(price_image,
-                                         ocr_config=ocr_property.config, lang=ocr_property.lang)
-      price = ''.join(df_price.iloc[:].text.to_list())
-      price = ReceiptUtil.preprocess_to_real_number(price)
-      try:
-        price = Util.clean_and_convert_to_float(price)
-      except ValueError:
-        text = ReceiptUtil.perform_ocr_on_single_item_image(price_image)
-        if len(text) != 0:
-          price = float(text)
-        else:
-          price = -1
-          warnings.warn('Non-float value error supressed with `-1` {price}', UserWarning)
-      prices.append(price)
+    ocr_property = ApplicationPropertiesService.ocr_properties.prices_ocr_property
+    prices, _ = ReceiptBuilder.extract_values(price_images, ocr_property)
     return prices
 
   @staticmethod
@@ -239,26 +360,94 @@ class ReceiptBuilder:
         return: amount_names
     """
 
-    amounts = []
-    for i in range(len(amount_images)):
-      amount_image = amount_images[i]
-      ocr_property = ApplicationPropertiesService.ocr_properties.amounts_ocr_property
-      df_amount = ReceiptUtil.perform_ocr(amount_image, ocr_config=ocr_property.config,
-                                         lang=ocr_property.lang)
-      amount = ''.join(df_amount.iloc[:].text.to_list())
-      amount = ReceiptUtil.preprocess_to_real_number(amount)
-      try:
-        amount = Util.clean_and_convert_to_float(amount)
-      except ValueError:
-        text = ReceiptUtil.perform_ocr_on_single_item_image(amount_image)
-        if len(text) != 0:
-          amount = float(text)
-        else:
-          amount = -1
-          warnings.warn('Non-float value error supressed with `-1` {amount}', UserWarning)
-      amounts.append(amount)
+    ocr_property = ApplicationPropertiesService.ocr_properties.amounts_ocr_property
+    amounts, _ = ReceiptBuilder.extract_values(amount_images, ocr_property)
     return amounts
 
+  @staticmethod
+  @Tracer.traced('extract_values')
+  def extract_values(value_images, ocr_property):
+    """
+    Performs OCR on each of the single line value (price, amount) images.
+    Values which can not be read are suppressed with `-1`, they are
+    read again only if the product line turns out to be inconsistent
+    (see revise_inconsistent_product_lines).
+
+    Args:
+        value_images (list): list of value images
+        ocr_property: OCRProperty to read the values with
+        ...
+
+    Returns:
+        return: values, confidences (lowest Tesseract word confidence of each value)
+    """
+
+    values, confidences = [], []
+    for i in range(len(value_images)):
+      df_value = ReceiptUtil.perform_ocr(value_images[i], ocr_config=ocr_property.config, lang=ocr_property.lang, field_type='values')
+      value, confidence = ReceiptBuilder._convert_words_to_value(df_value)
+      values.append(value)
+      confidences.append(confidence)
+    return values, confidences
+
+  @staticmethod
+  def _convert_words_to_value(df_value):
+    value = ''.join(df_value.text.to_list())
+    value = ReceiptUtil.preprocess_to_real_number(value)
+    try:
+      value = Util.clean_and_convert_to_float(value)
+    except ValueError:
+      warnings.warn('Non-float value error supressed with `-1`', UserWarning)
+      return -1, 0
+    return value, ReceiptUtil.determine_words_confidence(df_value)
+
+  @staticmethod
+  @Tracer.traced('revise_product_lines')
+  def revise_inconsistent_product_lines(products, quantity_images, price_images, amount_images, confidences):
+    """
+    Checks quantity x price = amount on each product line. Only the inconsistent
+    lines are read again from their images with heavier settings
+    (upscaling, alternative PSMs), within the retry budget of a receipt.
+    Fields with lower OCR confidence are read again first.
+
+    Args:
+        products (list): list of Product instances
+        quantity_images, price_images, amount_images (list): lists of line images
+        confidences (list): (quantity, price, amount) confidences of each line
+        ...
+
+    Returns:
+        return: products (revised in place)
+    """
+    validation_properties = ApplicationPropertiesService.validation_properties
+    tolerance = validation_properties.amount_tolerance
+    retry_budget = validation_properties.product_lines_retry_budget
+
+    for i in ReceiptValidator.find_inconsistent_product_lines(products, tolerance):
+      product = products[i]
+      candidates = [[product.quantity], [product.price], [product.amount]]
+      images = [quantity_images[i], price_images[i], amount_images[i]]
+      field_indices = sorted(range(3), key = lambda field_index: confidences[i][field_index])
+
+      combination = None
+      for psm in validation_properties.retry_psms:
+        for field_index in field_indices:
+          if retry_budget <= 0 or combination is not None:
+            break
+          Tracer.event('retry', kind='product_line', field=['quantity', 'price', 'amount'][field_index], psm=psm)
+          value = ReceiptUtil.perform_ocr_with_heavier_settings(images[field_index],
+                  scale_factor = validation_properties.retry_scale_factor, psm = psm)
+          retry_budget -= 1
+          if value is not None and value not in candidates[field_index]:
+            candidates[field_index].append(value)
+            combination = ReceiptValidator.find_consistent_product_line(candidates, tolerance)
+
+      if combination is None:
+        warnings.warn(f'Product line {i + 1} is inconsistent: {product}', UserWarning)
+        continue
+      product.quantity, product.price, product.amount = combination
+    return products
+
   @staticmethod
   def extract_values_from_payment_part(payment_part):
     """
@@ -284,7 +473,7 @@ class ReceiptBuilder:
 
     # Perform OCR on values part of the payment amount details
     ocr_property = ApplicationPropertiesService.ocr_properties.payment_amount_part_ocr_property
-    df_values = ReceiptUtil.perform_ocr(values_part, ocr_config = ocr_property.config, lang = ocr_property.lang)
+    df_values = ReceiptUtil.perform_ocr(values_part, ocr_config = ocr_property.config, lang = ocr_property.lang, field_type = 'payment')
 
     # Extract the needed total payment numbers
     total_amount_standalone = float(df_values.iloc[0].text)
@@ -317,12 +506,139 @@ class ReceiptBuilder:
     values_part = payment_type_part[:,index2:]
 
     ocr_property = ApplicationPropertiesService.ocr_properties.payment_type_part_names_ocr_property
-    df_names = ReceiptUtil.perform_ocr(names_part, ocr_config = ocr_property.config, lang = ocr_property.lang)
+    df_names = ReceiptUtil.perform_ocr(names_part, ocr_config = ocr_property.config, lang = ocr_property.lang, field_type = 'payment')
 
     payment_type_checking_text_similarity_threshold = ApplicationPropertiesService.text_similarity_threshold_properties.payment_type_checking_text_similarity_threshold
     is_paid_cash = ReceiptUtil.is_payment_cash(df_names.text.to_list(), similarity_thresh=payment_type_checking_text_similarity_threshold)
 
     ocr_property = ApplicationPropertiesService.ocr_properties.payment_type_part_numbers_ocr_property
-    values, _ = ReceiptUtil.perform_ocr_obtain_values(values_part, ocr_config = ocr_property.config, return_type = float, lang = ocr_property.lang)
+    values, _ = ReceiptUtil.perform_ocr_obtain_values(values_part, ocr_config = ocr_property.config, return_type = float, lang = ocr_property.lang, field_type = 'payment')
     cashless, cash, paid_cash, change, bonus, prepayment, credit = ReceiptUtil.distribute_values_in_payment_type(values, is_paid_cash)
-    return cashless, cash, paid_cash, change, bonus, prepayment, credit
\ No newline at end of file
+    return cashless, cash, paid_cash, change, bonus, prepayment, credit
+
+  @staticmethod
+  def extract_product_names_from_words(product_names_words, product_lines_ys):
+    """
+    Same as extract_product_names, but the names are gathered from
+    the already obtained word boxes of the product names part.
+
+    Args:
+        product_names_words: data frame of OCR results of the product names part
+        product_lines_ys: vertical bounds of the product lines
+        ...
+
+    Returns:
+        return: product_names
+    """
+
+    product_names = []
+    for i in range(len(product_lines_ys)):
+      df_product = ReceiptUtil.select_words_in_rectangle(product_names_words, product_lines_ys[i])
+      product_name = ' '.join(df_product.iloc[:-2].text.to_list())
+
+      # Remove redundant (pc) like things
+      product_name = product_name.replace(' (pc)', '')
+      product_names.append(product_name)
+    return product_names
+
+  @staticmethod
+  def extract_values_from_words(values_words, value_lines_ys):
+    """
+    Same as extract_values, but the values are gathered from
+    the already obtained word boxes.
+
+    Args:
+        values_words: data frame of OCR results of the values part
+        value_lines_ys: vertical bounds of the value lines
+        ...
+
+    Returns:
+        return: values, confidences
+    """
+
+    values, confidences = [], []
+    for i in range(len(value_lines_ys)):
+      df_value = ReceiptUtil.select_words_in_rectangle(values_words, value_lines_ys[i])
+      value, confidence = ReceiptBuilder._convert_words_to_value(df_value)
+      values.append(value)
+      confidences.append(confidence)
+    return values, confidences
+
+  @staticmethod
+  def pair_payment_names_values(payment_words, image_width):
+    """
+    Pairs payment names with the values on the same line.
+    The value of a line is its rightmost word if it lies in the right half.
+
+    Args:
+        payment_words: data frame of OCR results of a payment details part
+        image_width: width of the payment details part
+        ...
+
+    Returns:
+        return: names (one per line), values (None if not readable), value_words (word box of each value)
+    """
+    names, values, value_words = [], [], []
+    for df_line in ReceiptUtil.group_words_into_lines(payment_words):
+      value_word = df_line.iloc[-1]
+      if value_word.left + value_word.width / 2 < image_width / 2:
+        continue
+      try:
+        value = Util.clean_and_convert_to_float(ReceiptUtil.preprocess_to_real_number(value_word.text))
+      except ValueError:
+        value = None
+      names.append(' '.join(df_line.iloc[:-1].text.to_list()))
+      values.append(value)
+      value_words.append(value_word)
+    return names, values, value_words
+
+  @staticmethod
+  def extract_values_from_payment_details_words(image_payment_details, payment_details_words):
+    """
+    Processes payment details part using the word boxes of a single OCR pass
+    to obtain total payment amounts and cashless, cash, paid_cash, change,
+    bonus, prepayment, credit values. Names and values are paired by lines.
+    Values which can not be read are suppressed with `-1`, they are read
+    again only if the payment checks fail (see revise_inconsistent_payment_info).
+    If a value line was dropped or merged (less than 2 payment amounts, or
+    not 7 cash / 5 cashless payment type values), None is returned instead
+    of shifting the values into wrong fields.
+
+    Args:
+        image_payment_details (numpy array): payment details (lower) part of the receipt image
+        payment_details_words: data frame of OCR results of the payment details part
+        ...
+
+    Returns:
+        return: total_amount_standalone, non_tax_amount, tax_amount,
+                cashless, cash, paid_cash, change, bonus, prepayment, credit (None if the lines were not all paired)
+    """
+    payment_part_ys, payment_type_part_ys = ReceiptBuilder.determine_payment_details_bounds(image_payment_details)
+    names, values, value_words = ReceiptBuilder.pair_payment_names_values(payment_details_words,
+                                                                          image_payment_details.shape[1])
+
+    # Values which could not be read as numbers are left to the payment checks
+    for i in range(len(values)):
+      if values[i] is None:
+        warnings.warn('Non-float value error supressed with `-1`', UserWarning)
+        values[i] = -1
+
+    is_payment_amount = [value_word.top + value_word.height / 2 < payment_type_part_ys[0] for value_word in value_words]
+    payment_amount_values = [values[i] for i in range(len(values)) if is_payment_amount[i]]
+    payment_type_values = [values[i] for i in range(len(values)) if not is_payment_amount[i]]
+    payment_type_names = [names[i] for i in range(len(names)) if not is_payment_amount[i]]
+
+    payment_type_name_tokens = ' '.join(payment_type_names).split()
+    payment_type_checking_text_similarity_threshold = ApplicationPropertiesService.text_similarity_threshold_properties.payment_type_checking_text_similarity_threshold
+    is_paid_cash = ReceiptUtil.is_payment_cash(payment_type_name_tokens + payment_type_names,
+                                               similarity_thresh=payment_type_checking_text_similarity_threshold)
+    if len(payment_amount_values) < 2 or len(payment_type_values) != (7 if is_paid_cash else 5):
+      return None
+
+    # Extract the needed total payment numbers
+    total_amount_standalone = payment_amount_values[0]
+    non_tax_amount = payment_amount_values[1]
+    tax_amount = total_amount_standalone - non_tax_amount
+
+    cashless, cash, paid_cash, change, bonus, prepayment, credit = ReceiptUtil.distribute_values_in_payment_type(payment_type_values, is_paid_cash)
+    return total_amount_standalone, non_tax_amount, tax_amount, cashless, cash, paid_cash, change, bonus, prepayment, credit
@@ -1,15 +1,20 @@
 import math
 import os
+import re
 import time
 
 import cv2
 import numpy as np
+import pandas as pd
 
+from src.ekassa_rate_limiter import EkassaRateLimiter
 from src.logger import LowLevelReceiptMinerLogger
 from src.receipt_processors.util import Util
 from src.props.application_properties_service import ApplicationPropertiesService
 from src.receipt_processors.receipt_builder import ReceiptBuilder
 from src.receipt_processors.receipt_util import ReceiptUtil
+from src.receipt_processors.receipt_validator import ReceiptValidator
+from src.tracer import Tracer
 from src.models.product import Product
 from src.models.receipt import Receipt
 from src.models.receipt_general_info import ReceiptGeneralInfo
@@ -27,15 +32,43 @@ class ReceiptService:
 
     Attributes:
         app_props (ApplicationProperties): includes global properties for using in OCR and NER (e.g. threshold scale)
+        ocr_mode: OCR_MODE_CROP_PER_FIELD (each part/field is OCR'd separately) or
+                  OCR_MODE_SINGLE_PASS (one OCR pass over the whole receipt, words assigned to parts geometrically)
+        is_numeric_second_pass_on: in OCR_MODE_SINGLE_PASS, reads quantities, prices, amounts columns
+                                   again with digit whitelist
+        receipt_cache (ReceiptCache): if given, receipts are looked up by fiscal code before mining
+                                      and stored after mining
+        stage_cache (StageCache): if given, split geometry and OCR results are memoized,
+                                  so that only the stages affected by changed properties are recomputed
+        ekassa_priority: priority class of the E-kassa fetch in the rate limiter
+                         (EkassaRateLimiter.PRIORITY_INTERACTIVE for the bot, PRIORITY_BATCH otherwise)
 
     Methods:
         mine_receipt(fiscal_code) -> Receipt instance
         perform_ner_on_general_part(image_general) -> ReceiptGeneralInfo instance
         perform_ner_on_products_part(image_products) -> ReceiptProductList instance
         perform_ner_on_payment_details_part(image_total) -> ReceiptPaymentInfo instance
+        perform_ner_on_products_part_words(image_products, df_products_words, product_part_rect_xs_list) -> ReceiptProductList instance
+        perform_ner_on_payment_details_part_words(image_payment, df_payment_words) -> ReceiptPaymentInfo instance
+        revise_inconsistent_payment_info(image_payment, product_list, payment_info) -> ReceiptPaymentInfo instance
 
   """
-
+  OCR_MODE_CROP_PER_FIELD = 1
+  OCR_MODE_SINGLE_PASS = 2
+
+  def __init__(self, ocr_mode = None, is_numeric_second_pass_on = False, receipt_cache = None, stage_cache = None,
+               ekassa_priority = EkassaRateLimiter.PRIORITY_BATCH):
+    if ocr_mode is None:
+      ocr_mode = ReceiptService.OCR_MODE_CROP_PER_FIELD
+    if ocr_mode not in (ReceiptService.OCR_MODE_CROP_PER_FIELD, ReceiptService.OCR_MODE_SINGLE_PASS):
+      raise ValueError("No valid OCR mode was selected!")
+    self.ocr_mode = ocr_mode
+    self.is_numeric_second_pass_on = is_numeric_second_pass_on
+    self.receipt_cache = receipt_cache
+    self.stage_cache = stage_cache
+    self.ekassa_priority = ekassa_priority
+
+  @Tracer.traced('mine_receipt')
   def mine_receipt(self, image_ekassa_gray = None, fiscal_code = None):
     """
     Acquires receipt image from E-kassa using the fiscal code.
@@ -50,27 +83,27 @@ class ReceiptService:
         return_type: Receipt instance
     """
     start_time = time.time()
+    Tracer.set_fiscal_code(fiscal_code)
+    if self.receipt_cache is not None and fiscal_code is not None:
+      receipt = self.receipt_cache.get(fiscal_code, self)
+      if receipt is not None:
+        Tracer.event('cache', kind='hit')
+        return receipt
+      Tracer.event('cache', kind='miss')
+
     if image_ekassa_gray is None:
-      image_ekassa_gray = ReceiptUtil.read_image_from_ekassa(fiscal_code)
+      image_ekassa_gray = ReceiptUtil.read_image_from_ekassa(fiscal_code, self.ekassa_priority)
       receipt_images_folder = os.path.join('logs', 'receipts')
       image_name = LowLevelReceiptMinerLogger.sanitize_string(f"receipt_{fiscal_code}.jpg")
       if image_name not in os.listdir(receipt_images_folder):
         image_file = os.path.join(receipt_images_folder, image_name)
         cv2.imwrite(image_file, image_ekassa_gray)
 
-    ApplicationPropertiesService.current_receipt_fiscal_code = fiscal_code
-    ApplicationPropertiesService.current_receipt_processing_start_date_time = Util.prepare_current_datetime()
-    image_general, image_products, image_payment, product_part_rect_xs_list = ReceiptBuilder.split_receipt_logical_parts(image_ekassa_gray)
-
-    if ApplicationPropertiesService.is_debug_on:
-      ApplicationPropertiesService.logger.log_image('Ekassa image (gray)', image_ekassa_gray)
-      ApplicationPropertiesService.logger.log_image('general part of receipt', image_general)
-      ApplicationPropertiesService.logger.log_image('products part of receipt', image_products)
-      ApplicationPropertiesService.logger.log_image('payments part of receipt', image_payment)
-
-    general_info = self.perform_ner_on_general_part(image_general)
-    products = self.perform_ner_on_products_part(image_products, product_part_rect_xs_list)
-    payment_info = self.perform_ner_on_payment_details_part(image_payment)
+    ApplicationPropertiesService.set_current_receipt(fiscal_code, self.stage_cache)
+    if self.ocr_mode == ReceiptService.OCR_MODE_SINGLE_PASS:
+      general_info, products, payment_info = self._mine_receipt_parts_single_pass(image_ekassa_gray)
+    else:
+      general_info, products, payment_info = self._mine_receipt_parts_crop_per_field(image_ekassa_gray)
 
     receipt = Receipt(general_info, products, payment_info)
     processing_time = time.time() - start_time
@@ -82,15 +115,66 @@ class ReceiptService:
       ApplicationPropertiesService.logger.log_receipt('extracted receipt text', receipt.__str__())
       ApplicationPropertiesService.logger.log_receipt_image('receipt image', image_ekassa_gray)
     receipt._fiscal_code = fiscal_code
+    if self.receipt_cache is not None and fiscal_code is not None:
+      self.receipt_cache.put(fiscal_code, self, receipt)
     return receipt
 
-  def perform_ner_on_general_part(self, image_general):
+  def _mine_receipt_parts_crop_per_field(self, image_ekassa_gray):
+    with Tracer.span('split'):
+      image_general, image_products, image_payment, product_part_rect_xs_list = ReceiptBuilder.split_receipt_logical_parts(image_ekassa_gray)
+
+    if ApplicationPropertiesService.is_debug_on:
+      ApplicationPropertiesService.logger.log_image('Ekassa image (gray)', image_ekassa_gray)
+      ApplicationPropertiesService.logger.log_image('general part of receipt', image_general)
+      ApplicationPropertiesService.logger.log_image('products part of receipt', image_products)
+      ApplicationPropertiesService.logger.log_image('payments part of receipt', image_payment)
+
+    with Tracer.span('general'):
+      general_info = self.perform_ner_on_general_part(image_general)
+    with Tracer.span('products'):
+      products = self.perform_ner_on_products_part(image_products, product_part_rect_xs_list)
+    with Tracer.span('payment'):
+      payment_info = self.perform_ner_on_payment_details_part(image_payment)
+      payment_info = self.revise_inconsistent_payment_info(image_payment, products, payment_info)
+    return general_info, products, payment_info
+
+  def _mine_receipt_parts_single_pass(self, image_ekassa_gray):
+    # One word level OCR pass over the whole receipt; words are assigned to the parts by their boxes
+    with Tracer.span('split'):
+      ocr_property = ApplicationPropertiesService.ocr_properties.full_receipt_ocr_property
+      df_words = ReceiptUtil.perform_ocr(image_ekassa_gray, ocr_config = ocr_property.config, lang = ocr_property.lang, field_type = 'full_receipt')
+      general_ys, products_ys, payment_ys, product_part_rect_xs_list = ReceiptBuilder.determine_receipt_logical_parts_bounds(image_ekassa_gray, df_words)
+    image_general = image_ekassa_gray[general_ys[0]:general_ys[1], :]
+    image_products = image_ekassa_gray[products_ys[0]:products_ys[1], :]
+    image_payment = image_ekassa_gray[payment_ys[0]:payment_ys[1], :]
+
+    if ApplicationPropertiesService.is_debug_on:
+      ApplicationPropertiesService.logger.log_image('Ekassa image (gray)', image_ekassa_gray)
+      ApplicationPropertiesService.logger.log_image('general part of receipt', image_general)
+      ApplicationPropertiesService.logger.log_image('products part of receipt', image_products)
+      ApplicationPropertiesService.logger.log_image('payments part of receipt', image_payment)
+
+    df_general_words = ReceiptUtil.select_words_in_rectangle(df_words, general_ys)
+    df_products_words = ReceiptUtil.select_words_in_rectangle(df_words, products_ys)
+    df_payment_words = ReceiptUtil.select_words_in_rectangle(df_words, payment_ys)
+
+    with Tracer.span('general'):
+      general_info = self.perform_ner_on_general_part(image_general, df_general_words)
+    with Tracer.span('products'):
+      products = self.perform_ner_on_products_part_words(image_products, df_products_words, product_part_rect_xs_list)
+    with Tracer.span('payment'):
+      payment_info = self.perform_ner_on_payment_details_part_words(image_payment, df_payment_words)
+      payment_info = self.revise_inconsistent_payment_info(image_payment, products, payment_info)
+    return general_info, products, payment_info
+
+  def perform_ner_on_general_part(self, image_general, df_general = None):
     """
     Determine roughly general properties of the receipt.
     Adjusts cashier name, date, time if necessary.
 
     Args:
         image_general (numpy array): general part of the receipt image
+        df_general: already obtained OCR results of the general part (OCR'd here if None)
         ...
 
     Returns:
@@ -112,11 +196,26 @@ class ReceiptService:
                             TAXPAYER_NAME, SALE_RECEIPT_NUM]
     one_token_keywords = [TIN, CASHIER, DATE, TIME]
 
-    results_dict, df, selected_df = ReceiptUtil.rule_based_text_extraction(image_general, multi_token_keywords, one_token_keywords)
+    if df_general is None:
+      ocr_property = ApplicationPropertiesService.ocr_properties.general_part_ocr_property
+      df_general = ReceiptUtil.perform_ocr(image_general, ocr_config = ocr_property.config, lang = ocr_property.lang, field_type = 'general')
+    results_dict, df, selected_df = ReceiptUtil.rule_based_text_extraction_from_words(df_general, multi_token_keywords, one_token_keywords)
 
+    # Cashier, date, time are taken from the word boxes of the general part;
+    # their crops are read again only if the values are missing or not confident
     cashier_part_image, date_time_part_image = ReceiptBuilder.segment_cashier_date_time_part(image_general, df, selected_df)
-    cashier_value_dict, _, _ = ReceiptUtil.rule_based_text_extraction(cashier_part_image, multi_token_keywords = None, one_token_keywords = [CASHIER,])
-    date_time_value_dict, _, _ = ReceiptUtil.rule_based_text_extraction(date_time_part_image, multi_token_keywords = None, one_token_keywords = [DATE, TIME])
+    cashier_part_words, date_time_part_words = ReceiptBuilder.segment_cashier_date_time_words(image_general, df_general, df, selected_df)
+    confidence_thresh = ApplicationPropertiesService.confidence_threshold_properties.general_part_words_reuse_confidence_threshold
+
+    cashier_value_dict, _, cashier_selected_df = ReceiptUtil.rule_based_text_extraction_from_words(cashier_part_words, multi_token_keywords = None, one_token_keywords = [CASHIER,])
+    if not ReceiptUtil.is_extraction_reliable(cashier_value_dict, [CASHIER,], cashier_part_words, cashier_selected_df, confidence_thresh):
+      Tracer.event('fallback', kind='cashier_part_ocr')
+      cashier_value_dict, _, _ = ReceiptUtil.rule_based_text_extraction(cashier_part_image, multi_token_keywords = None, one_token_keywords = [CASHIER,])
+
+    date_time_value_dict, _, date_time_selected_df = ReceiptUtil.rule_based_text_extraction_from_words(date_time_part_words, multi_token_keywords = None, one_token_keywords = [DATE, TIME])
+    if not ReceiptUtil.is_extraction_reliable(date_time_value_dict, [DATE, TIME], date_time_part_words, date_time_selected_df, confidence_thresh):
+      Tracer.event('fallback', kind='date_time_part_ocr')
+      date_time_value_dict, _, _ = ReceiptUtil.rule_based_text_extraction(date_time_part_image, multi_token_keywords = None, one_token_keywords = [DATE, TIME])
 
     if ApplicationPropertiesService.is_debug_on:
       ApplicationPropertiesService.logger.log_image('general-cashier part image', cashier_part_image)
@@ -172,11 +271,14 @@ class ReceiptService:
       ApplicationPropertiesService.logger.log_image('Amounts', clear_amounts_part)
 
     ocr_property = ApplicationPropertiesService.ocr_properties.quantities_ocr_property
+    # Unreadable quantities are -1 with confidence 0, read again only if the product line is inconsistent
     quantities, df_quantities = ReceiptUtil.perform_ocr_obtain_values(image=clear_quantities_part,
-                ocr_config=ocr_property.config, return_type = float, lang = ocr_property.lang)
+                ocr_config=ocr_property.config, return_type = float, lang = ocr_property.lang, field_type = 'values',
+                is_single_item_retry_on = False)
 
     # Handle very small number segments when there is one number
     if df_quantities.shape[0] == 0:
+      Tracer.event('fallback', kind='small_image_ocr')
       quantities, df_quantities = ReceiptUtil.perform_ocr_on_small_image(clear_quantities_part)
 
     product_line_margin = ApplicationPropertiesService.margin_properties.product_line_margin
@@ -191,16 +293,23 @@ class ReceiptService:
     amount_images = ReceiptUtil.prepare_amount_images(clear_amounts_part, df_quantities,
                                                       amount_line_margin=amount_line_margin)
 
-    prices = ReceiptBuilder.extract_prices(price_images)
-    amounts = ReceiptBuilder.extract_amounts(amount_images)
+    prices, price_confidences = ReceiptBuilder.extract_values(price_images, ApplicationPropertiesService.ocr_properties.prices_ocr_property)
+    amounts, amount_confidences = ReceiptBuilder.extract_values(amount_images, ApplicationPropertiesService.ocr_properties.amounts_ocr_property)
 
     products = [Product(product_names[i], quantities[i], prices[i], amounts[i]) for i in range(len(product_names))]
+    quantity_images = [clear_quantities_part[y1:y2,:] for y1, y2 in ReceiptUtil.determine_value_lines_ys(df_quantities, clear_quantities_part.shape[0], price_line_margin)]
+    quantity_confidences = pd.to_numeric(df_quantities.conf, errors='coerce').fillna(0).to_list()
+    quantity_confidences = [0 if quantities[i] == -1 else quantity_confidences[i] for i in range(len(quantities))]
+    confidences = list(zip(quantity_confidences, price_confidences, amount_confidences))
+    ReceiptBuilder.revise_inconsistent_product_lines(products, quantity_images, price_images, amount_images, confidences)
     return ReceiptProductList(products)
 
   def perform_ner_on_payment_details_part(self, image_payment):
     """
-    Splits payments part of the receipt image into
-    payment amounts, payment type details.
+    Reads payments part of the receipt image once and pairs
+    payment amounts, payment type details names with values by lines.
+    Falls back to reading payment amount and payment type parts
+    separately if the lines could not be paired.
 
     Args:
         image_payment (numpy array): payment details part of the receipt image
@@ -209,10 +318,137 @@ class ReceiptService:
     Returns:
         return_type: ReceiptPaymentInfo instance
     """
+    # Whole payment details part is read once, names and values are paired by lines
+    ocr_property = ApplicationPropertiesService.ocr_properties.payment_details_ocr_property
+    df_payment_words = ReceiptUtil.perform_ocr(image_payment, ocr_config = ocr_property.config, lang = ocr_property.lang, field_type = 'payment')
+    payment_values = ReceiptBuilder.extract_values_from_payment_details_words(image_payment, df_payment_words)
+    if payment_values is None:
+      return self._perform_ner_on_payment_details_parts_separately(image_payment)
+    return ReceiptPaymentInfo(*payment_values)
+
+  def _perform_ner_on_payment_details_parts_separately(self, image_payment):
+    warnings.warn('Payment details lines were not paired, payment parts are read separately', UserWarning)
+    Tracer.event('fallback', kind='payment_parts_ocr')
     payment_part_image, payment_type_part_image = ReceiptBuilder.segment_payment_details_part(image_payment)
-
     total_amount_standalone, non_tax_amount, tax_amount = ReceiptBuilder.extract_values_from_payment_part(payment_part_image)
     cashless, cash, paid_cash, change, bonus, prepayment, credit = ReceiptBuilder.extract_values_from_payment_type_part(payment_type_part_image)
+    return ReceiptPaymentInfo(total_amount_standalone, non_tax_amount, tax_amount, cashless, cash, paid_cash, change, bonus, prepayment, credit)
+
+  def perform_ner_on_products_part_words(self, image_products, df_products_words, product_part_rect_xs_list):
+    """
+    Same as perform_ner_on_products_part, but product names, quantities,
+    prices, amounts are taken from the already obtained word boxes.
+    Numeric columns are read again with digit whitelist if
+    {is_numeric_second_pass_on} is set.
 
-    payment_info = ReceiptPaymentInfo(total_amount_standalone, non_tax_amount, tax_amount, cashless, cash, paid_cash, change, bonus, prepayment, credit)
-    return payment_info
\ No newline at end of file
+    Args:
+        image_products (numpy array): products part of the receipt image
+        df_products_words: OCR results of the products part
+        product_part_rect_xs_list: list of horizontal splitting rectangles
+        ...
+
+    Returns:
+        return_type: ReceiptProductsList instance
+    """
+    rect_xs_list = product_part_rect_xs_list
+    clear_products_part, clear_quantities_part, clear_prices_part, clear_amounts_part = ReceiptBuilder.segment_products_part(image_products, rect_xs_list)
+    names_words, quantities_words, prices_words, amounts_words = ReceiptBuilder.segment_products_words(df_products_words, rect_xs_list)
+
+    if self.is_numeric_second_pass_on:
+      ocr_property = ApplicationPropertiesService.ocr_properties.numeric_column_ocr_property
+      quantities_words = ReceiptUtil.perform_ocr(clear_quantities_part, ocr_config = ocr_property.config, lang = ocr_property.lang, field_type = 'values')
+      prices_words = ReceiptUtil.perform_ocr(clear_prices_part, ocr_config = ocr_property.config, lang = ocr_property.lang, field_type = 'values')
+      amounts_words = ReceiptUtil.perform_ocr(clear_amounts_part, ocr_config = ocr_property.config, lang = ocr_property.lang, field_type = 'values')
+
+    df_quantities = quantities_words.sort_values(by='top', kind='stable')
+    quantities = []
+    for index, row in df_quantities.iterrows():
+      try:
+        quantities.append(float(row.text))
+      except ValueError:
+        # Read again only if the product line turns out to be inconsistent
+        quantities.append(-1)
+
+    # Handle very small number segments when there is one number
+    if df_quantities.shape[0] == 0:
+      Tracer.event('fallback', kind='small_image_ocr')
+      quantities, df_quantities = ReceiptUtil.perform_ocr_on_small_image(clear_quantities_part)
+
+    product_line_margin = ApplicationPropertiesService.margin_properties.product_line_margin
+    product_lines_ys = ReceiptUtil.determine_product_lines_ys(df_quantities, clear_quantities_part.shape[0], product_line_margin)
+    product_names = ReceiptBuilder.extract_product_names_from_words(names_words, product_lines_ys)
+
+    price_line_margin = ApplicationPropertiesService.margin_properties.price_line_margin
+    price_lines_ys = ReceiptUtil.determine_value_lines_ys(df_quantities, clear_prices_part.shape[0], price_line_margin)
+    price_images = ReceiptUtil.prepare_price_images(clear_prices_part, df_quantities, price_line_margin=price_line_margin)
+    amount_line_margin = ApplicationPropertiesService.margin_properties.amount_line_margin
+    amount_lines_ys = ReceiptUtil.determine_value_lines_ys(df_quantities, clear_amounts_part.shape[0], amount_line_margin)
+    amount_images = ReceiptUtil.prepare_amount_images(clear_amounts_part, df_quantities, amount_line_margin=amount_line_margin)
+
+    prices, price_confidences = ReceiptBuilder.extract_values_from_words(prices_words, price_lines_ys)
+    amounts, amount_confidences = ReceiptBuilder.extract_values_from_words(amounts_words, amount_lines_ys)
+
+    products = [Product(product_names[i], quantities[i], prices[i], amounts[i]) for i in range(len(product_names))]
+    quantity_images = [clear_quantities_part[y1:y2,:] for y1, y2 in ReceiptUtil.determine_value_lines_ys(df_quantities, clear_quantities_part.shape[0], price_line_margin)]
+    quantity_confidences = pd.to_numeric(df_quantities.conf, errors='coerce').fillna(0).to_list()
+    quantity_confidences = [0 if quantities[i] == -1 else quantity_confidences[i] for i in range(len(quantities))]
+    confidences = list(zip(quantity_confidences, price_confidences, amount_confidences))
+    ReceiptBuilder.revise_inconsistent_product_lines(products, quantity_images, price_images, amount_images, confidences)
+    return ReceiptProductList(products)
+
+  def perform_ner_on_payment_details_part_words(self, image_payment, df_payment_words):
+    """
+    Same as perform_ner_on_payment_details_part, but the values are taken
+    from the already obtained word boxes, names and values paired by lines.
+
+    Args:
+        image_payment (numpy array): payment details part of the receipt image
+        df_payment_words: OCR results of the payment details part
+        ...
+
+    Returns:
+        return_type: ReceiptPaymentInfo instance
+    """
+    payment_values = ReceiptBuilder.extract_values_from_payment_details_words(image_payment, df_payment_words)
+    if payment_values is None:
+      return self._perform_ner_on_payment_details_parts_separately(image_payment)
+    return ReceiptPaymentInfo(*payment_values)
+
+  def revise_inconsistent_payment_info(self, image_payment, product_list, payment_info):
+    """
+    Checks payment values against the products and each other.
+    Only if a check fails, payment details part is read again with
+    heavier settings (upscaling, alternative PSMs) within the retry budget.
+
+    Args:
+        image_payment (numpy array): payment details part of the receipt image
+        product_list: ReceiptProductList instance
+        payment_info: ReceiptPaymentInfo instance
+        ...
+
+    Returns:
+        return_type: ReceiptPaymentInfo instance (the revised one if it passes the checks)
+    """
+    validation_properties = ApplicationPropertiesService.validation_properties
+    tolerance = validation_properties.amount_tolerance
+    failed_checks = ReceiptValidator.find_failed_payment_checks(product_list, payment_info, tolerance)
+    if len(failed_checks) == 0:
+      return payment_info
+
+    ocr_property = ApplicationPropertiesService.ocr_properties.payment_details_ocr_property
+    image_payment_temp = Util.resize_image(image_payment, validation_properties.payment_retry_scale_factor)
+    for psm in validation_properties.payment_retry_psms[:validation_properties.payment_retry_budget]:
+      Tracer.event('retry', kind='payment_details', psm=psm)
+      ocr_config = re.sub(r'--psm \d+', f'--psm {psm}', ocr_property.config)
+      df_payment_words = ReceiptUtil.perform_ocr(image_payment_temp, ocr_config = ocr_config, lang = ocr_property.lang)
+      # Split bounds and line pairing use pixel-tuned properties, so they are applied to the original image
+      df_payment_words = ReceiptUtil.scale_word_boxes(df_payment_words, validation_properties.payment_retry_scale_factor)
+      revised_payment_values = ReceiptBuilder.extract_values_from_payment_details_words(image_payment, df_payment_words)
+      if revised_payment_values is None:
+        continue
+      revised_payment_info = ReceiptPaymentInfo(*revised_payment_values)
+      if len(ReceiptValidator.find_failed_payment_checks(product_list, revised_payment_info, tolerance)) == 0:
+        return revised_payment_info
+
+    warnings.warn(f'Payment checks failed: {", ".join(failed_checks)}', UserWarning)
+    return payment_info
@@ -1,4 +1,5 @@
 import warnings
+from functools import lru_cache
 
 import cv2
 import numpy as np
@@ -6,8 +7,9 @@ import pytesseract
 from pytesseract import Output
 import requests
 import pandas as pd
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
 
+from src.ekassa_rate_limiter import EkassaRateLimiter
 from src.props.application_properties_service import ApplicationPropertiesService
 from src.receipt_processors.util import Util
 from src.models.product import Product
@@ -15,6 +17,8 @@ from src.models.receipt import Receipt
 from src.models.receipt_general_info import ReceiptGeneralInfo
 from src.models.receipt_payment_info import ReceiptPaymentInfo
 from src.models.receipt_product_list import ReceiptProductList
+from src.receipt_processors.ocr_image_preprocessor import OCRImagePreprocessor
+from src.tracer import Tracer
 import os
 
 
@@ -26,18 +30,29 @@ class ReceiptUtil:
   perform OCR on images.
 
   Methods:
-      read_image_from_ekassa(fiscal_code) -> obtains receipt image from ekassa.
-      perform_ocr(image, ocr_config, lang = None) -> performs OCR on an image.
-      perform_ocr_obtain_values(image, ocr_config, return_type, lang = None) -> performs OCR on an image and casts values to the given type.
+      read_image_from_ekassa(fiscal_code, priority) -> obtains receipt image from ekassa (rate limited).
+      perform_ocr(image, ocr_config, lang = None, field_type = None) -> performs OCR on an image
+      (trimmed, rescaled, binarized for the field type if pixel budget is on).
+      perform_ocr_obtain_values(image, ocr_config, return_type, lang = None, field_type = None, is_single_item_retry_on = True) -> performs OCR on an image and casts values to the given type.
       perform_ocr_on_small_image(clear_quantities_part, return_type = float) -> performs OCR when large white/empty margin exists
       perform_ocr_on_single_item_image(image, scale_factor=2, stroke_length=1) -> performs OCR on a single item/token image
+      perform_ocr_with_heavier_settings(image, scale_factor = 3, psm = 7) -> reads a single number on an upscaled image
+      determine_words_confidence(df_words) -> lowest OCR confidence of the words
       prepare_product_images(products_part, df_quantities, quantities_image_height, product_line_margin = 3) -> helps to segment
       product names image into images of seperate product names.
       select_keyword_existed_rows(df, searched_col_name, keywords, similiarity_thresh = 80) -> Helps to search for the keywords
           to obtain corresponding values in OCR results.
+      determine_product_lines_ys(df_quantities, image_height, line_margin = 3) -> vertical bounds of product name lines.
+      determine_value_lines_ys(df_quantities, image_height, line_margin = 3) -> vertical bounds of price/amount lines.
+      select_words_in_rectangle(df_words, rect_ys, rect_xs = None) -> selects OCR word boxes of a part of an image.
+      group_words_into_lines(df_words) -> groups OCR word boxes into visual lines.
       extract_content_based_on_keywords(selected_df, df, df_last_content) -> Helps to find values among keywords.
       rule_based_text_extraction(image, multi_token_keywords, one_token_keywords) -> Searches one token and multi token keywords
           and the corresponding values.
+      rule_based_text_extraction_from_words(df_general, multi_token_keywords, one_token_keywords) -> Same as above
+          but on already obtained OCR results.
+      is_extraction_reliable(results_dict, keywords, df_words, selected_df, confidence_thresh = 60) -> Checks whether keyword values
+          are found with enough OCR confidence.
       calculate_histograms(image, is_cleaning_applied = True) -> Calculates vertical and horizontal histograms.
       determine_horizontal_splitting_rectangles(image, vertical_hist_normalized,
           threshold_scale = 0.01, min_diff = 30) -> Determines horizontal splitting rectangles based on vertical histogram.
@@ -50,59 +65,98 @@ class ReceiptUtil:
   warnings.simplefilter("always", UserWarning)
   EXPORT_IMPORT_EXCEL = 3
   EXPORT_IMPORT_HTML = 4
+  # E-kassa monitoring service (EKASSA_BASE_URL may point to a local stand-in, see EkassaStubServer)
+  EKASSA_BASE_URL = os.getenv('EKASSA_BASE_URL', 'https://monitoring.e-kassa.gov.az')
+  # Shared by the threads of the process (EKASSA_MAX_RPS, EKASSA_BURST)
+  ekassa_rate_limiter = EkassaRateLimiter.from_env()
 
   @staticmethod
-  def read_image_from_ekassa(fiscal_code):
+  @Tracer.traced('ekassa_fetch')
+  def read_image_from_ekassa(fiscal_code, priority = EkassaRateLimiter.PRIORITY_BATCH):
     """
     Obtains the receipt image corresponding to the given {fiscal_code}.
+    The request waits for its turn in the E-kassa rate limiter (see EkassaRateLimiter).
 
     Args:
         fiscal_code: str
+        priority: priority class of the request in the rate limiter (interactive or batch)
         ...
 
     Returns:
         return: image_ekassa_gray
     """
 
-    ekassa_image_url = f'https://monitoring.e-kassa.gov.az/pks-monitoring/2.0.0/documents/{fiscal_code}'
-    response = requests.get(ekassa_image_url) # for EN: headers = {'user-lang': 'en'}
+    ekassa_image_url = f'{ReceiptUtil.EKASSA_BASE_URL}/pks-monitoring/2.0.0/documents/{fiscal_code}'
+    ReceiptUtil.ekassa_rate_limiter.acquire(priority)
+    try:
+      response = requests.get(ekassa_image_url) # for EN: headers = {'user-lang': 'en'}
+    except requests.RequestException:
+      ReceiptUtil.ekassa_rate_limiter.on_response(None)
+      raise
+    ReceiptUtil.ekassa_rate_limiter.on_response(response.status_code, response.headers.get('Retry-After'))
+    response.raise_for_status()
     image_data = np.frombuffer(response.content, np.uint8)
     image_ekassa = cv2.imdecode(image_data, cv2.IMREAD_COLOR)
     image_ekassa_gray = cv2.cvtColor(image_ekassa, cv2.COLOR_BGR2GRAY)
     print('IMAGE READ FROM EKASSA')
     return image_ekassa_gray
 
-  def perform_ocr(image, ocr_config, lang = None):
+  def perform_ocr(image, ocr_config, lang = None, field_type = None):
     """
     Reads text on an image using OCR.
+    If pixel budget is on and {field_type} is given, the image is sent
+    trimmed, rescaled and binarized (see OCRImagePreprocessor);
+    word boxes are still in coordinates of {image}.
 
     Args:
         image (numpy array)
         ocr_config (str)
         lang (str)
+        field_type (str): general, full_receipt, product_names, values, payment
         ...
 
     Returns:
         return: data frame of OCR results
 
     """
-    if lang is None:
-      df = pd.DataFrame(pytesseract.image_to_data(image, config = ocr_config, output_type=Output.DICT))
-    else:
-      df = pd.DataFrame(pytesseract.image_to_data(image, lang = lang, config = ocr_config, output_type=Output.DICT))
+    stage_cache = ApplicationPropertiesService.get_stage_cache()
+    if stage_cache is None:
+      return ReceiptUtil._perform_ocr(image, ocr_config, lang, field_type)
+    # Pixel budget properties are read only if the image is prepared for the field type
+    properties = ApplicationPropertiesService.pixel_budget_properties if OCRImagePreprocessor.is_applied(field_type) else None
+    return stage_cache.memoize('ocr', [image, ocr_config, lang, field_type], properties,
+                               lambda: ReceiptUtil._perform_ocr(image, ocr_config, lang, field_type))
+
+  def _perform_ocr(image, ocr_config, lang, field_type):
+    ocr_image, pixel_count, transform = image, image.size, None
+    if OCRImagePreprocessor.is_applied(field_type):
+      ocr_image, pixel_count, transform = OCRImagePreprocessor.prepare(image, field_type)
+      if ocr_image is None:
+        return OCRImagePreprocessor.prepare_empty_result()
+
+    with Tracer.ocr_span(pixel_count, ocr_config, lang):
+      if lang is None:
+        df = pd.DataFrame(pytesseract.image_to_data(ocr_image, config = ocr_config, output_type=Output.DICT))
+      else:
+        df = pd.DataFrame(pytesseract.image_to_data(ocr_image, lang = lang, config = ocr_config, output_type=Output.DICT))
     df = df[df.text.str.strip() != '']
+    if transform is not None:
+      df = OCRImagePreprocessor.map_words_back(df, transform)
     return df
 
-  def perform_ocr_obtain_values(image, ocr_config, return_type, lang = None):
+  def perform_ocr_obtain_values(image, ocr_config, return_type, lang = None, field_type = None, is_single_item_retry_on = True):
     """
     Reads text on an image using OCR.
-    Casts values to the given type.
+    Casts values to the given type. Float values which can not be read are
+    read again as single items if {is_single_item_retry_on}, otherwise
+    they are suppressed with `-1` (to be re-read only if found inconsistent).
 
     Args:
         image (numpy array)
         ocr_config (str)
         return_type: type to cast values to
         lang (str)
+        field_type (str): see perform_ocr
         ...
 
     Returns:
@@ -110,7 +164,7 @@ class ReceiptUtil:
                 data frame of OCR results
 
     """
-    df = ReceiptUtil.perform_ocr(image, ocr_config, lang = lang)
+    df = ReceiptUtil.perform_ocr(image, ocr_config, lang = lang, field_type = field_type)
     values = []
     for index, row in df.iterrows():
       text = row.text
@@ -121,9 +175,14 @@ class ReceiptUtil:
           value = float(text)
           values.append(value)
         except ValueError:
+          if not is_single_item_retry_on:
+            warnings.warn('Non-float value error supressed with `-1`', UserWarning)
+            values.append(-1)
+            continue
           x1, x2 = row.left, row.left + row.width
           y1, y2 = row.top, row.top + row.height
           one_item_image = image[y1:y2,x1:x2]
+          Tracer.event('fallback', kind='single_item_ocr')
           value = ReceiptUtil.perform_ocr_on_single_item_image_mult_times(one_item_image)
           values.append(value)
     return values, df
@@ -134,6 +193,7 @@ class ReceiptUtil:
       value = float(text)
       return value
     except ValueError:
+      Tracer.event('retry', kind='single_item_thick_stroke')
       text = ReceiptUtil.perform_ocr_on_single_item_image(one_item_image, scale_factor=4, stroke_width=10)
       try:
         value = float(text)
@@ -183,6 +243,50 @@ class ReceiptUtil:
       text = ''
     return text
 
+  def perform_ocr_with_heavier_settings(image, scale_factor = 3, psm = 7):
+    """
+    Reads a single number on an image upscaled and binarized,
+    with the given page segmentation mode.
+
+    Args:
+        image (numpy array)
+        scale_factor: upscaling factor
+        psm: Tesseract page segmentation mode
+        ...
+
+    Returns:
+        return: value (None if not readable)
+    """
+    if image.size == 0:
+      return None
+    image_temp = Util.resize_image(image, scale_factor)
+    _, image_temp = cv2.threshold(image_temp, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    image_temp = cv2.copyMakeBorder(image_temp, 10, 10, 10, 10, cv2.BORDER_CONSTANT, value=255)
+    df = ReceiptUtil.perform_ocr(image=image_temp, ocr_config=f'--psm {psm} -c tessedit_char_whitelist=.0123456789',
+                                 lang=None)
+    text = ReceiptUtil.preprocess_to_real_number(''.join(df.text.to_list()))
+    try:
+      return Util.clean_and_convert_to_float(text)
+    except ValueError:
+      return None
+
+  def determine_words_confidence(df_words):
+    """
+    Determines confidence of a value read from several words
+    as the lowest Tesseract confidence of the words.
+
+    Args:
+        df_words: data frame of OCR results
+        ...
+
+    Returns:
+        return: confidence (0 if there is no word)
+    """
+    confidences = pd.to_numeric(df_words.conf, errors='coerce').dropna()
+    if confidences.shape[0] == 0:
+      return 0
+    return float(confidences.min())
+
   def prepare_product_images(products_part, df_quantities, quantities_image_height, product_line_margin = 3):
     """
     Helps to segment product names image into images of seperate product names.
@@ -198,13 +302,7 @@ class ReceiptUtil:
         return: product_images
     """
     # print(df_quantities)
-    product_lines_ys = []
-    for i in range(1, df_quantities.shape[0]):
-      y1, y2 = df_quantities.iloc[i-1].top, df_quantities.iloc[i].top
-      product_lines_ys.append((max(y1-product_line_margin, 0),y2))
-
-    y1, y2 = df_quantities.iloc[-1].top, quantities_image_height
-    product_lines_ys.append((max(y1-product_line_margin, 0),y2))
+    product_lines_ys = ReceiptUtil.determine_product_lines_ys(df_quantities, quantities_image_height, product_line_margin)
     product_images = []
     for i in range(len(product_lines_ys)):
       product_line_ys = product_lines_ys[i]
@@ -230,11 +328,7 @@ class ReceiptUtil:
         return: price_images
     """
 
-    price_lines_ys = []
-    for i in range(df_quantities.shape[0]):
-      y1, y2 = df_quantities.iloc[i].top, df_quantities.iloc[i].top + df_quantities.iloc[i].height
-      price_lines_ys.append((max(y1-price_line_margin, 0), min(y2+price_line_margin, prices_part.shape[0])))
-      # price_lines_ys.append((y1-price_line_margin,y2+price_line_margin))
+    price_lines_ys = ReceiptUtil.determine_value_lines_ys(df_quantities, prices_part.shape[0], price_line_margin)
     # print('Price lines:', price_lines_ys)
     price_images = []
     for i in range(len(price_lines_ys)):
@@ -261,12 +355,7 @@ class ReceiptUtil:
         return: amount_images
     """
 
-    amount_lines_ys = []
-    for i in range(df_quantities.shape[0]):
-      y1, y2 = df_quantities.iloc[i].top, df_quantities.iloc[i].top + df_quantities.iloc[i].height
-      # print(y1, y2)
-      amount_lines_ys.append((max(y1-amount_line_margin, 0), min(y2+amount_line_margin, amounts_part.shape[0])))
-      # amount_lines_ys.append((y1-amount_line_margin, y2+amount_line_margin))
+    amount_lines_ys = ReceiptUtil.determine_value_lines_ys(df_quantities, amounts_part.shape[0], amount_line_margin)
     # print('Amount lines:', amount_lines_ys)
     amount_images = []
     for i in range(len(amount_lines_ys)):
@@ -278,6 +367,116 @@ class ReceiptUtil:
         ApplicationPropertiesService.logger.log_image(f'amount-{i + 1}', amount_image)
     return amount_images
 
+  def determine_product_lines_ys(df_quantities, image_height, line_margin = 3):
+    """
+    Determines vertical bounds of product name lines: each one starts at its quantity
+    and lasts until the next quantity (product names may take several lines).
+
+    Args:
+       df_quantities: data frame that contains OCR results of quantities part
+       image_height: height of the products part
+       line_margin: int
+       ...
+
+    Returns:
+        return: product_lines_ys
+    """
+    product_lines_ys = []
+    for i in range(1, df_quantities.shape[0]):
+      y1, y2 = df_quantities.iloc[i-1].top, df_quantities.iloc[i].top
+      product_lines_ys.append((max(y1-line_margin, 0),y2))
+
+    y1, y2 = df_quantities.iloc[-1].top, image_height
+    product_lines_ys.append((max(y1-line_margin, 0),y2))
+    return product_lines_ys
+
+  def determine_value_lines_ys(df_quantities, image_height, line_margin = 3):
+    """
+    Determines vertical bounds of single line values (prices, amounts)
+    aligned with the quantities.
+
+    Args:
+       df_quantities: data frame that contains OCR results of quantities part
+       image_height: height of the values part
+       line_margin: int
+       ...
+
+    Returns:
+        return: value_lines_ys
+    """
+    value_lines_ys = []
+    for i in range(df_quantities.shape[0]):
+      y1, y2 = df_quantities.iloc[i].top, df_quantities.iloc[i].top + df_quantities.iloc[i].height
+      value_lines_ys.append((max(y1-line_margin, 0), min(y2+line_margin, image_height)))
+    return value_lines_ys
+
+  def select_words_in_rectangle(df_words, rect_ys, rect_xs = None):
+    """
+    Selects OCR word boxes whose centers lie inside the given rectangle
+    and moves their coordinates to the rectangle's origin.
+
+    Args:
+       df_words: data frame of OCR results
+       rect_ys: (y_start, y_end)
+       rect_xs: (x_start, x_end), whole width if None
+       ...
+
+    Returns:
+        return: df_words of the rectangle
+    """
+    y_start, y_end = rect_ys
+    centers_y = df_words.top + df_words.height / 2
+    is_inside = (centers_y >= y_start) & (centers_y < y_end)
+    x_start = 0
+    if rect_xs is not None:
+      x_start, x_end = rect_xs
+      centers_x = df_words.left + df_words.width / 2
+      is_inside = is_inside & (centers_x >= x_start) & (centers_x < x_end)
+    df_words = df_words[is_inside].copy()
+    df_words['top'] = df_words.top - y_start
+    df_words['left'] = df_words.left - x_start
+    return df_words
+
+  def scale_word_boxes(df_words, scale_factor):
+    """
+    Maps OCR word boxes of a resized image to the coordinates of the original
+    image (boxes divided by the scale factor the image was resized by).
+
+    Args:
+       df_words: data frame of OCR results of the resized image
+       scale_factor: scale factor of the resized image
+       ...
+
+    Returns:
+        return: df_words in coordinates of the original image
+    """
+    df_words = df_words.copy()
+    for column in ['left', 'top', 'width', 'height']:
+      df_words[column] = (df_words[column] / scale_factor).round().astype(int)
+    return df_words
+
+  def group_words_into_lines(df_words):
+    """
+    Groups OCR word boxes into visual lines by their vertical centers,
+    regardless of the blocks Tesseract assigned them to.
+
+    Args:
+       df_words: data frame of OCR results
+       ...
+
+    Returns:
+        return: list of data frames (one per line, top to bottom, words left to right)
+    """
+    if df_words.shape[0] == 0:
+      return []
+    centers_y = (df_words.top + df_words.height / 2).sort_values(kind='stable')
+    line_height = df_words.height.median()
+    line_ids = (centers_y.diff() > line_height / 2).cumsum()
+    lines = []
+    for _, line_index in line_ids.groupby(line_ids, sort=True):
+      lines.append(df_words.loc[line_index.index].sort_values(by='left', kind='stable'))
+    return lines
+
   @staticmethod
   def select_keyword_existed_rows(df, searched_col_name, keywords, similiarity_thresh = 80):
     """
@@ -296,15 +495,54 @@ class ReceiptUtil:
     """
     selected_rows = []
     keyword_token_counts = []
-    for keyword in keywords:
-      for index, value in df[searched_col_name].items():
-        similarity_score = fuzz.ratio(keyword, value)
-        if similarity_score >= similiarity_thresh:
-            selected_rows.append((index, keyword, value))
-            token_count = len(keyword.split(' '))
-            keyword_token_counts.append(token_count)
+    if len(keywords) == 0 or df.shape[0] == 0:
+      return selected_rows, keyword_token_counts
+
+    keywords, keyword_positions, token_counts, keyword_scores = ReceiptUtil._prepare_keyword_set(tuple(keywords))
+    indices = df[searched_col_name].index.to_list()
+    values = df[searched_col_name].to_list()
+
+    # Score each distinct token once; exact keyword hits are taken from the cached keyword x keyword scores
+    unique_values = list(dict.fromkeys(value for value in values if value not in keyword_positions))
+    unique_scores = process.cdist(keywords, unique_values, scorer=fuzz.ratio,
+                                  score_cutoff=similiarity_thresh, dtype=np.float64)
+    unique_positions = {value: i for i, value in enumerate(unique_values)}
+
+    scores = np.empty((len(keywords), len(values)), dtype=np.float64)
+    for j, value in enumerate(values):
+      if value in keyword_positions:
+        scores[:, j] = keyword_scores[:, keyword_positions[value]]
+      else:
+        scores[:, j] = unique_scores[:, unique_positions[value]]
+
+    # Row-major order keeps the (keyword, row) ordering of the pairwise search
+    for i, j in zip(*np.nonzero(scores >= similiarity_thresh)):
+      selected_rows.append((indices[j], keywords[i], values[j]))
+      keyword_token_counts.append(token_counts[i])
     return selected_rows, keyword_token_counts
 
+  @staticmethod
+  @lru_cache(maxsize=32)
+  def _prepare_keyword_set(keywords):
+    """
+    Preprocesses a keyword set once and caches it across receipts.
+
+    Args:
+        keywords: tuple of keywords
+        ...
+
+    Returns:
+        return: keywords, keyword_positions, token_counts, keyword_scores
+                (keyword x keyword similarity matrix used for exact token matches)
+    """
+    keyword_positions = {}
+    for i, keyword in enumerate(keywords):
+      keyword_positions.setdefault(keyword, i)
+    token_counts = [len(keyword.split(' ')) for keyword in keywords]
+    keyword_scores = process.cdist(keywords, keywords, scorer=fuzz.ratio, dtype=np.float64)
+    keyword_scores.setflags(write=False)
+    return keywords, keyword_positions, token_counts, keyword_scores
+
   @staticmethod
   def extract_content_based_on_keywords(selected_df, df, df_last_content):
     """
@@ -349,16 +587,35 @@ class ReceiptUtil:
     Returns:
         return: results_dict, df, selected_df
 
+    """
+    # Extract text from the given image (image -> recognition df)
+    ocr_property = ApplicationPropertiesService.ocr_properties.general_part_ocr_property
+    df_general = ReceiptUtil.perform_ocr(image, ocr_config = ocr_property.config , lang = ocr_property.lang, field_type = 'general').reset_index(drop=True)
+
+    return ReceiptUtil.rule_based_text_extraction_from_words(df_general, multi_token_keywords, one_token_keywords)
+
+  @staticmethod
+  def rule_based_text_extraction_from_words(df_general, multi_token_keywords, one_token_keywords):
+    """
+    Searches one token and multi token keywords and the corresponding values
+    in already obtained OCR results (word boxes).
+
+    Args:
+        df_general: data frame of OCR results
+        multi_token_keywords
+        one_token_keywords
+        ...
+
+    Returns:
+        return: results_dict, df, selected_df
+
     """
     if multi_token_keywords is None:
       multi_token_keywords = []
     if one_token_keywords is None:
       one_token_keywords = []
 
-    # Extract text from the given image (image -> recognition df)
-    ocr_property = ApplicationPropertiesService.ocr_properties.general_part_ocr_property
-    df_general = ReceiptUtil.perform_ocr(image, ocr_config = ocr_property.config , lang = ocr_property.lang).reset_index(drop=True)
-
+    df_general = df_general.reset_index(drop=True)
     df_general['MergedStrings'] = df_general['text'] + ' ' + df_general['text'].shift(-1)
     df_last_content = df_general.iloc[-1:]
     df = df_general.iloc[:-1]  # Drop the last row as it will contain NaN due to shifting
@@ -374,7 +631,7 @@ class ReceiptUtil:
     keyword_token_counts = keyword_token_counts_multi_token + keyword_token_counts_one_token
 
     if len(selected_rows) == 0:
-      return {}
+      return {}, df, None
 
     selected_df = pd.DataFrame(selected_rows, columns=['Index', 'Keyword', 'MatchedString'])
     selected_df['KeywordTokenCount'] = keyword_token_counts
@@ -385,6 +642,42 @@ class ReceiptUtil:
 
     return results_dict, df, selected_df
 
+  @staticmethod
+  def is_extraction_reliable(results_dict, keywords, df_words, selected_df, confidence_thresh = 60):
+    """
+    Checks whether the values of the given keywords were found
+    and the words they were read from (the value tokens following each
+    keyword, not the other words of the region) are confident enough.
+    Rows without text or with confidence -1 (not words) are ignored.
+
+    Args:
+        results_dict: keyword : searched value
+        keywords: list of keywords which must have values
+        df_words: data frame of OCR results the values were extracted from
+        selected_df: keyword searching results (see rule_based_text_extraction_from_words)
+        confidence_thresh: minimal acceptable Tesseract word confidence
+        ...
+
+    Returns:
+        return: flag to determine whether re-OCR is needed
+    """
+    for keyword in keywords:
+      if results_dict.get(keyword.replace(':', ''), '').strip() == '':
+        return False
+    df_words = df_words.reset_index(drop=True)
+    keyword_indices = selected_df.Keyword.str.replace(':', '').to_list()
+    for keyword in keywords:
+      # The value of a keyword matched more than once is taken after its last match
+      i = len(keyword_indices) - 1 - keyword_indices[::-1].index(keyword.replace(':', ''))
+      start = selected_df.Index.iloc[i] + selected_df.KeywordTokenCount.iloc[i]
+      end = selected_df.Index.iloc[i + 1] if i + 1 < selected_df.shape[0] else df_words.shape[0]
+      value_words = df_words.iloc[start:end]
+      confidences = pd.to_numeric(value_words.conf, errors='coerce')
+      confidences = confidences[(value_words.text.astype(str).str.strip() != '') & (confidences != -1)].dropna()
+      if confidences.shape[0] == 0 or confidences.min() < confidence_thresh:
+        return False
+    return True
+
   @staticmethod
   def calculate_histograms(image, is_cleaning_applied = True):
     """
@@ -565,36 +858,30 @@ class ReceiptUtil:
 
   @staticmethod
   def _export_receipts_to_excel(receipts):
-    df_general_info_payments = pd.DataFrame(columns=[
+    general_info_payment_columns = [
       'FiscalCode', 'ObjName', 'Address', 'ObjCode',
       'TaxPayer', 'TIN', 'ReceiptID', 'Cashier',
       'Date', 'Time', 'TotalAmount', 'TaxAmount',
       'NonTaxAmount', 'Cashless', 'Cash', 'PaidCash',
       'Change', 'Bonus', 'PrePayment', 'Credit',
-    ])
-    df_products = pd.DataFrame(columns=[
-      'FiscalCode', 'ProductName', 'Quantity', 'Price', 'Amount'
-    ])
+    ]
+    product_columns = ['FiscalCode', 'ProductName', 'Quantity', 'Price', 'Amount']
 
+    # Rows are collected first and the data frames are built at once
+    general_info_payment_rows = []
+    products_frames = []
     for i in range(len(receipts)):
       receipt = receipts[i]
-      general_info = receipt.general_info
-      products = receipt.product_list.products
-      payment_info = receipt.payment_info
+      product_list = receipt.product_list
       fiscal_code = receipt._fiscal_code
       print('Code:', fiscal_code)
-      df_general_info_payments.loc[len(df_general_info_payments)] = [
-        fiscal_code, general_info.name, general_info.address, general_info.code,
-        general_info.tax_payer_name, general_info.TIN, general_info.sale_receipt_num, general_info.cashier_name,
-        general_info.date, general_info.time, payment_info.total_amount, payment_info.tax_amount,
-        payment_info.non_tax_amount, payment_info.cashless_payment_amount, payment_info.cash_payment_amount, payment_info.paid_cash_amount,
-        payment_info.change_cash_amount, payment_info.bonus, payment_info.prepayment, payment_info.credit
-      ]
-
-      for product in products:
-        df_products.loc[len(df_products)] = [
-          fiscal_code, product.name, product.quantity, product.price, product.amount
-        ]
+      general_info_payment_rows.append((fiscal_code,) + receipt.general_info.to_tuple() + receipt.payment_info.to_tuple())
+      products_frames.append(pd.DataFrame({
+        'FiscalCode': [fiscal_code] * product_list.get_num_products(), 'ProductName': product_list.names,
+        'Quantity': product_list.quantities, 'Price': product_list.prices, 'Amount': product_list.amounts
+      }, columns=product_columns))
+    df_general_info_payments = pd.DataFrame(general_info_payment_rows, columns=general_info_payment_columns)
+    df_products = pd.concat(products_frames, ignore_index=True) if products_frames else pd.DataFrame(columns=product_columns)
     folder_name = os.path.join(
       ApplicationPropertiesService.logger.output_dir,
       'overal_data'
@@ -745,14 +1032,9 @@ class ReceiptUtil:
         row.Change, row.Bonus, row.PrePayment, row.Credit,
       )
       product_rows = df_products[df_products.FiscalCode == fiscal_code]
-      products = []
-      for index in range(len(df_products)):
-        row = df_products.iloc[index]
-        product = Product(
-          row.ProductName, row.Quantity, row.Price, row.Amount
-        )
-        products.append(product)
-      product_list = ReceiptProductList(products)
+      product_list = ReceiptProductList.from_columns(
+        product_rows.ProductName.to_list(), product_rows.Quantity, product_rows.Price, product_rows.Amount
+      )
 
       receipt = Receipt(
         general_info, product_list, payment_info
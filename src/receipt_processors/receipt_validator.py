@@ -0,0 +1,109 @@
+import itertools
+
+
+class ReceiptValidator:
+  """
+  Class for checking arithmetic consistency of the mined receipt values,
+  so that only the inconsistent values are read again.
+
+  Methods:
+      is_product_line_consistent(quantity, price, amount, tolerance) -> checks quantity x price = amount.
+      find_inconsistent_product_lines(products, tolerance) -> indices of inconsistent product lines.
+      find_consistent_product_line(candidates, tolerance) -> consistent combination of candidate values.
+      find_failed_payment_checks(product_list, payment_info, tolerance) -> names of failed payment checks.
+  """
+  UNREAD_VALUE = -1
+
+  @staticmethod
+  def is_close(value1, value2, tolerance):
+    return abs(value1 - value2) <= tolerance
+
+  @staticmethod
+  def is_product_line_consistent(quantity, price, amount, tolerance):
+    """
+    Checks quantity x price = amount on a product line.
+
+    Args:
+        quantity, price, amount: float
+        tolerance: allowed absolute difference
+        ...
+
+    Returns:
+        return: flag of consistency
+    """
+    if ReceiptValidator.UNREAD_VALUE in (quantity, price, amount):
+      return False
+    return ReceiptValidator.is_close(quantity * price, amount, tolerance)
+
+  @staticmethod
+  def find_inconsistent_product_lines(products, tolerance):
+    """
+    Args:
+        products (list): list of Product instances
+        tolerance: allowed absolute difference
+        ...
+
+    Returns:
+        return: indices of the inconsistent product lines
+    """
+    return [i for i in range(len(products))
+            if not ReceiptValidator.is_product_line_consistent(products[i].quantity, products[i].price,
+                                                               products[i].amount, tolerance)]
+
+  @staticmethod
+  def find_consistent_product_line(candidates, tolerance):
+    """
+    Searches a consistent (quantity, price, amount) combination among the
+    candidate values, the earlier candidates (original reads) are preferred.
+
+    Args:
+        candidates: [quantity candidates, price candidates, amount candidates]
+        tolerance: allowed absolute difference
+        ...
+
+    Returns:
+        return: (quantity, price, amount) or None
+    """
+    for quantity, price, amount in itertools.product(*candidates):
+      if ReceiptValidator.is_product_line_consistent(quantity, price, amount, tolerance):
+        return quantity, price, amount
+    return None
+
+  @staticmethod
+  def find_failed_payment_checks(product_list, payment_info, tolerance):
+    """
+    Checks payment values against the products and each other:
+    sum of amounts = total amount,
+    cashless + cash + bonus + prepayment + credit = total amount,
+    paid cash - change = cash (when paid in cash).
+
+    Args:
+        product_list: ReceiptProductList instance
+        payment_info: ReceiptPaymentInfo instance
+        tolerance: allowed absolute difference
+        ...
+
+    Returns:
+        return: list of names of the failed checks
+    """
+    failed_checks = []
+    total_amount = payment_info.total_amount
+    if ReceiptValidator.UNREAD_VALUE in (total_amount, payment_info.cashless_payment_amount,
+                                         payment_info.cash_payment_amount, payment_info.paid_cash_amount,
+                                         payment_info.change_cash_amount, payment_info.bonus,
+                                         payment_info.prepayment, payment_info.credit):
+      failed_checks.append('unread payment value')
+
+    if not ReceiptValidator.is_close(product_list.get_total_amount(), total_amount, tolerance):
+      failed_checks.append('products total')
+
+    paid_amount = payment_info.cashless_payment_amount + payment_info.cash_payment_amount + \
+                  payment_info.bonus + payment_info.prepayment + payment_info.credit
+    if not ReceiptValidator.is_close(paid_amount, total_amount, tolerance):
+      failed_checks.append('payment total')
+
+    if payment_info.paid_cash_amount != 0:
+      if not ReceiptValidator.is_close(payment_info.paid_cash_amount - payment_info.change_cash_amount,
+                                       payment_info.cash_payment_amount, tolerance):
+        failed_checks.append('cash change')
+    return failed_checks
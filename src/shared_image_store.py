@@ -0,0 +1,119 @@
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedImageStore:
+    """
+    Class for handing decoded receipt images to worker processes without
+    copying them: an image is copied once into a shared memory block and
+    only its handle (block name, shape, dtype) is pickled to the workers,
+    which map the block as a read-only NumPy array.
+
+    Blocks are reference counted: put(key, image) holds a reference of the
+    store (dropped by release(key) once the tasks are submitted), acquire(key)
+    adds a reference for each task using the image and release(key) drops it
+    when the task is done; a block is unlinked with its last reference, and
+    close() unlinks the remaining ones (e.g. after an error).
+
+    Methods:
+        put(key, image) -> handle
+        acquire(key) -> handle, release(key)
+        attach(handle) -> read-only image (in the worker process)
+        detach() -> closes the blocks attached by the process whose images are not referenced anymore
+        get_stats() -> blocks, bytes
+        close()
+    """
+    # Blocks attached by this (worker) process, by block name
+    _attached_blocks = {}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def put(self, key, image):
+        image = np.ascontiguousarray(image)
+        block = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+        SharedImageStore._as_array(block, image.shape, image.dtype)[...] = image
+        handle = (block.name, image.shape, image.dtype.str)
+        with self._lock:
+            if key in self._entries:
+                block.close()
+                block.unlink()
+                raise ValueError(f'Image is already stored: {key}')
+            self._entries[key] = {'block': block, 'handle': handle, 'references': 1}
+        return handle
+
+    def acquire(self, key):
+        with self._lock:
+            entry = self._entries[key]
+            entry['references'] += 1
+            return entry['handle']
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries[key]
+            entry['references'] -= 1
+            if entry['references'] > 0:
+                return
+            del self._entries[key]
+        SharedImageStore._unlink(entry['block'])
+
+    @staticmethod
+    def _unlink(block):
+        block.close()
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def attach(handle):
+        name, shape, dtype = handle
+        block = SharedImageStore._attached_blocks.get(name)
+        if block is None:
+            try:
+                # The creating process owns the block, the resource tracker of the worker must not unlink it
+                block = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                block = shared_memory.SharedMemory(name=name)
+            SharedImageStore._attached_blocks[name] = block
+        image = SharedImageStore._as_array(block, shape, np.dtype(dtype))
+        image.flags.writeable = False
+        return image
+
+    @staticmethod
+    def _as_array(block, shape, dtype):
+        # frombuffer holds the buffer, so the block cannot be closed (unmapped) under a living image or crop
+        return np.frombuffer(block.buf, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+    @staticmethod
+    def detach():
+        for name, block in list(SharedImageStore._attached_blocks.items()):
+            try:
+                block.close()
+            except BufferError:
+                # An image (or a crop of it) of the block is still referenced, it is closed by a later detach()
+                continue
+            del SharedImageStore._attached_blocks[name]
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'blocks': len(self._entries),
+                'bytes': sum(entry['block'].size for entry in self._entries.values()),
+            }
+
+    def close(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            SharedImageStore._unlink(entry['block'])
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import time
+
+from src.models.receipt import Receipt
+
+
+class BatchJournal:
+    """
+    Class for an append-only journal (JSON lines) of a batch run, so that a
+    restarted run skips the finished fiscal codes and retries the failed ones.
+
+    Each line is an entry of a fiscal code: started (attempt number),
+    completed (with the receipt) or failed (with the error). Lines are
+    flushed and synced to disk when written; on opening, the journal is
+    replayed (a torn last line of a killed run is ignored and cut off, so
+    the entries appended after it stay readable).
+    An attempt started but neither completed nor failed (the run was
+    killed) counts as an attempt, so a receipt crashing the process is not
+    retried endlessly: at most {max_attempts} attempts are made.
+
+    Methods:
+        get_pending(fiscal_codes) -> generator of the fiscal codes not completed and having attempts left (in the given order)
+        mark_started(fiscal_code), mark_completed(fiscal_code, receipt), mark_failed(fiscal_code, error, error_traceback)
+        get_completed_receipts(fiscal_codes = None) -> dict of fiscal code: Receipt instance
+        get_failures(fiscal_codes = None) -> dict of fiscal code: attempts, last error, traceback (not completed ones)
+        get_stats() -> completed, failed, exhausted, interrupted counts
+    """
+    STATUS_STARTED = 'started'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+
+    def __init__(self, path = os.path.join('logs', 'batches', 'main_batch.jsonl'), max_attempts = 3, is_synced = True):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_attempts = max_attempts
+        self.is_synced = is_synced
+        self._lock = threading.Lock()
+        self._completed = {}
+        self._attempts = {}
+        self._failures = {}
+        self._in_progress = set()
+        self._replay()
+        self._truncate_torn_line()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._apply(entry)
+        # Attempts of a killed run stay counted, they are not in progress anymore
+        self._in_progress.clear()
+
+    def _truncate_torn_line(self, chunk_size = 4096):
+        # A torn last line is cut back to the last newline, so the next entry does not continue it
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as file:
+            end = file.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(position - chunk_size, 0)
+                file.seek(start)
+                chunk = file.read(position - start)
+                newline_index = chunk.rfind(b'\n')
+                if newline_index != -1:
+                    position = start + newline_index + 1
+                    break
+                position = start
+            if position < end:
+                file.truncate(position)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def _apply(self, entry):
+        fiscal_code, status = entry['fiscal_code'], entry['status']
+        if status == BatchJournal.STATUS_STARTED:
+            self._attempts[fiscal_code] = entry['attempt']
+            self._in_progress.add(fiscal_code)
+        elif status == BatchJournal.STATUS_COMPLETED:
+            self._completed[fiscal_code] = entry['receipt']
+            self._failures.pop(fiscal_code, None)
+            self._in_progress.discard(fiscal_code)
+        elif status == BatchJournal.STATUS_FAILED:
+            self._failures[fiscal_code] = {'error': entry['error'], 'traceback': entry.get('traceback')}
+            self._in_progress.discard(fiscal_code)
+
+    def _write(self, entry):
+        entry['time'] = time.time()
+        line = json.dumps(entry, ensure_ascii=False, default=Receipt._convert_scalar) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.is_synced:
+                os.fsync(self._file.fileno())
+            self._apply(entry)
+
+    def get_pending(self, fiscal_codes):
+        # Lazy, so that the fiscal codes can be streamed (e.g. from FiscalCodeIndex.iterate)
+        for fiscal_code in fiscal_codes:
+            with self._lock:
+                is_pending = fiscal_code not in self._completed and fiscal_code not in self._in_progress and \
+                    self._attempts.get(fiscal_code, 0) < self.max_attempts
+            if is_pending:
+                yield fiscal_code
+
+    def mark_started(self, fiscal_code):
+        self._write({'fiscal_code': fiscal_code, 'status': BatchJournal.STATUS_STARTED,
+                     'attempt': self._attempts.get(fiscal_code, 0) + 1})
+
+    def mark_completed(self, fiscal_code, receipt):
+        self._write({'fiscal_code': fiscal_code, 'status': BatchJournal.STATUS_COMPLETED, 'receipt': receipt.to_dict()})
+
+    def mark_failed(self, fiscal_code, error, error_traceback = None):
+        self._write({'fiscal_code': fiscal_code, 'status': BatchJournal.STATUS_FAILED,
+                     'error': f'{type(error).__name__}: {error}' if isinstance(error, BaseException) else str(error),
+                     'traceback': error_traceback})
+
+    def get_completed_receipts(self, fiscal_codes = None):
+        with self._lock:
+            fiscal_codes = list(self._completed) if fiscal_codes is None else fiscal_codes
+            return {fiscal_code: Receipt.from_dict(self._completed[fiscal_code])
+                    for fiscal_code in fiscal_codes if fiscal_code in self._completed}
+
+    def get_failures(self, fiscal_codes = None):
+        with self._lock:
+            fiscal_codes = list(self._failures) if fiscal_codes is None else fiscal_codes
+            return {fiscal_code: {'attempts': self._attempts.get(fiscal_code, 0), **self._failures[fiscal_code]}
+                    for fiscal_code in fiscal_codes if fiscal_code in self._failures}
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'completed': len(self._completed),
+                'failed': len(self._failures),
+                'exhausted': sum(self._attempts.get(fiscal_code, 0) >= self.max_attempts for fiscal_code in self._failures),
+                'interrupted': sum(fiscal_code not in self._completed and fiscal_code not in self._failures
+                                   for fiscal_code in self._attempts),
+            }
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,201 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+
+class FiscalCodeIndex:
+    """
+    Class for a persistent (SQLite) index of fiscal codes, so that code files,
+    link files and stdin can be ingested line by line (in transactions of
+    {batch_size} lines, the input is never held in memory) and deduplicated
+    against all codes ingested before.
+
+    A line is normalized to a fiscal code the way the bot reads a QR code
+    (the part after the last '='), so E-kassa links and bare codes are
+    accepted alike; lines not being base58 codes of 12-44 characters are
+    counted as invalid.
+    A code which is a prefix of a longer code (e.g. 4tFLVnqE1gbT of
+    4tFLVnqE1gbTmMWyK87z...) is a truncated duplicate: it is kept as an alias
+    of the longer code, whichever of them is ingested first (if the truncated
+    code came first, it is counted as truncated instead of new once the longer
+    code arrives, and its processed status is kept by the longer code).
+
+    Methods:
+        normalize(line) -> fiscal code or None
+        read_lines(paths) -> generator of lines of the files ('-' is stdin)
+        ingest(lines, source) -> counts of read, invalid, new, duplicate, truncated lines
+        iterate(status = None) -> generator of fiscal codes (sorted)
+        mark_processed(fiscal_codes), get_full_code(fiscal_code), get_stats()
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSED = 'processed'
+    MIN_CODE_LENGTH = 12
+    MAX_CODE_LENGTH = 44
+    CODE_PATTERN = re.compile(r'[1-9A-HJ-NP-Za-km-z]{%d,%d}' % (MIN_CODE_LENGTH, MAX_CODE_LENGTH))
+    # Upper bound of the codes starting with a prefix: greater than any base58 character
+    PREFIX_RANGE_END = '{'
+
+    def __init__(self, path = os.path.join('logs', 'fiscal_codes', 'index.sqlite3'), batch_size = 10000):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.executescript('''
+                CREATE TABLE IF NOT EXISTS fiscal_codes (
+                    code TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    source TEXT,
+                    added_at REAL NOT NULL,
+                    processed_at REAL
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS truncated_codes (
+                    code TEXT PRIMARY KEY,
+                    full_code TEXT NOT NULL,
+                    source TEXT,
+                    added_at REAL NOT NULL
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_truncated_codes_full_code ON truncated_codes (full_code);
+                CREATE INDEX IF NOT EXISTS idx_fiscal_codes_status ON fiscal_codes (status, code);
+            ''')
+        # Few distinct lengths in practice (12, 43, 44), so a code has few possible truncated prefixes
+        self._code_lengths = {row[0] for row in self._connection.execute('SELECT DISTINCT length(code) FROM fiscal_codes')}
+
+    @staticmethod
+    def normalize(line):
+        fiscal_code = line.strip().split('=')[-1].strip()
+        return fiscal_code if FiscalCodeIndex.CODE_PATTERN.fullmatch(fiscal_code) else None
+
+    @staticmethod
+    def read_lines(paths):
+        for path in paths:
+            if path == '-':
+                yield from sys.stdin
+                continue
+            with open(path, 'r', encoding='utf-8-sig') as file:
+                yield from file
+
+    def ingest(self, lines, source = None):
+        """
+        Args:
+            lines: iterable of lines (fiscal codes or E-kassa links)
+            source: name of the input, stored with the new codes
+
+        Returns:
+            return: dict of counts: read, invalid, new, duplicate (incl. already ingested),
+                    truncated (incl. codes ingested before, found truncated by a longer code of the lines)
+        """
+        counts = {'read': 0, 'invalid': 0, 'new': 0, 'duplicate': 0, 'truncated': 0}
+        started_at = time.time()
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= self.batch_size:
+                self._ingest_batch(batch, source, counts, started_at)
+                batch = []
+        if batch:
+            self._ingest_batch(batch, source, counts, started_at)
+        return counts
+
+    def _ingest_batch(self, lines, source, counts, started_at):
+        now = time.time()
+        with self._lock, self._connection:
+            for line in lines:
+                counts['read'] += 1
+                fiscal_code = FiscalCodeIndex.normalize(line)
+                if fiscal_code is None:
+                    if line.strip():
+                        counts['invalid'] += 1
+                    continue
+                counts[self._add(fiscal_code, source, now, counts, started_at)] += 1
+
+    def _add(self, fiscal_code, source, now, counts, started_at):
+        # The longest ingested code starting with this one (a truncated code always has its full code ingested)
+        row = self._connection.execute(
+            'SELECT code FROM fiscal_codes WHERE code >= ? AND code < ? ORDER BY length(code) DESC LIMIT 1',
+            (fiscal_code, fiscal_code + FiscalCodeIndex.PREFIX_RANGE_END)).fetchone()
+        if row is not None:
+            if row[0] == fiscal_code or self._connection.execute(
+                    'SELECT 1 FROM truncated_codes WHERE code = ?', (fiscal_code,)).fetchone() is not None:
+                return 'duplicate'
+            self._connection.execute('INSERT INTO truncated_codes VALUES (?, ?, ?, ?)',
+                                     (fiscal_code, row[0], source, now))
+            return 'truncated'
+
+        # Shorter codes ingested before which are prefixes of this one become its aliases
+        # (only the lengths present in the index are looked up)
+        processed_at = None
+        prefixes = [fiscal_code[:length] for length in self._code_lengths if length < len(fiscal_code)]
+        if prefixes:
+            placeholders = ', '.join('?' * len(prefixes))
+            truncated_rows = self._connection.execute(
+                f'SELECT code, status, source, added_at, processed_at FROM fiscal_codes WHERE code IN ({placeholders})',
+                prefixes).fetchall()
+            for code, status, truncated_source, added_at, truncated_processed_at in truncated_rows:
+                self._connection.execute('DELETE FROM fiscal_codes WHERE code = ?', (code,))
+                self._connection.execute('UPDATE truncated_codes SET full_code = ? WHERE full_code = ?',
+                                         (fiscal_code, code))
+                self._connection.execute('INSERT INTO truncated_codes VALUES (?, ?, ?, ?)',
+                                         (code, fiscal_code, truncated_source, added_at))
+                # The receipt of the truncated code is the receipt of the full one
+                if status == FiscalCodeIndex.STATUS_PROCESSED:
+                    processed_at = max(processed_at or 0.0, truncated_processed_at or 0.0)
+                # Counted as new by this ingestion, it turns out to be truncated
+                if added_at >= started_at:
+                    counts['new'] -= 1
+                counts['truncated'] += 1
+        self._connection.execute('INSERT INTO fiscal_codes VALUES (?, ?, ?, ?, ?)',
+                                 (fiscal_code, FiscalCodeIndex.STATUS_PENDING if processed_at is None else
+                                  FiscalCodeIndex.STATUS_PROCESSED, source, now, processed_at))
+        self._code_lengths.add(len(fiscal_code))
+        return 'new'
+
+    def iterate(self, status = None):
+        # Keyset pagination: only a page of codes is read at a time
+        last_code = ''
+        while True:
+            with self._lock:
+                if status is None:
+                    rows = self._connection.execute(
+                        'SELECT code FROM fiscal_codes WHERE code > ? ORDER BY code LIMIT ?',
+                        (last_code, self.batch_size)).fetchall()
+                else:
+                    rows = self._connection.execute(
+                        'SELECT code FROM fiscal_codes WHERE status = ? AND code > ? ORDER BY code LIMIT ?',
+                        (status, last_code, self.batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row[0]
+            last_code = rows[-1][0]
+
+    def mark_processed(self, fiscal_codes):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'UPDATE fiscal_codes SET status = ?, processed_at = ? WHERE code = ?',
+                [(FiscalCodeIndex.STATUS_PROCESSED, time.time(), fiscal_code) for fiscal_code in fiscal_codes])
+
+    def get_full_code(self, fiscal_code):
+        with self._lock:
+            row = self._connection.execute('SELECT full_code FROM truncated_codes WHERE code = ?', (fiscal_code,)).fetchone()
+        return row[0] if row is not None else fiscal_code
+
+    def get_stats(self):
+        with self._lock:
+            counts = dict(self._connection.execute('SELECT status, count(*) FROM fiscal_codes GROUP BY status').fetchall())
+            truncated_count = self._connection.execute('SELECT count(*) FROM truncated_codes').fetchone()[0]
+        return {
+            'codes': sum(counts.values()),
+            'pending': counts.get(FiscalCodeIndex.STATUS_PENDING, 0),
+            'processed': counts.get(FiscalCodeIndex.STATUS_PROCESSED, 0),
+            'truncated': truncated_count,
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,222 @@
+import os
+import uuid
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:
+    pa, pc, ds = None, None, None
+
+from src.storage.receipt_warehouse import ReceiptWarehouse
+
+
+class ReceiptAnalytics:
+    """
+    Class for the columnar analytics layer over mined receipts: Parquet
+    datasets 'receipts' (one row per receipt with its payment info) and
+    'products' (one row per product line with the receipt fields needed
+    for grouping), both hive-partitioned by month (YYYY-MM) and TIN.
+
+    Scans read only the columns of the query and the partitions selected
+    by tin/date filters (dates are 'YYYY-MM-DD'); aggregations are done by
+    Arrow, results are returned as pandas DataFrames.
+
+    Methods:
+        write(receipts) -> number of written receipts (receipts already in the dataset are skipped)
+        get_total_spend(group_by, tin, object_code, date_from, date_to) -> DataFrame
+        get_price_distribution(product_name, is_prefix, group_by, tin, date_from, date_to) -> DataFrame
+        get_top_products(n, by, tin, object_code, date_from, date_to) -> DataFrame
+    """
+    RECEIPT_COLUMNS = ['fiscal_code', 'date', 'time', 'object_code', 'object_name', 'total_amount', 'tax_amount',
+                       'cashless_payment_amount', 'cash_payment_amount', 'bonus', 'month', 'tin']
+    PRODUCT_COLUMNS = ['fiscal_code', 'date', 'object_code', 'object_name', 'line_num', 'name', 'name_key',
+                       'quantity', 'price', 'amount', 'month', 'tin']
+    UNKNOWN_PARTITION = 'unknown'
+
+    def __init__(self, root = os.path.join('logs', 'analytics')):
+        if pa is None:
+            raise ImportError('pyarrow is required for ReceiptAnalytics')
+        self.root = root
+        self.partitioning = ds.partitioning(pa.schema([('month', pa.string()), ('tin', pa.string())]), flavor='hive')
+        self.schemas = {
+            'receipts': pa.schema([
+                ('fiscal_code', pa.string()), ('date', pa.string()), ('time', pa.string()),
+                ('object_code', pa.string()), ('object_name', pa.string()),
+                ('total_amount', pa.float64()), ('tax_amount', pa.float64()),
+                ('cashless_payment_amount', pa.float64()), ('cash_payment_amount', pa.float64()),
+                ('bonus', pa.float64()), ('month', pa.string()), ('tin', pa.string())]),
+            'products': pa.schema([
+                ('fiscal_code', pa.string()), ('date', pa.string()), ('object_code', pa.string()),
+                ('object_name', pa.string()), ('line_num', pa.int32()), ('name', pa.string()),
+                ('name_key', pa.string()), ('quantity', pa.float64()), ('price', pa.float64()),
+                ('amount', pa.float64()), ('month', pa.string()), ('tin', pa.string())]),
+        }
+
+    def write(self, receipts):
+        """
+        Appends the receipts to the datasets; receipts whose fiscal code is
+        already in their partition are skipped.
+
+        Args:
+            receipts: list of Receipt instances
+            ...
+
+        Returns:
+            return: number of written receipts
+        """
+        receipt_table = self._prepare_receipt_table(receipts)
+        if receipt_table.num_rows == 0:
+            return 0
+        existing_fiscal_codes = self._get_existing_fiscal_codes(receipt_table)
+        if existing_fiscal_codes:
+            is_new = pc.invert(pc.is_in(receipt_table['fiscal_code'], value_set=pa.array(existing_fiscal_codes)))
+            receipts = [receipt for receipt, flag in zip(receipts, is_new.to_pylist()) if flag]
+            receipt_table = receipt_table.filter(is_new)
+        if receipt_table.num_rows == 0:
+            return 0
+        product_table = self._prepare_product_table(receipts, receipt_table)
+        basename_template = f'part-{uuid.uuid4().hex}-{{i}}.parquet'
+        for name, table in [('receipts', receipt_table), ('products', product_table)]:
+            ds.write_dataset(table, os.path.join(self.root, name), format='parquet', partitioning=self.partitioning,
+                             basename_template=basename_template, existing_data_behavior='overwrite_or_ignore')
+        return receipt_table.num_rows
+
+    def _prepare_receipt_table(self, receipts):
+        general_infos = [receipt.general_info for receipt in receipts]
+        payment_infos = [receipt.payment_info for receipt in receipts]
+        dates = [ReceiptWarehouse.normalize_date(general_info.date) for general_info in general_infos]
+        columns = {
+            'fiscal_code': [receipt.fiscal_code for receipt in receipts],
+            'date': dates,
+            'time': [general_info.time for general_info in general_infos],
+            'object_code': [str(general_info.code) for general_info in general_infos],
+            'object_name': [general_info.name for general_info in general_infos],
+            'month': [date[:7] if date else ReceiptAnalytics.UNKNOWN_PARTITION for date in dates],
+            'tin': [str(general_info.TIN) or ReceiptAnalytics.UNKNOWN_PARTITION for general_info in general_infos],
+        }
+        for field in ['total_amount', 'tax_amount', 'cashless_payment_amount', 'cash_payment_amount', 'bonus']:
+            columns[field] = np.array([getattr(payment_info, field) for payment_info in payment_infos], dtype=np.float64)
+        return pa.Table.from_pydict({column: columns[column] for column in ReceiptAnalytics.RECEIPT_COLUMNS},
+                                    schema=self.schemas['receipts'])
+
+    def _prepare_product_table(self, receipts, receipt_table):
+        product_lists = [receipt.product_list for receipt in receipts]
+        counts = np.array([product_list.get_num_products() for product_list in product_lists], dtype=np.int64)
+        # Receipt fields are repeated for each of its product lines
+        indices = pa.array(np.repeat(np.arange(len(receipts)), counts))
+        repeated_table = receipt_table.select(['fiscal_code', 'date', 'object_code', 'object_name', 'month', 'tin']).take(indices)
+        names = [name for product_list in product_lists for name in product_list.names]
+
+        def concatenate(column):
+            arrays = [getattr(product_list, column) for product_list in product_lists]
+            return np.concatenate(arrays) if arrays else np.array([], dtype=np.float64)
+
+        columns = {column: repeated_table[column] for column in repeated_table.column_names}
+        columns.update({
+            'line_num': np.concatenate([np.arange(count, dtype=np.int32) for count in counts]) if len(counts) else [],
+            'name': names,
+            'name_key': [ReceiptWarehouse.normalize_product_name(name) for name in names],
+            'quantity': concatenate('quantities'),
+            'price': concatenate('prices'),
+            'amount': concatenate('amounts'),
+        })
+        return pa.Table.from_pydict({column: columns[column] for column in ReceiptAnalytics.PRODUCT_COLUMNS},
+                                    schema=self.schemas['products'])
+
+    def _get_existing_fiscal_codes(self, receipt_table):
+        dataset = self._get_dataset('receipts')
+        if dataset is None:
+            return []
+        # Only the partitions of the new receipts are read
+        partition_filter = (ds.field('month').isin(pc.unique(receipt_table['month'])) &
+                            ds.field('tin').isin(pc.unique(receipt_table['tin'])))
+        return dataset.to_table(columns=['fiscal_code'], filter=partition_filter)['fiscal_code'].to_pylist()
+
+    def _get_dataset(self, name):
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(path):
+            return None
+        return ds.dataset(path, format='parquet', partitioning=self.partitioning, schema=self.schemas[name])
+
+    @staticmethod
+    def _prepare_filter(tin = None, object_code = None, date_from = None, date_to = None, extra_filter = None):
+        # Conditions on month/tin prune partitions, the one on date selects the rows
+        conditions = []
+        if tin is not None:
+            conditions.append(ds.field('tin') == str(tin))
+        if object_code is not None:
+            conditions.append(ds.field('object_code') == str(object_code))
+        if date_from is not None:
+            conditions += [ds.field('month') >= date_from[:7], ds.field('date') >= date_from]
+        if date_to is not None:
+            conditions += [ds.field('month') <= date_to[:7], ds.field('date') <= date_to]
+        if extra_filter is not None:
+            conditions.append(extra_filter)
+        scan_filter = None
+        for condition in conditions:
+            scan_filter = condition if scan_filter is None else scan_filter & condition
+        return scan_filter
+
+    def scan(self, name, columns, **filters):
+        """
+        Args:
+            name: receipts, products
+            columns: columns to read
+            filters: tin, object_code, date_from, date_to, extra_filter (dataset expression)
+            ...
+
+        Returns:
+            return: Arrow table of the columns (empty if the dataset does not exist)
+        """
+        dataset = self._get_dataset(name)
+        if dataset is None:
+            return self.schemas[name].empty_table().select(columns)
+        return dataset.to_table(columns=columns, filter=ReceiptAnalytics._prepare_filter(**filters))
+
+    def get_total_spend(self, group_by = ('month',), tin = None, object_code = None, date_from = None, date_to = None):
+        group_by = list(group_by)
+        table = self.scan('receipts', group_by + ['total_amount'], tin=tin, object_code=object_code,
+                          date_from=date_from, date_to=date_to)
+        result = table.group_by(group_by).aggregate([('total_amount', 'sum'), ('total_amount', 'count')])
+        return (ReceiptAnalytics._rename(result, {'total_amount_sum': 'total_amount', 'total_amount_count': 'receipt_count'})
+                .sort_by([(column, 'ascending') for column in group_by]).to_pandas())
+
+    def get_price_distribution(self, product_name = None, is_prefix = False, group_by = ('name_key', 'tin', 'month'),
+                               tin = None, object_code = None, date_from = None, date_to = None):
+        group_by = list(group_by)
+        extra_filter = None
+        if product_name is not None:
+            name_key = ReceiptWarehouse.normalize_product_name(product_name)
+            extra_filter = (pc.starts_with(ds.field('name_key'), name_key) if is_prefix
+                            else ds.field('name_key') == name_key)
+        table = self.scan('products', group_by + ['price'], tin=tin, object_code=object_code,
+                          date_from=date_from, date_to=date_to, extra_filter=extra_filter)
+        aggregations = ['count', 'min', 'max', 'mean', 'stddev', 'approximate_median']
+        result = table.group_by(group_by).aggregate([('price', aggregation) for aggregation in aggregations])
+        return (result.select(group_by + [f'price_{aggregation}' for aggregation in aggregations])
+                .sort_by([(column, 'ascending') for column in group_by]).to_pandas())
+
+    def get_top_products(self, n = 20, by = 'amount', tin = None, object_code = None, date_from = None, date_to = None):
+        """
+        Args:
+            n: number of products
+            by: amount, quantity, line_count
+            ...
+
+        Returns:
+            return: DataFrame (name_key, amount, quantity, line_count) of the top products
+        """
+        table = self.scan('products', ['name_key', 'quantity', 'amount'], tin=tin, object_code=object_code,
+                          date_from=date_from, date_to=date_to)
+        result = table.group_by('name_key').aggregate([('amount', 'sum'), ('quantity', 'sum'), ('amount', 'count')])
+        result = ReceiptAnalytics._rename(result, {'amount_sum': 'amount', 'quantity_sum': 'quantity',
+                                                   'amount_count': 'line_count'})
+        return result.sort_by([(by, 'descending'), ('name_key', 'ascending')]).slice(0, n).to_pandas()
+
+    @staticmethod
+    def _rename(table, names):
+        # Aggregation results are named '{column}_{aggregation}', the order of key columns depends on the Arrow version
+        return table.rename_columns([names.get(column, column) for column in table.column_names])
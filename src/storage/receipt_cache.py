@@ -0,0 +1,153 @@
+import glob
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from src.models.receipt import Receipt
+from src.props.application_properties_service import ApplicationPropertiesService
+
+
+class ReceiptCache:
+    """
+    Class for a persistent (SQLite) cache of mined receipts.
+    A fiscal code always maps to the same E-kassa receipt, so a receipt is
+    kept under (fiscal code, config hash); the config hash covers the loaded
+    properties, the OCR mode of the service and the source of the pipeline,
+    so any change of them makes the stored receipts unreachable (and
+    purge_stale_configs() deletes them).
+
+    Eviction: entries older than {max_age_seconds} are deleted, then the least
+    recently used ones above {max_entries}.
+
+    Methods:
+        get(fiscal_code, receipt_service) -> Receipt instance or None
+        put(fiscal_code, receipt_service, receipt)
+        invalidate(fiscal_code = None), purge_stale_configs(receipt_service), evict()
+        get_stats() -> entries, hits, misses, hit_rate
+    """
+    PIPELINE_SOURCE_PATTERNS = [os.path.join('receipt_processors', '*.py'), os.path.join('models', '*.py')]
+    _pipeline_source_hash = None
+
+    def __init__(self, path = os.path.join('logs', 'cache', 'receipts.sqlite3'),
+                 max_entries = 10000, max_age_seconds = 90 * 24 * 3600):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._config_hash_key, self._config_hash = None, None
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS receipts (
+                    fiscal_code TEXT NOT NULL,
+                    config_hash TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (fiscal_code, config_hash)
+                )''')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS receipts_accessed_at ON receipts (accessed_at)')
+
+    @staticmethod
+    def compute_pipeline_source_hash():
+        if ReceiptCache._pipeline_source_hash is None:
+            src_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            source_hash = hashlib.sha256()
+            for pattern in ReceiptCache.PIPELINE_SOURCE_PATTERNS:
+                for file_path in sorted(glob.glob(os.path.join(src_folder, pattern))):
+                    with open(file_path, 'rb') as file:
+                        source_hash.update(file.read())
+            ReceiptCache._pipeline_source_hash = source_hash.hexdigest()
+        return ReceiptCache._pipeline_source_hash
+
+    def compute_config_hash(self, receipt_service):
+        # Properties are hashed again only when another ApplicationProperties instance is loaded
+        key = (ApplicationPropertiesService.version, receipt_service.ocr_mode, receipt_service.is_numeric_second_pass_on)
+        if key != self._config_hash_key:
+            text = '|'.join([ApplicationPropertiesService.compute_properties_hash(),
+                             ReceiptCache.compute_pipeline_source_hash()] + [str(item) for item in key[1:]])
+            self._config_hash_key, self._config_hash = key, hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return self._config_hash
+
+    def get(self, fiscal_code, receipt_service):
+        config_hash = self.compute_config_hash(receipt_service)
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT format, data, created_at FROM receipts WHERE fiscal_code = ? AND config_hash = ?',
+                (fiscal_code, config_hash)).fetchone()
+            if row is None or time.time() - row[2] > self.max_age_seconds:
+                self.misses += 1
+                return None
+            with self._connection:
+                self._connection.execute('UPDATE receipts SET accessed_at = ? WHERE fiscal_code = ? AND config_hash = ?',
+                                         (time.time(), fiscal_code, config_hash))
+            self.hits += 1
+        data_format, data = row[0], row[1]
+        if data_format == 'msgpack':
+            return Receipt.from_msgpack(data)
+        return Receipt.from_json(data.decode('utf-8'))
+
+    def put(self, fiscal_code, receipt_service, receipt):
+        config_hash = self.compute_config_hash(receipt_service)
+        if msgpack is not None:
+            data_format, data = 'msgpack', receipt.to_msgpack()
+        else:
+            data_format, data = 'json', receipt.to_json().encode('utf-8')
+        now = time.time()
+        with self._lock:
+            with self._connection:
+                self._connection.execute('INSERT OR REPLACE INTO receipts VALUES (?, ?, ?, ?, ?, ?)',
+                                         (fiscal_code, config_hash, data_format, data, now, now))
+            self._evict()
+
+    def invalidate(self, fiscal_code = None):
+        with self._lock, self._connection:
+            if fiscal_code is None:
+                self._connection.execute('DELETE FROM receipts')
+            else:
+                self._connection.execute('DELETE FROM receipts WHERE fiscal_code = ?', (fiscal_code,))
+
+    def purge_stale_configs(self, receipt_service):
+        """
+        Deletes receipts mined with other properties/pipeline versions.
+        """
+        config_hash = self.compute_config_hash(receipt_service)
+        with self._lock, self._connection:
+            return self._connection.execute('DELETE FROM receipts WHERE config_hash != ?', (config_hash,)).rowcount
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        with self._connection:
+            self._connection.execute('DELETE FROM receipts WHERE created_at < ?', (time.time() - self.max_age_seconds,))
+            count = self._connection.execute('SELECT COUNT(*) FROM receipts').fetchone()[0]
+            if count > self.max_entries:
+                self._connection.execute('''
+                    DELETE FROM receipts WHERE rowid IN (
+                        SELECT rowid FROM receipts ORDER BY accessed_at LIMIT ?
+                    )''', (count - self.max_entries,))
+
+    def get_stats(self):
+        with self._lock:
+            entries = self._connection.execute('SELECT COUNT(*) FROM receipts').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,233 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from src.models.receipt import Receipt
+from src.models.receipt_general_info import ReceiptGeneralInfo
+from src.models.receipt_payment_info import ReceiptPaymentInfo
+from src.models.receipt_product_list import ReceiptProductList
+
+
+class ReceiptWarehouse:
+    """
+    Class for a local SQLite warehouse of mined receipts with normalized
+    tables (receipts: general info, payments, products) and indexes on
+    TIN, object code, date and product name.
+
+    Dates are stored as ISO 'YYYY-MM-DD' (receipts show 'DD.MM.YYYY'),
+    product names additionally as a search key (case folded, single spaces).
+
+    Methods:
+        ingest(receipts) -> number of ingested receipts (single transaction, replaces same fiscal codes)
+        get_receipt(fiscal_code) -> Receipt instance or None
+        find_receipts(tin, object_code, date_from, date_to, limit) -> list of receipt rows
+        get_spending(group_by, tin, object_code, date_from, date_to) -> list of spending rows
+        get_price_history(product_name, tin, is_prefix) -> list of price rows ordered by date
+        get_top_products(tin, date_from, date_to, limit) -> list of product rows by spending
+    """
+    SPENDING_GROUPS = {
+        'tin': 'r.tin',
+        'object_code': 'r.object_code',
+        'date': 'r.date',
+        'month': "substr(r.date, 1, 7)",
+    }
+
+    def __init__(self, path = os.path.join('logs', 'warehouse', 'receipts.sqlite3')):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA foreign_keys=ON')
+            self._connection.executescript('''
+                CREATE TABLE IF NOT EXISTS receipts (
+                    id INTEGER PRIMARY KEY,
+                    fiscal_code TEXT UNIQUE,
+                    object_name TEXT,
+                    object_address TEXT,
+                    object_code TEXT,
+                    tax_payer_name TEXT,
+                    tin TEXT,
+                    sale_receipt_num TEXT,
+                    cashier_name TEXT,
+                    date TEXT,
+                    time TEXT,
+                    ingested_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS payments (
+                    receipt_id INTEGER PRIMARY KEY REFERENCES receipts (id) ON DELETE CASCADE,
+                    total_amount REAL,
+                    tax_amount REAL,
+                    non_tax_amount REAL,
+                    cashless_payment_amount REAL,
+                    cash_payment_amount REAL,
+                    paid_cash_amount REAL,
+                    change_cash_amount REAL,
+                    bonus REAL,
+                    prepayment REAL,
+                    credit REAL
+                );
+                CREATE TABLE IF NOT EXISTS products (
+                    id INTEGER PRIMARY KEY,
+                    receipt_id INTEGER NOT NULL REFERENCES receipts (id) ON DELETE CASCADE,
+                    line_num INTEGER NOT NULL,
+                    name TEXT,
+                    name_key TEXT,
+                    quantity REAL,
+                    price REAL,
+                    amount REAL
+                );
+                CREATE INDEX IF NOT EXISTS receipts_tin_date ON receipts (tin, date);
+                CREATE INDEX IF NOT EXISTS receipts_object_code_date ON receipts (object_code, date);
+                CREATE INDEX IF NOT EXISTS receipts_date ON receipts (date);
+                CREATE INDEX IF NOT EXISTS products_name_key ON products (name_key);
+                CREATE INDEX IF NOT EXISTS products_receipt_id ON products (receipt_id);
+            ''')
+
+    @staticmethod
+    def normalize_date(date):
+        match = re.fullmatch(r'\s*(\d{1,2})[./-](\d{1,2})[./-](\d{4})\s*', str(date))
+        if match is None:
+            return None
+        day, month, year = match.groups()
+        return f'{year}-{int(month):02d}-{int(day):02d}'
+
+    @staticmethod
+    def normalize_product_name(name):
+        return ' '.join(str(name).split()).casefold()
+
+    def ingest(self, receipts):
+        """
+        Inserts the receipts in one transaction; a receipt with an already
+        ingested fiscal code replaces the stored one.
+
+        Args:
+            receipts: list of Receipt instances
+            ...
+
+        Returns:
+            return: number of ingested receipts
+        """
+        ingested_at = time.time()
+        with self._lock, self._connection:
+            cursor = self._connection.cursor()
+            for receipt in receipts:
+                fiscal_code = receipt.fiscal_code or None
+                if fiscal_code is not None:
+                    cursor.execute('DELETE FROM receipts WHERE fiscal_code = ?', (fiscal_code,))
+                general_info = receipt.general_info
+                cursor.execute('''
+                    INSERT INTO receipts (fiscal_code, object_name, object_address, object_code, tax_payer_name, tin,
+                                          sale_receipt_num, cashier_name, date, time, ingested_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', (
+                    fiscal_code, general_info.name, general_info.address, str(general_info.code),
+                    general_info.tax_payer_name, str(general_info.TIN), str(general_info.sale_receipt_num),
+                    general_info.cashier_name, ReceiptWarehouse.normalize_date(general_info.date), general_info.time,
+                    ingested_at))
+                receipt_id = cursor.lastrowid
+                cursor.execute('INSERT INTO payments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               (receipt_id,) + tuple(float(value) for value in receipt.payment_info.to_tuple()))
+                product_list = receipt.product_list
+                cursor.executemany('''
+                    INSERT INTO products (receipt_id, line_num, name, name_key, quantity, price, amount)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)''', [
+                    (receipt_id, i, name, ReceiptWarehouse.normalize_product_name(name), quantity, price, amount)
+                    for i, (name, quantity, price, amount) in enumerate(zip(
+                        product_list.names, product_list.quantities.tolist(),
+                        product_list.prices.tolist(), product_list.amounts.tolist()))])
+        return len(receipts)
+
+    def get_receipt(self, fiscal_code):
+        row = self._query('SELECT * FROM receipts r JOIN payments p ON p.receipt_id = r.id WHERE r.fiscal_code = ?',
+                          (fiscal_code,))
+        if len(row) == 0:
+            return None
+        row = row[0]
+        product_rows = self._query('SELECT name, quantity, price, amount FROM products WHERE receipt_id = ? ORDER BY line_num',
+                                   (row['id'],))
+        general_info = ReceiptGeneralInfo(
+            row['object_name'], row['object_address'], row['object_code'], row['tax_payer_name'], row['tin'],
+            row['sale_receipt_num'], row['cashier_name'], ReceiptWarehouse._format_date(row['date']), row['time'])
+        payment_info = ReceiptPaymentInfo(*[row[field] for field in ReceiptPaymentInfo.FIELDS])
+        product_list = ReceiptProductList.from_columns(
+            [product_row['name'] for product_row in product_rows], [product_row['quantity'] for product_row in product_rows],
+            [product_row['price'] for product_row in product_rows], [product_row['amount'] for product_row in product_rows])
+        return Receipt(general_info, product_list, payment_info, row['fiscal_code'])
+
+    def find_receipts(self, tin = None, object_code = None, date_from = None, date_to = None, limit = 1000):
+        where, parameters = ReceiptWarehouse._prepare_filters(tin, object_code, date_from, date_to)
+        return self._query(f'''
+            SELECT r.fiscal_code, r.object_name, r.object_code, r.tin, r.date, r.time, p.total_amount
+            FROM receipts r JOIN payments p ON p.receipt_id = r.id
+            {where} ORDER BY r.date, r.time LIMIT ?''', parameters + [limit])
+
+    def get_spending(self, group_by = 'month', tin = None, object_code = None, date_from = None, date_to = None):
+        """
+        Args:
+            group_by: tin, object_code, date, month
+            ...
+
+        Returns:
+            return: list of rows (key, receipt_count, total_amount) ordered by key
+        """
+        if group_by not in ReceiptWarehouse.SPENDING_GROUPS:
+            raise ValueError(f"group_by must be one of {list(ReceiptWarehouse.SPENDING_GROUPS)}")
+        where, parameters = ReceiptWarehouse._prepare_filters(tin, object_code, date_from, date_to)
+        key = ReceiptWarehouse.SPENDING_GROUPS[group_by]
+        return self._query(f'''
+            SELECT {key} AS key, COUNT(*) AS receipt_count, SUM(p.total_amount) AS total_amount
+            FROM receipts r JOIN payments p ON p.receipt_id = r.id
+            {where} GROUP BY {key} ORDER BY {key}''', parameters)
+
+    def get_price_history(self, product_name, tin = None, is_prefix = False):
+        name_key = ReceiptWarehouse.normalize_product_name(product_name)
+        if is_prefix:
+            # Range condition so that the name index is used
+            conditions, parameters = ['pr.name_key >= ?', 'pr.name_key < ?'], [name_key, name_key + '\U0010ffff']
+        else:
+            conditions, parameters = ['pr.name_key = ?'], [name_key]
+        if tin is not None:
+            conditions.append('r.tin = ?')
+            parameters.append(str(tin))
+        return self._query(f'''
+            SELECT r.date, r.time, r.tin, r.object_name, pr.name, pr.price, pr.quantity
+            FROM products pr JOIN receipts r ON r.id = pr.receipt_id
+            WHERE {' AND '.join(conditions)} ORDER BY r.date, r.time''', parameters)
+
+    def get_top_products(self, tin = None, date_from = None, date_to = None, limit = 20):
+        where, parameters = ReceiptWarehouse._prepare_filters(tin, None, date_from, date_to)
+        return self._query(f'''
+            SELECT pr.name_key, MIN(pr.name) AS name, COUNT(*) AS line_count, SUM(pr.quantity) AS quantity,
+                   SUM(pr.amount) AS total_amount, AVG(pr.price) AS average_price
+            FROM products pr JOIN receipts r ON r.id = pr.receipt_id
+            {where} GROUP BY pr.name_key ORDER BY total_amount DESC LIMIT ?''', parameters + [limit])
+
+    @staticmethod
+    def _prepare_filters(tin, object_code, date_from, date_to):
+        conditions, parameters = [], []
+        for condition, value in [('r.tin = ?', tin), ('r.object_code = ?', object_code),
+                                 ('r.date >= ?', date_from), ('r.date <= ?', date_to)]:
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(str(value))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return where, parameters
+
+    @staticmethod
+    def _format_date(date):
+        if date is None:
+            return None
+        year, month, day = date.split('-')
+        return f'{day}.{month}.{year}'
+
+    def _query(self, sql, parameters = ()):
+        with self._lock:
+            return [dict(row) for row in self._connection.execute(sql, parameters).fetchall()]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from src.storage.receipt_cache import ReceiptCache
+from src.tracer import Tracer
+
+
+class StageCache:
+    """
+    Class for a persistent (SQLite) cache of intermediate artifacts of the
+    pipeline stages (split geometry, OCR word tables), so that after a
+    change of properties only the stages reading them are recomputed.
+
+    An artifact is kept under a key of the stage name, its inputs (images
+    and data frames by content digest) and the subset of the properties
+    the stage reads, e.g. an OCR result is keyed by the crop pixels, OCR
+    config, language and field type: a changed margin gives other crops,
+    so only these are read again, while the unchanged crops are taken
+    from the cache. The pipeline source hash (see ReceiptCache) is part
+    of every key.
+    The compute time of an artifact is kept too and sent with the hit
+    events (attribute cost), so that the cost of a run can be estimated
+    as if nothing was cached. The file can be shared by worker processes.
+
+    Methods:
+        memoize(stage, inputs, properties, compute) -> cached or computed value
+        compute_key(stage, inputs, properties) -> key
+        get(stage, key) -> value or None, put(stage, key, value)
+        invalidate(stage = None), get_stats() -> entries, hits and misses per stage
+    """
+    EVICTION_INTERVAL = 1000
+    ACCESS_UPDATE_INTERVAL = 3600
+
+    def __init__(self, path = os.path.join('logs', 'cache', 'stages.sqlite3'), max_entries = 500000):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = {}
+        self.misses = {}
+        self._puts_since_eviction = 0
+        self._lock = threading.Lock()
+        # Waits for the writes of the other processes instead of failing
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    stage TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    cost REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (stage, key)
+                )''')
+            columns = [row[1] for row in self._connection.execute('PRAGMA table_info(artifacts)').fetchall()]
+            if 'cost' not in columns:
+                self._connection.execute('ALTER TABLE artifacts ADD COLUMN cost REAL NOT NULL DEFAULT 0')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS artifacts_accessed_at ON artifacts (accessed_at)')
+
+    def memoize(self, stage, inputs, properties, compute):
+        """
+        Args:
+            stage: stage name (e.g. split, ocr)
+            inputs: list of the stage inputs (numpy arrays, data frames, other values by repr)
+            properties: property objects (or values) read by the stage
+            compute: function computing the value if it is not cached
+
+        Returns:
+            return: cached or computed value
+        """
+        key = self.compute_key(stage, inputs, properties)
+        value, cost = self._get(stage, key)
+        if value is not None:
+            Tracer.event('stage_cache', kind=f'{stage}_hit', cost=cost)
+            return value
+        Tracer.event('stage_cache', kind=f'{stage}_miss')
+        start_time = time.perf_counter()
+        value = compute()
+        self.put(stage, key, value, cost=time.perf_counter() - start_time)
+        return value
+
+    @staticmethod
+    def compute_key(stage, inputs, properties = None):
+        key_hash = hashlib.sha256(stage.encode('utf-8'))
+        key_hash.update(ReceiptCache.compute_pipeline_source_hash().encode('utf-8'))
+        for item in inputs:
+            key_hash.update(StageCache._digest(item))
+        properties_text = json.dumps(properties, sort_keys=True, default=lambda obj: vars(obj))
+        key_hash.update(properties_text.encode('utf-8'))
+        return key_hash.hexdigest()
+
+    @staticmethod
+    def _digest(item):
+        if isinstance(item, np.ndarray):
+            item = np.ascontiguousarray(item)
+            return hashlib.sha256(f'{item.shape}{item.dtype}'.encode('utf-8') + item.data).digest()
+        if isinstance(item, pd.DataFrame):
+            values = pd.util.hash_pandas_object(item, index=True).values
+            return hashlib.sha256(str(list(item.columns)).encode('utf-8') + values.tobytes()).digest()
+        return hashlib.sha256(repr(item).encode('utf-8')).digest()
+
+    def get(self, stage, key):
+        return self._get(stage, key)[0]
+
+    def _get(self, stage, key):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT format, data, accessed_at, cost FROM artifacts WHERE stage = ? AND key = ?', (stage, key)).fetchone()
+            if row is None:
+                self.misses[stage] = self.misses.get(stage, 0) + 1
+                return None, None
+            # Access time is only needed for eviction, it is not written on each hit
+            if now - row[2] > StageCache.ACCESS_UPDATE_INTERVAL:
+                with self._connection:
+                    self._connection.execute('UPDATE artifacts SET accessed_at = ? WHERE stage = ? AND key = ?',
+                                             (now, stage, key))
+            self.hits[stage] = self.hits.get(stage, 0) + 1
+        data_format, data = row[0], row[1]
+        if data_format == 'msgpack':
+            return StageCache._from_plain(msgpack.unpackb(data, strict_map_key=False)), row[3]
+        return StageCache._from_plain(json.loads(data.decode('utf-8'))), row[3]
+
+    def put(self, stage, key, value, cost = 0):
+        value = StageCache._to_plain(value)
+        if msgpack is not None:
+            data_format, data = 'msgpack', msgpack.packb(value)
+        else:
+            data_format, data = 'json', json.dumps(value).encode('utf-8')
+        now = time.time()
+        with self._lock:
+            with self._connection:
+                self._connection.execute('INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                         (stage, key, data_format, data, now, now, cost))
+            self._puts_since_eviction += 1
+            if self._puts_since_eviction >= StageCache.EVICTION_INTERVAL:
+                self._evict()
+
+    @staticmethod
+    def _to_plain(value):
+        if isinstance(value, pd.DataFrame):
+            return {
+                '__dataframe__': True,
+                'index': value.index.tolist(),
+                'columns': {str(column): value[column].tolist() for column in value.columns},
+                'dtypes': {str(column): str(dtype) for column, dtype in value.dtypes.items()},
+            }
+        if isinstance(value, dict):
+            return {key: StageCache._to_plain(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [StageCache._to_plain(item) for item in value]
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    @staticmethod
+    def _from_plain(value):
+        if isinstance(value, dict):
+            if value.get('__dataframe__'):
+                return pd.DataFrame(value['columns'], index=value['index']).astype(value['dtypes'])
+            return {key: StageCache._from_plain(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [StageCache._from_plain(item) for item in value]
+        return value
+
+    def invalidate(self, stage = None):
+        with self._lock, self._connection:
+            if stage is None:
+                self._connection.execute('DELETE FROM artifacts')
+            else:
+                self._connection.execute('DELETE FROM artifacts WHERE stage = ?', (stage,))
+
+    def _evict(self):
+        self._puts_since_eviction = 0
+        with self._connection:
+            count = self._connection.execute('SELECT COUNT(*) FROM artifacts').fetchone()[0]
+            if count > self.max_entries:
+                self._connection.execute('''
+                    DELETE FROM artifacts WHERE rowid IN (
+                        SELECT rowid FROM artifacts ORDER BY accessed_at LIMIT ?
+                    )''', (count - self.max_entries,))
+
+    def get_stats(self):
+        with self._lock:
+            entries = dict(self._connection.execute('SELECT stage, COUNT(*) FROM artifacts GROUP BY stage').fetchall())
+        return {'entries': entries, 'hits': dict(self.hits), 'misses': dict(self.misses)}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
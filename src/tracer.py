@@ -0,0 +1,316 @@
+import functools
+import json
+import os
+import threading
+import time
+
+
+class Span:
+    """
+    Class for a named, timed part of the receipt processing.
+    OCR calls, pixels sent to OCR and events (fallbacks, retries)
+    of the nested spans are added to their parents.
+    """
+    __slots__ = ('name', 'attributes', 'parent', 'thread_id', 'start_time', 'start_cpu_time',
+                 'wall_time', 'cpu_time', 'ocr_calls', 'ocr_pixels', 'events', 'fiscal_code')
+
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.thread_id = threading.get_ident()
+        self.start_time = time.perf_counter()
+        self.start_cpu_time = time.thread_time()
+        self.wall_time = None
+        self.cpu_time = None
+        self.ocr_calls = 0
+        self.ocr_pixels = 0
+        self.events = {}
+        # Set on the mine_receipt span (Tracer.set_fiscal_code), inherited by the nested spans of the thread
+        self.fiscal_code = parent.fiscal_code if parent is not None else None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'parent': self.parent.name if self.parent is not None else None,
+            'fiscal_code': self.fiscal_code,
+            'thread_id': self.thread_id,
+            'start_time': self.start_time,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'ocr_calls': self.ocr_calls,
+            'ocr_pixels': self.ocr_pixels,
+            'events': self.events,
+            'attributes': self.attributes,
+        }
+
+
+class _NullSpanContext:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class _SpanContext:
+    def __init__(self, name, attributes, ocr_pixels = None):
+        self._name = name
+        self._attributes = attributes
+        self._ocr_pixels = ocr_pixels
+        self._span = None
+
+    def __enter__(self):
+        stack = Tracer._get_stack()
+        self._span = Span(self._name, self._attributes, stack[-1] if stack else None)
+        if self._ocr_pixels is not None:
+            self._span.ocr_calls = 1
+            self._span.ocr_pixels = self._ocr_pixels
+        stack.append(self._span)
+        for sink in Tracer.sinks:
+            sink.on_span_start(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        span = self._span
+        span.wall_time = time.perf_counter() - span.start_time
+        span.cpu_time = time.thread_time() - span.start_cpu_time
+        if exc_type is not None:
+            span.attributes['error'] = exc_type.__name__
+        Tracer._get_stack().pop()
+
+        parent = span.parent
+        if parent is not None:
+            parent.ocr_calls += span.ocr_calls
+            parent.ocr_pixels += span.ocr_pixels
+            for event_name, count in span.events.items():
+                parent.events[event_name] = parent.events.get(event_name, 0) + count
+        for sink in Tracer.sinks:
+            sink.on_span(span)
+        return False
+
+
+class Tracer:
+    """
+    Class for low-overhead instrumentation of the receipt processing.
+    Spans are recorded only when at least one sink is added,
+    otherwise span()/traced()/event() cost a single check.
+
+    Sinks (JsonlTraceSink, InMemoryTraceAggregator, ChromeTraceSink) implement
+    on_span_start(span), on_span(span), on_event(name, attributes, span), close().
+
+    Methods:
+        add_sink(sink), remove_sink(sink), close_sinks()
+        span(name, **attributes) -> context manager of a named span
+        traced(name) -> decorator wrapping a function into a span
+        ocr_span(pixel_count, ocr_config, lang) -> span of an OCR call
+        event(name, **attributes) -> records a fallback/retry like event
+        set_fiscal_code(fiscal_code) -> sets the fiscal code of the current span (and of the spans opened in it)
+    """
+    sinks = []
+    _NULL_SPAN_CONTEXT = _NullSpanContext()
+    _local = threading.local()
+
+    @staticmethod
+    def add_sink(sink):
+        Tracer.sinks = Tracer.sinks + [sink]
+        return sink
+
+    @staticmethod
+    def remove_sink(sink):
+        Tracer.sinks = [item for item in Tracer.sinks if item is not sink]
+
+    @staticmethod
+    def close_sinks():
+        sinks, Tracer.sinks = Tracer.sinks, []
+        for sink in sinks:
+            sink.close()
+
+    @staticmethod
+    def span(name, **attributes):
+        if not Tracer.sinks:
+            return Tracer._NULL_SPAN_CONTEXT
+        return _SpanContext(name, attributes)
+
+    @staticmethod
+    def traced(name):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not Tracer.sinks:
+                    return function(*args, **kwargs)
+                with _SpanContext(name, {}):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def ocr_span(pixel_count, ocr_config, lang):
+        if not Tracer.sinks:
+            return Tracer._NULL_SPAN_CONTEXT
+        return _SpanContext('ocr', {'config': ocr_config, 'lang': lang}, ocr_pixels = int(pixel_count))
+
+    @staticmethod
+    def event(name, **attributes):
+        if not Tracer.sinks:
+            return
+        stack = Tracer._get_stack()
+        span = stack[-1] if stack else None
+        if span is not None:
+            span.events[name] = span.events.get(name, 0) + 1
+        for sink in Tracer.sinks:
+            sink.on_event(name, attributes, span)
+
+    @staticmethod
+    def set_fiscal_code(fiscal_code):
+        if not Tracer.sinks:
+            return
+        stack = Tracer._get_stack()
+        if stack:
+            stack[-1].fiscal_code = fiscal_code
+
+    @staticmethod
+    def _get_stack():
+        stack = getattr(Tracer._local, 'stack', None)
+        if stack is None:
+            stack = Tracer._local.stack = []
+        return stack
+
+
+class JsonlTraceSink:
+    """
+    Writes each span and event as a JSON line.
+    """
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def on_span_start(self, span):
+        pass
+
+    def on_span(self, span):
+        record = span.to_dict()
+        record['type'] = 'span'
+        self._write(record)
+
+    def on_event(self, name, attributes, span):
+        self._write({
+            'type': 'event',
+            'name': name,
+            'span': span.name if span is not None else None,
+            'time': time.perf_counter(),
+            'attributes': attributes,
+        })
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _write(self, record):
+        line = json.dumps(record, default=str, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+
+
+class InMemoryTraceAggregator:
+    """
+    Aggregates spans by name (count, wall/CPU time, OCR calls and pixels),
+    OCR calls by (config, lang) and events by name (count, sum of the cost
+    attribute if the events have it).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.spans = {}
+            self.ocr_calls = {}
+            self.events = {}
+            self.event_costs = {}
+
+    def on_span_start(self, span):
+        pass
+
+    def on_span(self, span):
+        with self._lock:
+            totals = self.spans.setdefault(span.name, {'count': 0, 'wall_time': 0.0, 'cpu_time': 0.0,
+                                                        'ocr_calls': 0, 'ocr_pixels': 0})
+            totals['count'] += 1
+            totals['wall_time'] += span.wall_time
+            totals['cpu_time'] += span.cpu_time
+            totals['ocr_calls'] += span.ocr_calls
+            totals['ocr_pixels'] += span.ocr_pixels
+            if span.name == 'ocr':
+                key = (span.attributes.get('config'), span.attributes.get('lang'))
+                totals = self.ocr_calls.setdefault(key, {'count': 0, 'wall_time': 0.0, 'pixels': 0})
+                totals['count'] += 1
+                totals['wall_time'] += span.wall_time
+                totals['pixels'] += span.ocr_pixels
+
+    def on_event(self, name, attributes, span):
+        key = (name, attributes.get('kind'))
+        with self._lock:
+            self.events[key] = self.events.get(key, 0) + 1
+            if attributes.get('cost') is not None:
+                self.event_costs[key] = self.event_costs.get(key, 0.0) + attributes['cost']
+
+    def close(self):
+        pass
+
+    def get_span_totals(self, name):
+        return self.spans.get(name, {'count': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'ocr_calls': 0, 'ocr_pixels': 0})
+
+    def get_event_cost(self, name, kind = None):
+        return self.event_costs.get((name, kind), 0.0)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'spans': {name: dict(totals) for name, totals in self.spans.items()},
+                'ocr_calls': [{'config': config, 'lang': lang, **totals}
+                              for (config, lang), totals in self.ocr_calls.items()],
+                'events': [{'name': name, 'kind': kind, 'count': count,
+                            **({'cost': self.event_costs[(name, kind)]} if (name, kind) in self.event_costs else {})}
+                           for (name, kind), count in self.events.items()],
+            }
+
+
+class ChromeTraceSink:
+    """
+    Collects spans and events and writes them on close in Chrome trace
+    event format (chrome://tracing, Perfetto).
+    """
+    def __init__(self, path):
+        self.path = path
+        self._trace_events = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def on_span_start(self, span):
+        pass
+
+    def on_span(self, span):
+        args = {key: value for key, value in span.attributes.items()}
+        args.update({'fiscal_code': span.fiscal_code, 'cpu_time': span.cpu_time,
+                     'ocr_calls': span.ocr_calls, 'ocr_pixels': span.ocr_pixels})
+        with self._lock:
+            self._trace_events.append({
+                'name': span.name, 'ph': 'X', 'pid': self._pid, 'tid': span.thread_id,
+                'ts': span.start_time * 1e6, 'dur': span.wall_time * 1e6, 'args': args,
+            })
+
+    def on_event(self, name, attributes, span):
+        with self._lock:
+            self._trace_events.append({
+                'name': name, 'ph': 'i', 's': 't', 'pid': self._pid, 'tid': threading.get_ident(),
+                'ts': time.perf_counter() * 1e6, 'args': attributes,
+            })
+
+    def close(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._lock:
+            with open(self.path, 'w', encoding='utf-8') as file:
+                json.dump({'traceEvents': self._trace_events}, file, default=str)
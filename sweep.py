@@ -0,0 +1,52 @@
+import argparse
+import os
+
+import pytesseract
+
+from src.benchmark.parameter_sweep import ParameterSweep
+from src.benchmark.receipt_accuracy import ReceiptAccuracy
+from src.receipt_processors.receipt_service import ReceiptService
+
+if os.name == 'nt':
+    pytesseract.pytesseract.tesseract_cmd = 'C:\\Program Files\\Tesseract-OCR\\tesseract.exe'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Evaluates candidate properties over the stored receipts in parallel and ranks them by accuracy and OCR time.')
+    parser.add_argument('--param', action='append', default=[], metavar='PATH=VALUES',
+                        help="swept property, e.g. margin_properties.product_line_margin=2:5 or "
+                             "splitting_properties.receipt_logical_splitting_property.threshold_scale=0.25,0.3,0.35")
+    parser.add_argument('--strategy', choices=[ParameterSweep.STRATEGY_GRID, ParameterSweep.STRATEGY_RANDOM],
+                        default=ParameterSweep.STRATEGY_GRID)
+    parser.add_argument('--samples', type=int, default=None, help='number of sampled combinations (random strategy)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: CPU count - 1)')
+    parser.add_argument('--chunk-size', type=int, default=5, help='receipts per worker task')
+    parser.add_argument('--limit', type=int, default=None, help='number of receipts to evaluate')
+    parser.add_argument('--single-pass', action='store_true', help='use single-pass full receipt OCR mode')
+    parser.add_argument('--numeric-second-pass', action='store_true',
+                        help='read numeric columns again with digit whitelist (single-pass mode)')
+    parser.add_argument('--receipts-dir', default=os.path.join('logs', 'receipts'))
+    parser.add_argument('--references-dir', default=ReceiptAccuracy.REFERENCES_FOLDER,
+                        help='hand-checked receipt_*.log references (never written by the pipeline)')
+    parser.add_argument('--stage-cache', default=os.path.join('logs', 'cache', 'stages.sqlite3'))
+    parser.add_argument('--output-dir', default=os.path.join('logs', 'sweeps'))
+    parser.add_argument('--top', type=int, default=10, help='number of candidates to print')
+    args = parser.parse_args()
+
+    parameters = [ParameterSweep.parse_parameter(text) for text in args.param]
+    candidates = ParameterSweep.prepare_candidates(parameters, args.strategy, args.samples, args.seed)
+    corpus = ReceiptAccuracy.load_corpus(args.receipts_dir, args.references_dir, limit=args.limit)
+    print(f'{len(candidates)} candidates x {len(corpus)} receipts')
+
+    ocr_mode = ReceiptService.OCR_MODE_SINGLE_PASS if args.single_pass else ReceiptService.OCR_MODE_CROP_PER_FIELD
+    parameter_sweep = ParameterSweep(ocr_mode=ocr_mode, is_numeric_second_pass_on=args.numeric_second_pass,
+                                     stage_cache_path=args.stage_cache, workers=args.workers, chunk_size=args.chunk_size)
+    results = parameter_sweep.run(candidates, corpus)
+    ParameterSweep.print_ranking(results, args.top)
+    print(f'Results: {parameter_sweep.export_results(results, args.output_dir)}')
+
+
+if __name__ == '__main__':
+    main()